@@ -0,0 +1,101 @@
+"""Open the first page of every admin list against a real database.
+
+Seeds one active user, one banned user and one pending report, then renders
+page one of each ADMIN_LISTS entry from its start cursor and then follows
+the Next and Prev cursors in both directions, the way the admin panel does.
+Parameter type errors (e.g. a start cursor that doesn't fit the id column)
+only show up here, not at import time.
+
+    BENCH_DATABASE_URL=postgresql://localhost/au_dating_bench python benchmarks/admin_lists.py
+
+Exits non-zero if a list fails to load. Use a scratch database: it writes
+and deletes users and reports with ids from 60,000,000.
+"""
+import asyncio
+import os
+import sys
+
+import asyncpg
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+if not BENCH_DATABASE_URL:
+    print("❌ ERROR: BENCH_DATABASE_URL environment variable is required!")
+    sys.exit(1)
+
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", BENCH_DATABASE_URL)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot  # noqa: E402
+import queries  # noqa: E402
+
+FIRST_USER_ID = 60_000_000
+SEARCH_TERM = "Listcheck"
+
+
+class Context:
+    """The slice of CallbackContext render_admin_list reads"""
+
+    def __init__(self):
+        self.user_data = {'admin_search_term': SEARCH_TERM}
+
+
+async def clear(conn):
+    await conn.execute("DELETE FROM reports WHERE reporter_id >= $1 OR reported_id >= $1", FIRST_USER_ID)
+    await conn.execute("DELETE FROM user_stats WHERE telegram_id >= $1", FIRST_USER_ID)
+    await conn.execute("DELETE FROM users WHERE telegram_id >= $1", FIRST_USER_ID)
+
+
+async def seed(conn):
+    await clear(conn)
+    await conn.executemany("""
+        INSERT INTO users (telegram_id, name, gender, campus, is_banned)
+        VALUES ($1, $2, 'Female', 'Main Campus', $3)
+    """, [(FIRST_USER_ID, f"{SEARCH_TERM} Active", False), (FIRST_USER_ID + 1, f"{SEARCH_TERM} Banned", True)])
+    await conn.execute(queries.INSERT_REPORT, FIRST_USER_ID, FIRST_USER_ID + 1, "admin list check")
+
+
+async def check_list(list_name, context):
+    """Page one, then Next and Prev from its edge rows, whether or not they exist"""
+    spec = bot.ADMIN_LISTS[list_name]
+    text, _ = await bot.render_admin_list(list_name, context)
+    rows, _, _ = await bot.fetch_keyset_page(
+        list_name, 'n', spec.get('start', bot.KEYSET_START), spec['args'](context) if 'args' in spec else ())
+    if rows:
+        first_key, second_key = spec['key']
+        for direction, row in (('n', rows[-1]), ('p', rows[0])):
+            data = bot.encode_cursor(list_name, direction, 2, row[first_key], row[second_key])
+            _, _, page, cursor = bot.decode_cursor(data)
+            await bot.render_admin_list(list_name, context, direction, page, cursor)
+    return len(rows), text.splitlines()[0]
+
+
+async def main():
+    bot.db_pool = await asyncpg.create_pool(dsn=BENCH_DATABASE_URL, min_size=1, max_size=2)
+    failures = []
+    try:
+        await bot.create_tables()
+        await bot.run_migrations()
+        async with bot.db_pool.acquire() as conn:
+            await seed(conn)
+        context = Context()
+        print("=" * 50)
+        for list_name in bot.ADMIN_LISTS:
+            try:
+                count, heading = await check_list(list_name, context)
+                print(f"✅ {list_name}: {count} rows on page one ({heading})")
+            except Exception as e:
+                failures.append(list_name)
+                print(f"❌ {list_name}: {type(e).__name__}: {e}")
+        print("=" * 50)
+    finally:
+        async with bot.db_pool.acquire() as conn:
+            await clear(conn)
+        await bot.db_pool.close()
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
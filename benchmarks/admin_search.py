@@ -0,0 +1,110 @@
+"""Admin search latency on a large seeded users table.
+
+Seeds BENCH_USERS synthetic users (500k by default), applies the schema
+migrations so the pg_trgm GIN indexes exist, then times the first results
+page of the ranked admin search for username prefixes, name substrings and
+misspelled names. Prints p50/p95 per term and the plan's top scan node.
+
+    BENCH_DATABASE_URL=postgresql://localhost/au_dating_bench python benchmarks/admin_search.py
+
+Use a scratch database: it writes and deletes users with ids from 40,000,000.
+"""
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+import asyncpg
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+if not BENCH_DATABASE_URL:
+    print("❌ ERROR: BENCH_DATABASE_URL environment variable is required!")
+    sys.exit(1)
+
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", BENCH_DATABASE_URL)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot  # noqa: E402
+import queries  # noqa: E402
+
+USERS = int(os.getenv("BENCH_USERS", "500000"))
+RUNS = int(os.getenv("BENCH_RUNS", "50"))
+FIRST_USER_ID = 40_000_000
+
+FIRST_NAMES = ["Abebe", "Almaz", "Bethlehem", "Biruk", "Dawit", "Eden", "Feven", "Hana", "Kidus", "Liya",
+               "Meron", "Mikias", "Nahom", "Ruth", "Samuel", "Selam", "Tsion", "Yonas", "Zelalem", "Mariam"]
+LAST_NAMES = ["Tesfaye", "Bekele", "Girma", "Haile", "Kebede", "Mengistu", "Tadesse", "Wolde", "Alemu", "Desta"]
+
+TERMS = [
+    ("username prefix", "@kidus12"),
+    ("username substring", "tsion4"),
+    ("name substring", "Mengis"),
+    ("full name", "Hana Girma"),
+    ("misspelled name", "Zelalm Tesfay"),
+    ("no match", "qqxz"),
+]
+
+
+def seed_rows():
+    for i in range(USERS):
+        first = random.choice(FIRST_NAMES)
+        last = random.choice(LAST_NAMES)
+        username = f"{first.lower()}{random.randrange(100000)}" if random.random() < 0.8 else None
+        yield (FIRST_USER_ID + i, username, f"{first} {last}", random.choice(["Male", "Female"]), "Main Campus")
+
+
+async def seed(conn):
+    await conn.execute("DELETE FROM users WHERE telegram_id >= $1", FIRST_USER_ID)
+    started = time.perf_counter()
+    await conn.copy_records_to_table(
+        "users", records=seed_rows(),
+        columns=["telegram_id", "username", "name", "gender", "campus"],
+    )
+    await conn.execute("ANALYZE users")
+    print(f"🌱 Seeded {USERS} users in {time.perf_counter() - started:.1f}s")
+
+
+async def time_search(conn, term):
+    args = bot.search_args(term)
+    size = bot.ADMIN_LISTS['search']['size'] + 1
+    timings = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        rows = await conn.fetch(queries.SEARCH_PAGE_NEXT, *bot.RANK_START, size, *args)
+        timings.append((time.perf_counter() - started) * 1000)
+    plan = await conn.fetch(f"EXPLAIN {queries.SEARCH_PAGE_NEXT}", *bot.RANK_START, size, *args)
+    scans = [r[0].strip().lstrip("-> ").split("  ")[0] for r in plan if "Scan" in r[0]]
+    timings.sort()
+    return rows, statistics.median(timings), timings[int(len(timings) * 0.95) - 1], scans
+
+
+async def main():
+    random.seed(int(os.getenv("BENCH_SEED", "42")))
+    bot.db_pool = await asyncpg.create_pool(dsn=BENCH_DATABASE_URL, min_size=1, max_size=2)
+    try:
+        await bot.create_tables()
+        await bot.run_migrations()
+        async with bot.db_pool.acquire() as conn:
+            await seed(conn)
+            print("=" * 50)
+            print(f"🔍 First page of admin search, {RUNS} runs per term")
+            print("=" * 50)
+            for label, term in TERMS:
+                rows, p50, p95, scans = await time_search(conn, term)
+                top = rows[0]['name'] if rows else "-"
+                print(f"▶ {label}: {term!r}")
+                print(f"   p50 {p50:.2f}ms  p95 {p95:.2f}ms  ({len(rows)} rows, top: {top})")
+                print(f"   plan: {', '.join(scans)}")
+            print("=" * 50)
+    finally:
+        async with bot.db_pool.acquire() as conn:
+            await conn.execute("DELETE FROM users WHERE telegram_id >= $1", FIRST_USER_ID)
+        await bot.db_pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
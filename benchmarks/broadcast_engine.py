@@ -0,0 +1,81 @@
+"""Drive the broadcast engine against the local fake Bot API.
+
+Sends one text broadcast to BENCH_RECIPIENTS fake chats while the fake server
+enforces Telegram's global rate limit and a slice of recipients have blocked
+the bot, then reports throughput, 429s seen and recipients pruned.
+
+    python benchmarks/broadcast_engine.py
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", "postgresql://unused")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+RECIPIENTS = int(os.getenv("BENCH_RECIPIENTS", "600"))
+GLOBAL_LIMIT = int(os.getenv("BENCH_GLOBAL_LIMIT", "30"))
+BLOCKED_EVERY = int(os.getenv("BENCH_BLOCKED_EVERY", "50"))
+
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+
+
+async def recipients():
+    for chat_id in range(1, RECIPIENTS + 1):
+        yield chat_id
+
+
+async def main():
+    blocked = {i for i in range(1, RECIPIENTS + 1) if i % BLOCKED_EVERY == 0}
+    api = FakeBotAPI(global_limit=GLOBAL_LIMIT, blocked=blocked)
+    base_url = await api.start()
+
+    fake_bot = Bot(
+        bot.BOT_TOKEN,
+        base_url=base_url,
+        request=HTTPXRequest(connection_pool_size=bot.BROADCAST_WORKERS * 2),
+    )
+    await fake_bot.initialize()
+
+    payload = {'type': "text", 'text': bot.BROADCAST_HEADER + "Benchmark broadcast"}
+    stats = {'sent': 0, 'failed': 0, 'blocked': 0}
+
+    started = time.monotonic()
+    try:
+        await bot.deliver_broadcast(fake_bot, payload, recipients(), stats)
+    finally:
+        elapsed = time.monotonic() - started
+        await fake_bot.shutdown()
+        await api.stop()
+
+    sends = sorted(c["time"] for c in api.sent("sendMessage"))
+    peak = max(
+        (sum(1 for t in sends[i:] if t - start < 1) for i, start in enumerate(sends)),
+        default=0,
+    )
+
+    print("=" * 50)
+    print(f"📤 Recipients:        {RECIPIENTS}")
+    print(f"✅ Sent:              {stats['sent']}")
+    print(f"🚫 Blocked (pruned):  {stats['blocked']} (expected {len(blocked)})")
+    print(f"❌ Failed:            {stats['failed']}")
+    print(f"⏳ 429s from server:  {api.rejected_flood}")
+    print(f"⏱️ Elapsed:           {elapsed:.1f}s")
+    print(f"📈 Throughput:        {(stats['sent'] + stats['blocked']) / elapsed:.1f} msg/s")
+    print(f"📊 Peak 1s window:    {peak} msg (limit {GLOBAL_LIMIT})")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+"""Memory and selection speed of the in-process candidate index.
+
+Builds a CandidateIndex of BENCH_USERS synthetic profiles with
+BENCH_LIKES likes each, then reports the bytes held by its arrays, the
+total Python allocations measured by tracemalloc, and the mean time of a
+candidates() call. No database needed.
+
+    python benchmarks/candidate_index.py
+"""
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from candidate_index import IN_CHAT, BANNED, CandidateIndex  # noqa: E402
+
+USERS = int(os.getenv("BENCH_USERS", "100000"))
+LIKES = int(os.getenv("BENCH_LIKES", "50"))
+CALLS = int(os.getenv("BENCH_CALLS", "1000"))
+BATCH = int(os.getenv("CANDIDATE_BATCH_SIZE", "200"))
+CAMPUSES = ("Main Campus", "Sefere Selam", "Arat Kilo", "Amist Kilo", "Lideta")
+
+
+def build():
+    index = CandidateIndex()
+    for telegram_id in range(1, USERS + 1):
+        index.upsert(
+            telegram_id,
+            random.choice(("Male", "Female")),
+            random.choice(CAMPUSES),
+            banned=random.random() < 0.01,
+            in_chat=random.random() < 0.05,
+        )
+        index.set_liked(telegram_id, random.sample(range(1, USERS + 1), LIKES))
+    return index
+
+
+def main():
+    random.seed(int(os.getenv("BENCH_SEED", "42")))
+
+    started = time.perf_counter()
+    build()
+    build_time = time.perf_counter() - started
+
+    # Build again under tracemalloc, which slows allocation down a lot
+    random.seed(int(os.getenv("BENCH_SEED", "42")))
+    tracemalloc.start()
+    index = build()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    profile_bytes, liked_bytes = index.nbytes()
+    users = random.choices(range(1, USERS + 1), k=CALLS)
+    started = time.perf_counter()
+    for user_id in users:
+        index.candidates(user_id, ["Male", "Female"], BATCH)
+    select_time = (time.perf_counter() - started) / CALLS
+
+    flagged = sum(1 for f in index.flags[:len(index)] if f & (BANNED | IN_CHAT))
+    print("=" * 50)
+    print(f"👥 Profiles:              {len(index)} ({flagged} banned or in chat)")
+    print(f"❤️ Likes per user:        {LIKES}")
+    print(f"🧮 Profile arrays:        {profile_bytes / 1e6:.2f} MB ({profile_bytes / len(index):.0f} B/user)")
+    print(f"🧮 Liked arrays (data):   {liked_bytes / 1e6:.2f} MB")
+    print(f"💾 Total allocated:       {allocated / 1e6:.2f} MB ({allocated / len(index):.0f} B/user)")
+    print(f"🏗️ Build time:            {build_time:.2f}s")
+    print(f"⏱️ candidates() per call: {select_time * 1000:.3f}ms (batch {BATCH})")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()
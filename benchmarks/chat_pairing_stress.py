@@ -0,0 +1,177 @@
+"""Concurrency stress test for the chat pairing statements.
+
+Seeds BENCH_USERS users, then fires BENCH_OPS start_chat / accept / stop /
+unreachable-partner operations at once through bot.run_chat_statement, with
+the LISTEN connection running the way a replica does. Afterwards it checks:
+
+  * every active_chats row has its mirror row and nobody chats with themselves
+  * the in-memory chat routes match active_chats once notifications drain
+  * bot_stats.active_chats moved by exactly the change in active_chats rows
+
+    BENCH_DATABASE_URL=postgresql://localhost/au_dating_bench python benchmarks/chat_pairing_stress.py
+
+Exits non-zero if an invariant is broken. Use a scratch database: it writes
+and deletes users, chats, chat requests and outbox rows with ids from
+50,000,000.
+"""
+import asyncio
+import collections
+import os
+import random
+import sys
+import time
+
+import asyncpg
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+if not BENCH_DATABASE_URL:
+    print("❌ ERROR: BENCH_DATABASE_URL environment variable is required!")
+    sys.exit(1)
+
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", BENCH_DATABASE_URL)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot  # noqa: E402
+import queries  # noqa: E402
+
+USERS = int(os.getenv("BENCH_USERS", "200"))
+OPS = int(os.getenv("BENCH_OPS", "5000"))
+POOL_SIZE = int(os.getenv("BENCH_POOL_SIZE", "20"))
+FIRST_USER_ID = 50_000_000
+USER_IDS = list(range(FIRST_USER_ID, FIRST_USER_ID + USERS))
+
+
+async def clear(conn):
+    await conn.execute("DELETE FROM active_chats WHERE user_id >= $1 OR partner_id >= $1", FIRST_USER_ID)
+    await conn.execute("DELETE FROM chat_route_versions WHERE user_id >= $1", FIRST_USER_ID)
+    await conn.execute("DELETE FROM chat_requests WHERE requester_id >= $1 OR requested_id >= $1", FIRST_USER_ID)
+    await conn.execute("DELETE FROM outbox WHERE chat_id >= $1", FIRST_USER_ID)
+    await conn.execute("DELETE FROM users WHERE telegram_id >= $1", FIRST_USER_ID)
+
+
+async def seed(conn):
+    await clear(conn)
+    await conn.executemany("""
+        INSERT INTO users (telegram_id, name, gender, campus)
+        VALUES ($1, $2, $3, 'Main Campus')
+    """, [(u, f"Stress {u}", "Male" if u % 2 else "Female") for u in USER_IDS])
+
+
+async def chat_counts(conn):
+    rows = await conn.fetchval(
+        "SELECT COUNT(*) FROM active_chats WHERE user_id >= $1 OR partner_id >= $1", FIRST_USER_ID)
+    total = await conn.fetchval("SELECT COUNT(*) FROM active_chats")
+    stat = await conn.fetchval("SELECT value FROM bot_stats WHERE name = 'active_chats'") or 0
+    return rows, total, stat
+
+
+async def operation(outcomes):
+    a, b = random.sample(USER_IDS, 2)
+    kind = random.choices(["start", "accept", "stop", "unreachable"], weights=[5, 2, 3, 1])[0]
+    try:
+        if kind == "start":
+            row = await bot.run_chat_statement(queries.START_CHAT, a, b)
+            kind = f"start: {row['outcome']}"
+        elif kind == "accept":
+            async with bot.db_pool.acquire() as conn:
+                request_id = await conn.fetchval(
+                    "SELECT id FROM chat_requests WHERE requested_id = $1 AND status = 'pending' LIMIT 1", a)
+            if request_id is None:
+                kind = "accept: no request"
+            else:
+                row = await bot.run_chat_statement(queries.ACCEPT_CHAT_REQUEST, request_id)
+                kind = "accept: paired" if row else "accept: already taken"
+        elif kind == "stop":
+            await bot.run_chat_statement(queries.END_CHATS, [a], bot.CHAT_ENDED_NOTICE)
+        else:
+            await bot.run_chat_statement(queries.END_CHATS, [a, b], None)
+    except Exception as e:
+        kind = f"error: {type(e).__name__}"
+    outcomes[kind] += 1
+
+
+async def wait_for_notifications(settle=0.5, timeout=30):
+    """Wait until no chat route notifications have arrived for settle seconds"""
+    deadline = time.monotonic() + timeout
+    seen = -1
+    while time.monotonic() < deadline and seen != bot.chat_router_stats['notifications']:
+        seen = bot.chat_router_stats['notifications']
+        await asyncio.sleep(settle)
+
+
+async def main():
+    random.seed(int(os.getenv("BENCH_SEED", "42")))
+    bot.db_pool = await asyncpg.create_pool(dsn=BENCH_DATABASE_URL, min_size=POOL_SIZE, max_size=POOL_SIZE)
+    bot.db_connect_args = {'dsn': BENCH_DATABASE_URL, 'ssl': False}
+    bot.db_connection_mode = queries.DIRECT
+    listener = None
+    failures = []
+    try:
+        await bot.create_tables()
+        await bot.run_migrations()
+        async with bot.db_pool.acquire() as conn:
+            await seed(conn)
+            rows_before, total_before, stat_before = await chat_counts(conn)
+
+        await bot.load_chat_routes()
+        listener = asyncio.create_task(bot.notify_listener())
+        while not bot.notify_stats['listening']:
+            await asyncio.sleep(0.05)
+
+        outcomes = collections.Counter()
+        started = time.perf_counter()
+        await asyncio.gather(*(operation(outcomes) for _ in range(OPS)))
+        elapsed = time.perf_counter() - started
+        await wait_for_notifications()
+
+        async with bot.db_pool.acquire() as conn:
+            rows_after, total_after, stat_after = await chat_counts(conn)
+            unmirrored = await conn.fetchval("""
+                SELECT COUNT(*) FROM active_chats a
+                WHERE a.user_id >= $1 AND NOT EXISTS (
+                    SELECT 1 FROM active_chats b WHERE b.user_id = a.partner_id AND b.partner_id = a.user_id
+                )
+            """, FIRST_USER_ID)
+            self_chats = await conn.fetchval(
+                "SELECT COUNT(*) FROM active_chats WHERE user_id = partner_id AND user_id >= $1", FIRST_USER_ID)
+            db_routes = {r['user_id']: r['partner_id'] for r in await conn.fetch(
+                "SELECT user_id, partner_id FROM active_chats WHERE user_id >= $1", FIRST_USER_ID)}
+        memory_routes = {u: p for u, p in bot.chat_routes.items() if u >= FIRST_USER_ID}
+
+        if unmirrored:
+            failures.append(f"{unmirrored} chat rows without a mirror row")
+        if self_chats:
+            failures.append(f"{self_chats} users chatting with themselves")
+        if memory_routes != db_routes:
+            diff = set(memory_routes.items()) ^ set(db_routes.items())
+            failures.append(f"in-memory routes differ from active_chats on {len(diff)} entries")
+        if stat_after - stat_before != total_after - total_before:
+            failures.append(f"bot_stats.active_chats moved {stat_after - stat_before}, "
+                            f"active_chats rows moved {total_after - total_before}")
+
+        print("=" * 50)
+        print(f"⚡ {OPS} concurrent operations on {USERS} users in {elapsed:.2f}s "
+              f"({OPS / elapsed:.0f} ops/s, pool {POOL_SIZE})")
+        for kind, count in sorted(outcomes.items()):
+            print(f"   {kind:<24} {count}")
+        print(f"💬 Active chats: {rows_before // 2} -> {rows_after // 2}, "
+              f"{bot.chat_router_stats['notifications']} route notifications")
+        print("=" * 50)
+        for failure in failures:
+            print(f"❌ {failure}")
+        if not failures:
+            print("✅ All invariants hold")
+    finally:
+        if listener:
+            listener.cancel()
+        async with bot.db_pool.acquire() as conn:
+            await clear(conn)
+        await bot.db_pool.close()
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+"""Local stand-in for the Telegram Bot API.
+
+Records every call and acknowledges it with a plausible result, enforces a
+global messages-per-second limit with 429 RetryAfter answers like Telegram
+does, and answers 403 for chats listed as having blocked the bot. Point a
+python-telegram-bot ``Bot`` at it with ``base_url=api.base_url``.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+
+from aiohttp import web
+
+SEND_METHODS = {
+    "sendmessage", "sendphoto", "sendvideo", "senddocument", "copymessage",
+}
+
+
+class FakeBotAPI:
+    def __init__(self, global_limit=30, retry_after=1, blocked=(), latency=0.0):
+        self.global_limit = global_limit
+        self.retry_after = retry_after
+        self.blocked = set(blocked)
+        self.latency = latency
+        self.calls = []
+        self.rejected_flood = 0
+        self.rejected_blocked = 0
+        self.message_id = 0
+        self.webhook_url = ""
+        self._window = deque()
+        self._runner = None
+        self.base_url = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{bound_port}/bot"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def sent(self, method=None):
+        """Calls that were accepted, optionally filtered by method name"""
+        return [c for c in self.calls if c["ok"] and (method is None or c["method"] == method.lower())]
+
+    async def _params(self, request):
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    def _message(self, chat_id, params):
+        self.message_id += 1
+        message = {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id or 0), "type": "private"},
+        }
+        if "text" in params:
+            message["text"] = str(params["text"])
+        return message
+
+    async def handle(self, request):
+        method = request.match_info["method"].lower()
+        params = await self._params(request)
+        chat_id = params.get("chat_id")
+        call = {"time": time.monotonic(), "method": method, "params": params, "ok": True}
+        self.calls.append(call)
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method in SEND_METHODS:
+            now = time.monotonic()
+            while self._window and self._window[0] < now - 1:
+                self._window.popleft()
+            if len(self._window) >= self.global_limit:
+                call["ok"] = False
+                self.rejected_flood += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }, status=429)
+            self._window.append(now)
+
+            if chat_id is not None and int(chat_id) in self.blocked:
+                call["ok"] = False
+                self.rejected_blocked += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 403,
+                    "description": "Forbidden: bot was blocked by the user",
+                }, status=403)
+
+        if method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot"}
+        elif method == "setwebhook":
+            self.webhook_url = params.get("url", "")
+            result = True
+        elif method == "deletewebhook":
+            self.webhook_url = ""
+            result = True
+        elif method == "getwebhookinfo":
+            result = {
+                "url": self.webhook_url,
+                "has_custom_certificate": False,
+                "pending_update_count": 0,
+                "max_connections": 40,
+            }
+        elif method == "getchatmember":
+            result = {
+                "status": "member",
+                "user": {"id": int(params.get("user_id") or 0), "is_bot": False, "first_name": "Member"},
+            }
+        elif method == "copymessage":
+            self.message_id += 1
+            result = {"message_id": self.message_id}
+        elif method.startswith("send") or method.startswith("edit"):
+            result = self._message(chat_id, params)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
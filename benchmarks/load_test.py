@@ -0,0 +1,327 @@
+"""Load test: the real webhook app against a local Postgres and fake Bot API.
+
+Boots ``bot.main()`` (aiohttp server, update processing, handlers) pointed at
+FakeBotAPI, registers BENCH_USERS users through the real conversation, pairs
+half of them into chats, then replays BENCH_UPDATES webhook updates drawn
+from BENCH_MIX. Handler latency percentiles, updates/s and SQL statements
+per update are printed and written to benchmarks/results/ as JSON, next to
+the previous run's numbers for comparison.
+
+    BENCH_DATABASE_URL=postgresql://localhost/au_dating_bench python benchmarks/load_test.py
+
+Never point this at production: it truncates every table.
+"""
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import aiohttp
+import asyncpg
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+if not BENCH_DATABASE_URL:
+    print("❌ ERROR: BENCH_DATABASE_URL environment variable is required!")
+    sys.exit(1)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+API_PORT = free_port()
+BOT_PORT = free_port()
+
+os.environ.update({
+    "BOT_TOKEN": "123456:load-test",
+    "DATABASE_URL": BENCH_DATABASE_URL,
+    "DATABASE_SSL": os.getenv("BENCH_DATABASE_SSL", "disable"),
+    "PORT": str(BOT_PORT),
+    "RENDER_URL": f"http://127.0.0.1:{BOT_PORT}",
+    "TELEGRAM_API_BASE_URL": f"http://127.0.0.1:{API_PORT}/bot",
+})
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+USERS = int(os.getenv("BENCH_USERS", "200"))
+UPDATES = int(os.getenv("BENCH_UPDATES", "2000"))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "50"))
+MIX = os.getenv("BENCH_MIX", "find=4,like=3,chat=2,photo=1")
+RESULTS_DIR = Path(__file__).parent / "results"
+
+FIRST_USER_ID = 10_000_000
+HANDLERS = ("start", "find_match", "handle_like", "chat_relay", "photo_relay")
+
+
+class UpdateFactory:
+    """Builds webhook payloads shaped like the ones Telegram sends"""
+
+    def __init__(self):
+        self.update_id = 0
+        self.message_id = 0
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"Bench {user_id}", "username": f"bench{user_id}"}
+
+    def _message(self, user_id, **fields):
+        self.message_id += 1
+        return {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            **fields,
+        }
+
+    def _update(self, **fields):
+        self.update_id += 1
+        return {"update_id": self.update_id, **fields}
+
+    def text(self, user_id, text):
+        fields = {"text": text}
+        if text.startswith("/"):
+            fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self._update(message=self._message(user_id, **fields))
+
+    def photo(self, user_id):
+        size = {"file_id": f"photo-{user_id}", "file_unique_id": f"u{user_id}", "width": 320, "height": 320}
+        return self._update(message=self._message(user_id, photo=[size]))
+
+    def callback(self, user_id, data):
+        return self._update(callback_query={
+            "id": str(self.update_id),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": self._message(user_id, text="bench"),
+        })
+
+
+def parse_mix(spec):
+    weights = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def histogram_quantile(q, buckets, counts, total):
+    """Estimate a quantile from cumulative bucket counts like PromQL does"""
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for bound, n in zip(buckets, counts):
+        if cumulative + n >= rank:
+            return lower + (bound - lower) * ((rank - cumulative) / n if n else 0)
+        cumulative += n
+        lower = bound
+    return buckets[-1]
+
+
+def latency_summary(histogram):
+    summary = {}
+    for key, (counts, total_time, count) in histogram.values.items():
+        name = key[0] if key else "all"
+        summary[name] = {
+            "count": count,
+            "mean_ms": round(total_time / count * 1000, 2) if count else None,
+            **{
+                f"p{int(q * 100)}_ms": round(histogram_quantile(q, histogram.buckets, counts, count) * 1000, 2)
+                for q in (0.5, 0.95, 0.99)
+            },
+        }
+    return summary
+
+
+def metric_total(histogram):
+    return sum(count for _, _, count in histogram.values.values())
+
+
+def reset_metrics():
+    for metric in bot.METRICS:
+        if hasattr(metric, "values"):
+            metric.values.clear()
+    for key in bot.update_queue_stats:
+        bot.update_queue_stats[key] = 0 if isinstance(bot.update_queue_stats[key], int) else 0.0
+
+
+async def post_updates(session, updates):
+    """POST updates to the webhook in order, retrying when it sheds load"""
+    for payload in updates:
+        while True:
+            async with session.post(f"{os.environ['RENDER_URL']}/webhook", json=payload) as response:
+                if response.status != 503:
+                    break
+            await asyncio.sleep(0.05)
+
+
+async def run_phase(session, per_user_updates):
+    """Send each user's updates in order, CONCURRENCY users at a time"""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    expected = bot.update_queue_stats['processed'] + sum(len(u) for u in per_user_updates)
+
+    async def send(updates):
+        async with semaphore:
+            await post_updates(session, updates)
+
+    started = time.monotonic()
+    await asyncio.gather(*(send(u) for u in per_user_updates if u))
+    while bot.update_queue_stats['processed'] < expected:
+        await asyncio.sleep(0.01)
+    return time.monotonic() - started
+
+
+async def wait_for_server(session):
+    for _ in range(600):
+        try:
+            async with session.get(f"{os.environ['RENDER_URL']}/health") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("bot did not start")
+
+
+async def truncate_tables():
+    conn = await asyncpg.connect(BENCH_DATABASE_URL)
+    try:
+        tables = await conn.fetch("""
+            SELECT tablename FROM pg_tables
+            WHERE schemaname = 'public' AND tablename <> 'schema_version'
+        """)
+        if tables:
+            await conn.execute(f"TRUNCATE {', '.join(t['tablename'] for t in tables)} CASCADE")
+    finally:
+        await conn.close()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_result():
+    runs = sorted(RESULTS_DIR.glob("load_test-*.json"))
+    return json.loads(runs[-1].read_text()) if runs else None
+
+
+def registration(factory, user_id):
+    gender = "Male" if user_id % 2 else "Female"
+    return [
+        factory.text(user_id, "/start"),
+        factory.text(user_id, f"Bench {user_id}"),
+        factory.callback(user_id, gender),
+        factory.callback(user_id, "Main Campus"),
+        factory.callback(user_id, "skip"),
+        factory.callback(user_id, "skip"),
+        factory.callback(user_id, "skip"),
+        factory.callback(user_id, "pref_Both"),
+        factory.callback(user_id, "confirm"),
+    ]
+
+
+def mixed_workload(factory, swipers, chatters, weights):
+    per_user = {user_id: [] for user_id in swipers + chatters}
+    kinds = list(weights)
+    for kind in random.choices(kinds, weights=[weights[k] for k in kinds], k=UPDATES):
+        if kind in ("find", "like"):
+            user_id = random.choice(swipers)
+            if kind == "find":
+                per_user[user_id].append(factory.text(user_id, "/find"))
+            else:
+                target = random.choice([s for s in swipers if s != user_id])
+                per_user[user_id].append(factory.callback(user_id, f"like_{target}"))
+        else:
+            user_id = random.choice(chatters)
+            if kind == "chat":
+                per_user[user_id].append(factory.text(user_id, "Hello there 👋"))
+            else:
+                per_user[user_id].append(factory.photo(user_id))
+    return list(per_user.values())
+
+
+async def main():
+    random.seed(int(os.getenv("BENCH_SEED", "42")))
+    weights = parse_mix(MIX)
+    api = FakeBotAPI(global_limit=10**9)
+    await api.start(port=API_PORT)
+
+    await truncate_tables()
+    bot_task = asyncio.create_task(bot.main())
+    factory = UpdateFactory()
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + USERS))
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_for_server(session)
+
+            print(f"📝 Registering {USERS} users...")
+            registration_time = await run_phase(session, [registration(factory, u) for u in user_ids])
+
+            # Pair every other chatter with the next one so chat and photo updates relay
+            chatters = user_ids[: USERS // 2]
+            swipers = user_ids[USERS // 2:]
+            await run_phase(session, [[factory.callback(a, f"chat_{b}")] for a, b in zip(chatters[::2], chatters[1::2])])
+
+            print(f"🚀 Replaying {UPDATES} updates ({MIX})...")
+            reset_metrics()
+            elapsed = await run_phase(session, mixed_workload(factory, swipers, chatters, weights))
+    finally:
+        bot_task.cancel()
+        await asyncio.gather(bot_task, return_exceptions=True)
+        await api.stop()
+
+    processed = bot.update_queue_stats['processed']
+    result = {
+        "commit": git_commit(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "config": {"users": USERS, "updates": UPDATES, "concurrency": CONCURRENCY, "mix": MIX,
+                   "update_concurrency": bot.UPDATE_CONCURRENCY},
+        "registration_seconds": round(registration_time, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "updates_per_second": round(processed / elapsed, 1),
+        "sql_per_update": round(metric_total(bot.sql_latency) / processed, 2) if processed else None,
+        "bot_api_calls_per_update": round(metric_total(bot.bot_api_latency) / processed, 2) if processed else None,
+        "update_latency": latency_summary(bot.update_duration).get("all"),
+        "queue_wait": latency_summary(bot.update_wait).get("all"),
+        "handler_latency": {k: v for k, v in latency_summary(bot.handler_latency).items() if k in HANDLERS},
+        "errors": bot.update_queue_stats['errors'],
+    }
+
+    previous = previous_result()
+    RESULTS_DIR.mkdir(exist_ok=True)
+    out = RESULTS_DIR / f"load_test-{datetime.now():%Y%m%d-%H%M%S}-{result['commit']}.json"
+    out.write_text(json.dumps(result, indent=2))
+
+    print("=" * 50)
+    print(f"📈 Updates/s:        {result['updates_per_second']}")
+    print(f"🗄️ SQL per update:   {result['sql_per_update']}")
+    print(f"📤 API calls/update: {result['bot_api_calls_per_update']}")
+    print(f"⏱️ Update latency:   {result['update_latency']}")
+    for name, stats in result["handler_latency"].items():
+        print(f"   {name:<12} p50 {stats['p50_ms']}ms  p95 {stats['p95_ms']}ms  p99 {stats['p99_ms']}ms  (n={stats['count']})")
+    if previous:
+        print(f"🔁 Previous run ({previous['commit']}): {previous['updates_per_second']} updates/s, "
+              f"{previous['sql_per_update']} SQL/update")
+    print(f"💾 Saved {out}")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
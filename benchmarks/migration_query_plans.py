@@ -0,0 +1,168 @@
+"""Before/after query plans for the indexes added by the schema migrations.
+
+Seeds a scratch database with 100k users and 5M swipes, explains the bot's hot
+queries without the migration indexes, applies the migrations and explains
+them again.
+
+    BENCH_DATABASE_URL=postgresql://localhost/au_dating_bench python benchmarks/migration_query_plans.py
+
+Never point this at production: it drops the migration indexes and truncates
+every table.
+"""
+import asyncio
+import os
+import sys
+
+import asyncpg
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+if not BENCH_DATABASE_URL:
+    print("❌ ERROR: BENCH_DATABASE_URL environment variable is required!")
+    sys.exit(1)
+
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", BENCH_DATABASE_URL)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot  # noqa: E402
+
+USERS = int(os.getenv("BENCH_USERS", "100000"))
+SWIPES_PER_USER = int(os.getenv("BENCH_SWIPES_PER_USER", "50"))
+
+HOT_QUERIES = {
+    "handle_like reverse swipe": (
+        "SELECT 1 FROM swipes WHERE liker_id = $1 AND liked_id = $2",
+        (4242, 4243),
+    ),
+    "likes received": (
+        "SELECT COUNT(*) FROM swipes WHERE liked_id = $1",
+        (4242,),
+    ),
+    "find_match candidate batch": (
+        """
+        SELECT u.telegram_id
+        FROM users u
+        WHERE u.gender = ANY($2::text[])
+        AND u.is_banned = FALSE
+        AND u.telegram_id != $1
+        AND NOT EXISTS (
+            SELECT 1 FROM swipes s WHERE s.liker_id = $1 AND s.liked_id = u.telegram_id
+        )
+        AND NOT EXISTS (
+            SELECT 1 FROM active_chats ac
+            WHERE ac.user_id = u.telegram_id OR ac.partner_id = u.telegram_id
+        )
+        ORDER BY RANDOM()
+        LIMIT 200
+        """,
+        (4242, ["Female"]),
+    ),
+    "view_requests": (
+        """
+        SELECT cr.id, cr.requester_id, u.name, u.campus
+        FROM chat_requests cr
+        JOIN users u ON cr.requester_id = u.telegram_id
+        WHERE cr.requested_id = $1 AND cr.status = 'pending'
+        ORDER BY cr.created_at DESC
+        """,
+        (4242,),
+    ),
+    "admin_reports": (
+        """
+        SELECT r.id, r.reporter_id, r.reported_id, r.reason, r.created_at,
+               u1.name as reporter_name, u2.name as reported_name
+        FROM reports r
+        LEFT JOIN users u1 ON r.reporter_id = u1.telegram_id
+        LEFT JOIN users u2 ON r.reported_id = u2.telegram_id
+        WHERE r.status = 'pending'
+        ORDER BY r.created_at DESC
+        LIMIT 10
+        """,
+        (),
+    ),
+    "admin_handle_search": (
+        """
+        SELECT * FROM users
+        WHERE username ILIKE $1 OR name ILIKE $1
+        ORDER BY created_at DESC
+        LIMIT 10
+        """,
+        ("%4242%",),
+    ),
+}
+
+
+async def seed(conn):
+    print(f"🌱 Seeding {USERS} users and {USERS * SWIPES_PER_USER} swipes...")
+    await conn.execute("TRUNCATE users, swipes, active_chats, chat_requests, reports, channel_checks")
+    await conn.execute("""
+        INSERT INTO users (telegram_id, username, name, gender, campus, preference)
+        SELECT g, 'user' || g, 'Name ' || g,
+               CASE WHEN g % 2 = 0 THEN 'Male' ELSE 'Female' END,
+               'Main Campus',
+               'Both'
+        FROM generate_series(1, $1::int) g
+    """, USERS)
+    # 7919 is prime and coprime with the user count, so every liker gets
+    # SWIPES_PER_USER distinct targets that are never themselves
+    await conn.execute("""
+        INSERT INTO swipes (liker_id, liked_id)
+        SELECT liker, ((liker + k * 7919) % $1::int) + 1
+        FROM generate_series(1, $1::int) liker
+        CROSS JOIN generate_series(1, $2::int) k
+        ON CONFLICT DO NOTHING
+    """, USERS, SWIPES_PER_USER)
+    await conn.execute("""
+        INSERT INTO chat_requests (requester_id, requested_id)
+        SELECT g, ((g * 31) % $1::int) + 1 FROM generate_series(1, $1::int / 2) g
+        ON CONFLICT DO NOTHING
+    """, USERS)
+    await conn.execute("""
+        INSERT INTO reports (reporter_id, reported_id, reason, status)
+        SELECT g, ((g * 17) % $1::int) + 1, 'spam',
+               CASE WHEN g % 10 = 0 THEN 'pending' ELSE 'resolved' END
+        FROM generate_series(1, $1::int / 2) g
+    """, USERS)
+    await conn.execute("ANALYZE")
+
+
+async def explain_all(conn, label):
+    print("=" * 60)
+    print(f"📊 Query plans {label}")
+    print("=" * 60)
+    for name, (sql, params) in HOT_QUERIES.items():
+        rows = await conn.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {sql}", *params)
+        print(f"\n▶ {name}")
+        for row in rows:
+            print(f"   {row[0]}")
+
+
+async def drop_migration_indexes(conn):
+    for _, _, statements in bot.MIGRATIONS:
+        for statement in statements:
+            match = bot.CONCURRENT_INDEX_RE.search(statement)
+            if match:
+                await conn.execute(f"DROP INDEX IF EXISTS {match.group(1)}")
+    await conn.execute("DROP TABLE IF EXISTS schema_version")
+
+
+async def main():
+    bot.db_pool = await asyncpg.create_pool(dsn=BENCH_DATABASE_URL, min_size=1, max_size=2, command_timeout=None)
+    try:
+        await bot.create_tables()
+        async with bot.db_pool.acquire() as conn:
+            await drop_migration_indexes(conn)
+            await seed(conn)
+            await explain_all(conn, "BEFORE migrations")
+
+        await bot.run_migrations()
+
+        async with bot.db_pool.acquire() as conn:
+            await conn.execute("ANALYZE")
+            await explain_all(conn, "AFTER migrations")
+    finally:
+        await bot.db_pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
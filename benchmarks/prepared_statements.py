@@ -0,0 +1,135 @@
+"""Parse/plan overhead of the find_match and relay queries, cached vs uncached.
+
+Runs the candidate batch and candidate profile lookups behind /find and the
+user context read every relayed message starts with, first on a connection
+with asyncpg's statement cache off (how the bot ran behind the pooler), then
+with it on. Reports mean time per call and the server-side planning time
+EXPLAIN reports for one uncached execution.
+
+    BENCH_DATABASE_URL=postgresql://localhost/au_dating_bench python benchmarks/prepared_statements.py
+
+Set BENCH_POOLER_URL to the same database through pgbouncer/Supavisor to also
+time the mode queries.detect_connection_mode picks for it. Use a scratch
+database: it writes and deletes users with ids from 30,000,000.
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import asyncpg
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+if not BENCH_DATABASE_URL:
+    print("❌ ERROR: BENCH_DATABASE_URL environment variable is required!")
+    sys.exit(1)
+
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", BENCH_DATABASE_URL)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot  # noqa: E402
+import queries  # noqa: E402
+
+BENCH_POOLER_URL = os.getenv("BENCH_POOLER_URL")
+USERS = int(os.getenv("BENCH_USERS", "2000"))
+CALLS = int(os.getenv("BENCH_CALLS", "2000"))
+FIRST_USER_ID = 30_000_000
+
+
+def workload():
+    """(label, sql, args factory) for the queries under test"""
+    user_ids = range(FIRST_USER_ID, FIRST_USER_ID + USERS)
+    return [
+        ("find_match: candidate batch", queries.CANDIDATE_BATCH,
+         lambda: (random.choice(user_ids), ['Male', 'Female'], bot.CANDIDATE_BATCH_SIZE,
+                  bot.CANDIDATE_BATCH_SIZE * bot.CANDIDATE_SAMPLE_FACTOR)),
+        ("find_match: candidate profile", queries.NEXT_CANDIDATE_PROFILE,
+         lambda: (random.sample(user_ids, bot.CANDIDATE_CHECK_SIZE), ['Male', 'Female'])),
+        ("relay: user context", queries.USER_CONTEXT,
+         lambda: (random.choice(user_ids), bot.CHANNEL_CHECK_TTL)),
+    ]
+
+
+async def clear(conn):
+    await conn.execute("DELETE FROM swipes WHERE liker_id >= $1", FIRST_USER_ID)
+    await conn.execute("DELETE FROM users WHERE telegram_id >= $1", FIRST_USER_ID)
+
+
+async def seed(conn):
+    await clear(conn)
+    await conn.executemany("""
+        INSERT INTO users (telegram_id, name, gender, campus)
+        VALUES ($1, $2, $3, 'Main Campus')
+    """, [(u, f"Bench {u}", "Male" if u % 2 else "Female")
+          for u in range(FIRST_USER_ID, FIRST_USER_ID + USERS)])
+    await conn.executemany(
+        "INSERT INTO swipes (liker_id, liked_id) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+        [(u, FIRST_USER_ID + random.randrange(USERS)) for u in range(FIRST_USER_ID, FIRST_USER_ID + USERS)
+         for _ in range(5)],
+    )
+    await conn.execute("ANALYZE users")
+    await conn.execute("ANALYZE swipes")
+
+
+async def planning_ms(conn, sql, args):
+    """Server-side planning time of one uncached execution"""
+    plan = await conn.fetchval(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", *args)
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Planning Time"]
+
+
+async def time_calls(conn, sql, make_args):
+    for _ in range(10):
+        await conn.fetch(sql, *make_args())
+    started = time.perf_counter()
+    for _ in range(CALLS):
+        await conn.fetch(sql, *make_args())
+    return (time.perf_counter() - started) / CALLS * 1000
+
+
+async def run(label, dsn, options):
+    print(f"▶ {label} ({options})")
+    conn = await asyncpg.connect(dsn=dsn, **options)
+    try:
+        for name, sql, make_args in workload():
+            mean = await time_calls(conn, sql, make_args)
+            print(f"   {name:<32} {mean:.3f}ms/call")
+    finally:
+        await conn.close()
+
+
+async def main():
+    random.seed(int(os.getenv("BENCH_SEED", "42")))
+    bot.db_pool = await asyncpg.create_pool(dsn=BENCH_DATABASE_URL, min_size=1, max_size=2)
+    try:
+        await bot.create_tables()
+        async with bot.db_pool.acquire() as conn:
+            await seed(conn)
+            print("=" * 50)
+            print(f"📊 {USERS} users, {CALLS} calls per query")
+            print("=" * 50)
+            print("▶ Planning time per uncached execution (EXPLAIN ANALYZE)")
+            for name, sql, make_args in workload():
+                print(f"   {name:<32} {await planning_ms(conn, sql, make_args()):.3f}ms")
+
+        await run("Before: unnamed statements", BENCH_DATABASE_URL, queries.pool_options(queries.POOLER))
+        await run("After: statement cache", BENCH_DATABASE_URL, queries.pool_options(queries.DIRECT, bot.STATEMENT_CACHE_SIZE))
+
+        if BENCH_POOLER_URL:
+            mode = await queries.detect_connection_mode(BENCH_POOLER_URL)
+            await run(f"Pooler, detected {mode}", BENCH_POOLER_URL,
+                      queries.pool_options(mode, bot.STATEMENT_CACHE_SIZE))
+        print("=" * 50)
+    finally:
+        async with bot.db_pool.acquire() as conn:
+            await clear(conn)
+        await bot.db_pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
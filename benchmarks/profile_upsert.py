@@ -0,0 +1,114 @@
+"""Round trips per registration: the old profile write path vs the upsert.
+
+The old path ran the debug read in /start, a SELECT to see whether the
+user existed, an INSERT or UPDATE, and a second debug read-back. The new
+one is a single INSERT ... ON CONFLICT DO UPDATE. Statements are counted
+with the same asyncpg query logger that feeds /metrics.
+
+    BENCH_DATABASE_URL=postgresql://localhost/au_dating_bench python benchmarks/profile_upsert.py
+
+Use a scratch database: it writes and deletes users with ids from 20,000,000.
+"""
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import asyncpg
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+if not BENCH_DATABASE_URL:
+    print("❌ ERROR: BENCH_DATABASE_URL environment variable is required!")
+    sys.exit(1)
+
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", BENCH_DATABASE_URL)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot  # noqa: E402
+
+REGISTRATIONS = int(os.getenv("BENCH_REGISTRATIONS", "500"))
+FIRST_USER_ID = 20_000_000
+
+
+def registration(user_id):
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id, username=f"bench{user_id}"))
+    context = SimpleNamespace(user_data={
+        'name': f"Bench {user_id}", 'gender': "Female", 'campus': "Main Campus",
+        'photo_file_id': None, 'bio': "Benchmark", 'hobbies': None, 'preference': "Both",
+    })
+    return update, context
+
+
+async def legacy_save_profile(update, context):
+    """The profile write path as it was before the upsert"""
+    user_id = update.effective_user.id
+    data = context.user_data
+    values = (update.effective_user.username, data['name'], data['gender'], data['campus'],
+              data['photo_file_id'], data['bio'], data['hobbies'], data['preference'])
+
+    # debug_user_exists() at the top of /start
+    async with bot.db_pool.acquire() as conn:
+        await conn.fetchrow("SELECT * FROM users WHERE telegram_id = $1", user_id)
+
+    async with bot.db_pool.acquire() as conn:
+        existing = await conn.fetchrow("SELECT telegram_id FROM users WHERE telegram_id = $1", user_id)
+        if existing:
+            await conn.execute("""
+                UPDATE users SET username = $1, name = $2, gender = $3, campus = $4,
+                photo_file_id = $5, bio = $6, hobbies = $7, preference = $8, updated_at = NOW()
+                WHERE telegram_id = $9
+            """, *values, user_id)
+        else:
+            await conn.execute("""
+                INSERT INTO users (telegram_id, username, name, gender, campus,
+                                   photo_file_id, bio, hobbies, preference)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+            """, user_id, *values)
+
+    # debug_user_exists() read-back after saving
+    async with bot.db_pool.acquire() as conn:
+        await conn.fetchrow("SELECT * FROM users WHERE telegram_id = $1", user_id)
+
+
+def statements_run():
+    return sum(count for _, _, count in bot.sql_latency.values.values())
+
+
+async def measure(label, save):
+    async with bot.db_pool.acquire() as conn:
+        await conn.execute("DELETE FROM users WHERE telegram_id >= $1", FIRST_USER_ID)
+
+    before = statements_run()
+    started = time.perf_counter()
+    for user_id in range(FIRST_USER_ID, FIRST_USER_ID + REGISTRATIONS):
+        await save(*registration(user_id))
+    elapsed = time.perf_counter() - started
+    statements = statements_run() - before
+
+    print(f"▶ {label}")
+    print(f"   Round trips per registration: {statements / REGISTRATIONS:.1f}")
+    print(f"   Mean time per registration:   {elapsed / REGISTRATIONS * 1000:.2f}ms")
+
+
+async def main():
+    bot.db_pool = await asyncpg.create_pool(
+        dsn=BENCH_DATABASE_URL, min_size=1, max_size=2, init=bot.setup_connection
+    )
+    try:
+        await bot.create_tables()
+        print("=" * 50)
+        print(f"📊 {REGISTRATIONS} registrations")
+        print("=" * 50)
+        await measure("Before: SELECT + INSERT/UPDATE + debug reads", legacy_save_profile)
+        await measure("After: single upsert", bot.save_profile)
+    finally:
+        async with bot.db_pool.acquire() as conn:
+            await conn.execute("DELETE FROM users WHERE telegram_id >= $1", FIRST_USER_ID)
+        await bot.db_pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+"""Update throughput as PTB's concurrent_updates grows, with per-user ordering.
+
+Builds a real Application against the local fake Bot API for each level in
+BENCH_LEVELS and feeds BENCH_UPDATES text updates from BENCH_USERS users
+through bot.enqueue_update. The handler spends BENCH_HANDLER_MS waiting (the
+stand-in for SQL and Bot API calls); every BENCH_SLOW_EVERY-th update takes
+BENCH_SLOW_MS instead, like a cold find_match. Prints updates/s, latency of
+the ordinary updates and any user whose updates ran out of order.
+
+    python benchmarks/update_concurrency.py
+"""
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", "postgresql://unused")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+LEVELS = [int(n) for n in os.getenv("BENCH_LEVELS", "1,4,16,64").split(",")]
+USERS = int(os.getenv("BENCH_USERS", "200"))
+UPDATES = int(os.getenv("BENCH_UPDATES", "2000"))
+HANDLER_MS = float(os.getenv("BENCH_HANDLER_MS", "20"))
+SLOW_MS = float(os.getenv("BENCH_SLOW_MS", "500"))
+SLOW_EVERY = int(os.getenv("BENCH_SLOW_EVERY", "100"))
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+
+
+def update_payloads():
+    for i in range(UPDATES):
+        user_id = 1000 + i % USERS
+        yield {
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+                "text": str(i),
+            },
+        }
+
+
+async def run_level(base_url, level):
+    app = ApplicationBuilder().token(bot.BOT_TOKEN).base_url(base_url).concurrent_updates(level).build()
+    seen = defaultdict(list)
+    latencies = []
+
+    async def handler(update, context):
+        sequence = int(update.message.text)
+        seen[update.effective_user.id].append(sequence)
+        slow = sequence % SLOW_EVERY == 0
+        await asyncio.sleep((SLOW_MS if slow else HANDLER_MS) / 1000)
+        if not slow:
+            latencies.append(time.monotonic() - sent_at[sequence])
+
+    app.add_handler(MessageHandler(filters.TEXT, handler))
+    await app.initialize()
+    bot.start_update_processing(app)
+    sent_at = {}
+    try:
+        started = time.monotonic()
+        for payload in update_payloads():
+            update = Update.de_json(payload, app.bot)
+            sent_at[int(payload["message"]["text"])] = time.monotonic()
+            while not bot.enqueue_update(update):
+                await asyncio.sleep(0.01)
+        await asyncio.gather(*bot.update_tasks)
+        elapsed = time.monotonic() - started
+    finally:
+        await app.shutdown()
+
+    out_of_order = [user_id for user_id, sequences in seen.items() if sequences != sorted(sequences)]
+    latencies.sort()
+    return {
+        "rate": UPDATES / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "out_of_order": out_of_order,
+        "contended": bot.update_queue_stats['contended'],
+    }
+
+
+async def main():
+    api = FakeBotAPI(global_limit=10 ** 6)
+    base_url = await api.start()
+    failures = 0
+    try:
+        print("=" * 50)
+        print(f"⚡ {UPDATES} updates from {USERS} users, {HANDLER_MS:.0f}ms handlers, "
+              f"every {SLOW_EVERY}th takes {SLOW_MS:.0f}ms")
+        print("=" * 50)
+        for level in LEVELS:
+            for key in bot.update_queue_stats:
+                bot.update_queue_stats[key] = 0 if isinstance(bot.update_queue_stats[key], int) else 0.0
+            result = await run_level(base_url, level)
+            print(f"▶ concurrent_updates={level:<4} {result['rate']:7.0f} updates/s   "
+                  f"p50 {result['p50']:7.1f}ms  p95 {result['p95']:7.1f}ms  "
+                  f"({result['contended']} waited on their user's lock)")
+            if result['out_of_order']:
+                failures += 1
+                print(f"   ❌ {len(result['out_of_order'])} users' updates ran out of order")
+        print("=" * 50)
+        if not failures:
+            print("✅ Every user's updates ran in order")
+    finally:
+        await api.stop()
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
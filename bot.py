@@ -1,21 +1,112 @@
 import sys
 import os
 import asyncio
+import atexit
+import bisect
+import functools
 import asyncpg
 import aiohttp  
 import logging
-from datetime import datetime
+import logging.handlers
+import queue
+import random
+import json
+import re
+import signal
+import socket
+import time
+import weakref
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, ContextTypes,
-    MessageHandler, ConversationHandler, filters, CallbackQueryHandler
+    Application, ApplicationBuilder, CommandHandler, ContextTypes,
+    MessageHandler, ConversationHandler, filters, CallbackQueryHandler, ChatMemberHandler,
+    TypeHandler
 )
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
 from aiohttp import web
 
+import queries
+from candidate_index import BANNED, IN_CHAT, CandidateIndex
+from persistence import PostgresPersistence, SharedConversationHandler
+
 # Load environment variables
 load_dotenv()
 
+# ---------------- Logging ----------------
+# One JSON object per line. Records are formatted where they are logged but
+# written by a QueueListener thread, so stdout I/O never blocks the event loop.
+# LOG_LEVELS sets per-category levels, e.g. "au_bot.webhook=DEBUG,httpx=INFO".
+# High-volume events go through log_sampled() and only LOG_SAMPLE_RATE of them
+# are kept.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "httpx=WARNING,aiohttp.access=WARNING")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+# Attributes every LogRecord has; anything else came in through extra=
+LOG_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON line, including any extra= fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec="milliseconds") + "Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in LOG_RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def setup_logging():
+    """Route all logging through a queue drained by a background thread"""
+    log_queue = queue.SimpleQueue()
+    # The queue handler formats on the caller's side (cheap); the listener
+    # thread only writes the finished line
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(JsonFormatter())
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    for item in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+        name, _, level = item.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+def log_sampled(log: logging.Logger, level: int, msg: str, *args, rate: float = None, **fields):
+    """Log only a random sample of a high-volume event"""
+    rate = LOG_SAMPLE_RATE if rate is None else rate
+    if rate < 1 and random.random() >= rate:
+        return
+    if log.isEnabledFor(level):
+        log.log(level, msg, *args, extra={**fields, 'sample_rate': rate})
+
+log_listener = setup_logging()
+logger = logging.getLogger("au_bot")
+db_logger = logging.getLogger("au_bot.db")
+webhook_logger = logging.getLogger("au_bot.webhook")
+update_logger = logging.getLogger("au_bot.updates")
+profile_logger = logging.getLogger("au_bot.profile")
+match_logger = logging.getLogger("au_bot.match")
+chat_logger = logging.getLogger("au_bot.chat")
+admin_logger = logging.getLogger("au_bot.admin")
+broadcast_logger = logging.getLogger("au_bot.broadcast")
+
 # Define conversation states
 (NAME, GENDER, CAMPUS, PHOTO, BIO, HOBBIES, PREFERENCE, REVIEW, 
  EDIT_CHOICE, EDIT_NAME, EDIT_GENDER, EDIT_CAMPUS, 
@@ -27,45 +118,211 @@ ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", "0"))
 CHANNEL_USERNAME = os.getenv("CHANNEL_USERNAME", "@AmboU_confession")
 DATABASE_URL = os.getenv("DATABASE_URL")
 PORT = int(os.getenv("PORT", "8080"))
+# Point the bot at a local Bot API stand-in, e.g. for load tests
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL")
+# "disable" for a local Postgres without TLS
+DATABASE_SSL = os.getenv("DATABASE_SSL", "require")
+# auto, direct, pooler or pooler-prepared; auto probes the connection
+DATABASE_POOLER = os.getenv("DATABASE_POOLER", "auto").lower()
+STATEMENT_CACHE_SIZE = int(os.getenv("STATEMENT_CACHE_SIZE", "256"))
+# Extra read-backs and the /debug command; keep off in production
+DIAGNOSTICS = os.getenv("DIAGNOSTICS", "false").lower() in ("1", "true", "yes")
 
 # Validate required environment variables
 if not BOT_TOKEN:
-    print("❌ ERROR: BOT_TOKEN environment variable is required!")
+    logger.critical("BOT_TOKEN environment variable is required!")
     sys.exit(1)
 
 if not DATABASE_URL:
-    print("❌ ERROR: DATABASE_URL environment variable is required!")
+    logger.critical("DATABASE_URL environment variable is required!")
     sys.exit(1)
 
-print("=" * 50)
-print("🚀 Starting AU Dating Bot...")
-print(f"✅ Bot token: {BOT_TOKEN[:10]}...")
-print(f"✅ Database: {DATABASE_URL[:30]}...")
-print(f"✅ Port: {PORT}")
-print("=" * 50)
-
-# Database connection pool
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
-logger = logging.getLogger(__name__)
+logger.info("Starting AU Dating Bot", extra={'bot_token': f"{BOT_TOKEN[:10]}...", 'database': f"{DATABASE_URL[:30]}...", 'port': PORT})
 
 # Database connection pool
 db_pool = None
+# How the pool reaches Postgres, see queries.detect_connection_mode
+db_connection_mode = None
+# dsn and ssl the pool connected with, for dedicated connections such as LISTEN
+db_connect_args = None
+
+# ---------------- Metrics ----------------
+# Prometheus text-format metrics served on /metrics. Handlers and DB helpers
+# are timed by @instrumented, every SQL statement by an asyncpg query logger
+# and every Bot API call by InstrumentedRequest. Gauges such as pool and
+# update queue sizes are read when the endpoint is scraped.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = []
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.values = {}
+        METRICS.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in self.values.items():
+            yield f"{self.name}{format_labels(self.labelnames, key)} {value}"
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # label values -> [per-bucket counts, sum, count]
+        self.values = {}
+        METRICS.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[0][index] += 1
+        state[1] += value
+        state[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labelnames + ("le",)
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield f"{self.name}_bucket{format_labels(names, key + (bound,))} {cumulative}"
+            yield f"{self.name}_bucket{format_labels(names, key + ('+Inf',))} {count}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, key)} {total}"
+            yield f"{self.name}_count{format_labels(self.labelnames, key)} {count}"
+
+class ValueMetric:
+    """A gauge or counter whose value is read from existing state at scrape time"""
+
+    def __init__(self, name, help_text, read, kind="gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.kind = kind
+        METRICS.append(self)
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception:
+            return
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield f"{self.name} {value}"
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+handler_latency = Histogram("bot_handler_duration_seconds", "Time spent in an update handler", ("handler",))
+handler_errors = Counter("bot_handler_errors_total", "Exceptions raised by an update handler", ("handler",))
+db_helper_latency = Histogram("bot_db_helper_duration_seconds", "Time spent in a database helper", ("helper",))
+db_helper_errors = Counter("bot_db_helper_errors_total", "Exceptions raised by a database helper", ("helper",))
+sql_latency = Histogram("bot_sql_duration_seconds", "Execution time per SQL statement", ("statement",))
+sql_errors = Counter("bot_sql_errors_total", "Failed SQL statements", ("statement",))
+bot_api_latency = Histogram("bot_api_request_duration_seconds", "Telegram Bot API call latency", ("method",))
+bot_api_errors = Counter("bot_api_errors_total", "Failed Telegram Bot API calls", ("method", "code"))
+update_wait = Histogram("bot_update_queue_wait_seconds", "Time an update waited for its user's lock and a processing slot")
+update_lock_wait = Histogram("bot_update_lock_wait_seconds", "Time an update waited behind the same user's earlier updates")
+update_duration = Histogram("bot_update_duration_seconds", "Time spent processing one update")
+
+INSTRUMENT_METRICS = {
+    'handler': (handler_latency, handler_errors, "handler"),
+    'db': (db_helper_latency, db_helper_errors, "helper"),
+}
+
+def instrumented(func=None, *, kind="handler"):
+    """Record latency and errors of an async handler or DB helper"""
+    if func is None:
+        return functools.partial(instrumented, kind=kind)
+    histogram, errors, label = INSTRUMENT_METRICS[kind]
+    labels = {label: func.__name__}
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            errors.inc(**labels)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started, **labels)
+    return wrapper
+
+@functools.lru_cache(maxsize=512)
+def statement_label(query: str):
+    """Collapse a SQL string into a short, stable metric label"""
+    return " ".join(query.split())[:100]
+
+def record_query(record):
+    statement = statement_label(record.query)
+    sql_latency.observe(record.elapsed, statement=statement)
+    if record.exception is not None:
+        sql_errors.inc(statement=statement)
+
+async def setup_connection(conn):
+    """Pool init hook: time every statement run on this connection"""
+    conn.add_query_logger(record_query)
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records latency and errors per Bot API method"""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            status, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception as e:
+            bot_api_errors.inc(method=api_method, code=type(e).__name__)
+            raise
+        finally:
+            bot_api_latency.observe(time.perf_counter() - started, method=api_method)
+        if status >= 400:
+            bot_api_errors.inc(method=api_method, code=status)
+        return status, payload
+
+def pool_waiters():
+    # asyncpg has no public waiter count; read it off the pool's internal queue
+    return len(getattr(getattr(db_pool, "_queue", None), "_getters", ()) or ())
+
+ValueMetric("bot_db_pool_size", "Open connections in the asyncpg pool", lambda: db_pool.get_size())
+ValueMetric("bot_db_pool_idle", "Idle connections in the asyncpg pool", lambda: db_pool.get_idle_size())
+ValueMetric("bot_db_pool_waiters", "Tasks waiting to acquire a pool connection", pool_waiters)
 
 # ---------------- Database Functions ----------------
 async def init_db():
     """Initialize PostgreSQL database tables with Supabase SSL support"""
-    global db_pool
+    global db_pool, db_connection_mode, db_connect_args
     
-    print("=" * 50)
-    print("🔄 Initializing database connection...")
-    logger.info("Starting database initialization")
+    db_logger.info("Starting database initialization")
     
     if not DATABASE_URL:
-        print("❌ ERROR: DATABASE_URL environment variable is missing!")
-        logger.error("DATABASE_URL environment variable is missing!")
+        db_logger.error("DATABASE_URL environment variable is missing!")
         raise ValueError("DATABASE_URL is required")
     
     # Make a copy of the DATABASE_URL to modify
@@ -73,7 +330,7 @@ async def init_db():
     
     # For Supabase, we need to handle SSL differently
     if "supabase" in db_url or "pooler.supabase.com" in db_url:
-        print("🔧 Configuring SSL for Supabase connection...")
+        db_logger.info("Configuring SSL for Supabase connection...")
         # Remove any existing sslmode parameters
         if "?" in db_url:
             base_url = db_url.split("?")[0]
@@ -89,20 +346,26 @@ async def init_db():
         else:
             db_url += "?sslmode=require"
         
-        print(f"✅ SSL configured for Supabase")
+        db_logger.info("SSL configured for Supabase")
     
     # Show partial URL for debugging
     safe_url = mask_database_url(db_url)
-    print(f"📦 Connecting to: {safe_url}")
-    logger.info(f"Connecting to database: {safe_url}")
+    db_logger.info(f"Connecting to database: {safe_url}")
+    
+    # 'require' encrypts without verifying certs
+    db_ssl = False if DATABASE_SSL == "disable" else DATABASE_SSL
     
     max_retries = 3
     retry_delay = 5
     
     for attempt in range(max_retries):
         try:
-            print(f"Attempt {attempt + 1}/{max_retries}...")
-            logger.info(f"Database connection attempt {attempt + 1}/{max_retries}")
+            db_logger.info(f"Database connection attempt {attempt + 1}/{max_retries}")
+            
+            # Named prepared statements only survive a transaction pooler that
+            # tracks them, so probe before choosing the statement cache size
+            db_connection_mode = await queries.detect_connection_mode(db_url, ssl=db_ssl, override=DATABASE_POOLER)
+            db_logger.info(f"Database connection mode: {db_connection_mode}")
             
             # Create connection pool with SSL disabled for certificate verification
             db_pool = await asyncpg.create_pool(
@@ -112,37 +375,37 @@ async def init_db():
                 max_inactive_connection_lifetime=300,
                 command_timeout=60,
                 timeout=30,
-                statement_cache_size=0,
-                ssl='require'  # Changed from True to 'require' which doesn't verify certs
+                ssl=db_ssl,
+                init=setup_connection,
+                **queries.pool_options(db_connection_mode, STATEMENT_CACHE_SIZE)
             )
             
+            db_connect_args = {'dsn': db_url, 'ssl': db_ssl}
+            
             # Test the connection
             async with db_pool.acquire() as conn:
                 db_version = await conn.fetchval("SELECT version()")
-                print(f"✅ Connected to PostgreSQL: {db_version.split(',')[0]}")
-                logger.info(f"Successfully connected to PostgreSQL")
+                db_logger.info(f"Connected to PostgreSQL: {db_version.split(',')[0]}")
                 
                 test_result = await conn.fetchval("SELECT 1 + 1")
-                print(f"✅ Database test query: 1 + 1 = {test_result}")
+                db_logger.debug(f"Database test query: 1 + 1 = {test_result}")
             
-            print("📊 Creating/verifying database tables...")
-            logger.info("Creating/verifying database tables")
+            db_logger.info("Creating/verifying database tables")
             await create_tables()
             
-            print("✅ Database initialized successfully!")
-            logger.info("Database initialized successfully")
-            print("=" * 50)
+            db_logger.info("Applying schema migrations")
+            await run_migrations()
+            
+            db_logger.info("Database initialized successfully")
             return
             
         except Exception as e:
-            print(f"❌ Database error: {type(e).__name__}: {e}")
-            logger.error(f"Database error: {type(e).__name__}: {e}")
+            db_logger.error(f"Database error: {type(e).__name__}: {e}")
             if attempt < max_retries - 1:
-                print(f"⏳ Retrying in {retry_delay} seconds...")
+                db_logger.info(f"Retrying in {retry_delay} seconds...")
                 await asyncio.sleep(retry_delay)
             else:
-                print("❌ Max retries reached. Could not initialize database.")
-                logger.error("Max retries reached. Could not initialize database.")
+                db_logger.error("Max retries reached. Could not initialize database.")
                 raise
 
 def mask_database_url(url):
@@ -176,7 +439,7 @@ async def create_tables():
             last_active TIMESTAMP DEFAULT NOW()
         )
         """)
-        print("  ✅ users table")
+        db_logger.debug("users table ready")
         
         # Swipes table - stores likes/swipes
         await conn.execute("""
@@ -188,7 +451,7 @@ async def create_tables():
             UNIQUE(liker_id, liked_id)
         )
         """)
-        print("  ✅ swipes table")
+        db_logger.debug("swipes table ready")
         
         # Active chats table - stores currently active conversations
         await conn.execute("""
@@ -201,7 +464,7 @@ async def create_tables():
             UNIQUE(partner_id)
         )
         """)
-        print("  ✅ active_chats table")
+        db_logger.debug("active_chats table ready")
         
         # Chat requests table - stores pending chat requests
         await conn.execute("""
@@ -215,7 +478,7 @@ async def create_tables():
             UNIQUE(requester_id, requested_id, status)
         )
         """)
-        print("  ✅ chat_requests table")
+        db_logger.debug("chat_requests table ready")
         
         # Reports table - stores user reports
         await conn.execute("""
@@ -230,7 +493,7 @@ async def create_tables():
             updated_at TIMESTAMP DEFAULT NOW()
         )
         """)
-        print("  ✅ reports table")
+        db_logger.debug("reports table ready")
         
         # Channel check table - tracks who joined the channel
         await conn.execute("""
@@ -243,16 +506,266 @@ async def create_tables():
             UNIQUE(user_id)
         )
         """)
-        print("  ✅ channel_checks table")
+        db_logger.debug("channel_checks table ready")
         
-        print("✅ All tables created/verified successfully!")
+        db_logger.info("All tables created/verified successfully!")
+
+# ---------------- Schema Migrations ----------------
+# Ordered, idempotent steps recorded in schema_version. Every statement runs on
+# its own (no surrounding transaction) so indexes can be built CONCURRENTLY
+# without locking the live tables during a deploy. A session advisory lock
+# makes replicas starting together take turns: the first applies the steps,
+# the rest find them recorded once they get the lock, so nobody mistakes an
+# index another replica is still building for an invalid one.
+MIGRATION_TIMEOUT = float(os.getenv("MIGRATION_TIMEOUT", "3600"))
+MIGRATION_LOCK_ID = 0x61755f626f74
+
+MIGRATIONS = [
+    (1, "swipes (liked_id, liker_id) index for match checks", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_swipes_liked_liker ON swipes (liked_id, liker_id)",
+    ]),
+    (2, "users (gender, is_banned) index for find_match", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_gender_banned ON users (gender, is_banned)",
+    ]),
+    (3, "chat_requests (requested_id, status) index for /requests", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chat_requests_requested_status ON chat_requests (requested_id, status)",
+    ]),
+    (4, "reports (status, created_at) index for the admin report queue", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_status_created ON reports (status, created_at)",
+    ]),
+    (5, "trigram indexes for admin user search", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_name_trgm ON users USING gin (name gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_username_trgm ON users USING gin (username gin_trgm_ops)",
+    ]),
+    (6, "users.blocked_bot flag for pruning broadcast recipients", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_bot BOOLEAN DEFAULT FALSE",
+    ]),
+    (7, "durable broadcast jobs and per-recipient deliveries", [
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            payload JSONB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running' CHECK (status IN ('running', 'completed')),
+            total INTEGER DEFAULT 0,
+            progress_chat_id BIGINT,
+            progress_message_id BIGINT,
+            created_at TIMESTAMP DEFAULT NOW(),
+            finished_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            job_id BIGINT NOT NULL REFERENCES broadcast_jobs(id) ON DELETE CASCADE,
+            telegram_id BIGINT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'claimed', 'sent', 'failed', 'blocked')),
+            claimed_by TEXT,
+            claimed_at TIMESTAMP,
+            attempts INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (job_id, telegram_id)
+        )
+        """,
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_broadcast_deliveries_open ON broadcast_deliveries (job_id, telegram_id) WHERE status IN ('pending', 'claimed')",
+    ]),
+    (8, "matches table written at like time, back-filled from swipes", [
+        """
+        CREATE TABLE IF NOT EXISTS matches (
+            min_id BIGINT NOT NULL,
+            max_id BIGINT NOT NULL,
+            matched_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (min_id, max_id),
+            CHECK (min_id < max_id)
+        )
+        """,
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_matches_max_id ON matches (max_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_matches_matched_at ON matches (matched_at)",
+        # A pair matched when the second of its two swipes was made
+        """
+        INSERT INTO matches (min_id, max_id, matched_at)
+        SELECT s1.liker_id, s1.liked_id, GREATEST(s1.created_at, s2.created_at)
+        FROM swipes s1
+        JOIN swipes s2 ON s2.liker_id = s1.liked_id AND s2.liked_id = s1.liker_id
+        WHERE s1.liker_id < s1.liked_id
+        ON CONFLICT DO NOTHING
+        """,
+    ]),
+    (9, "bot_stats counters and hourly/daily rollups for the admin dashboards", [
+        """
+        CREATE TABLE IF NOT EXISTS bot_stats (
+            name TEXT PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS bot_stats_rollups (
+            bucket TEXT NOT NULL CHECK (bucket IN ('hour', 'day')),
+            period_start TIMESTAMP NOT NULL,
+            name TEXT NOT NULL,
+            value BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, period_start, name)
+        )
+        """,
+    ]),
+    (10, "user_stats per-user counters for admin_view_user, back-filled by a recount", [
+        """
+        CREATE TABLE IF NOT EXISTS user_stats (
+            telegram_id BIGINT PRIMARY KEY,
+            likes_given INTEGER NOT NULL DEFAULT 0,
+            likes_received INTEGER NOT NULL DEFAULT 0,
+            matches INTEGER NOT NULL DEFAULT 0,
+            reports_made INTEGER NOT NULL DEFAULT 0,
+            reports_pending_against INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        queries.RECOUNT_USER_STATS,
+    ]),
+    (11, "keyset pagination indexes for the admin lists", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_created_id ON users (created_at, telegram_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_banned_created_id ON users (created_at, telegram_id) WHERE is_banned",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_pending_created_id ON reports (created_at, id) WHERE status = 'pending'",
+    ]),
+    (12, "bot_user_data and bot_conversations for the PTB persistence", [
+        """
+        CREATE TABLE IF NOT EXISTS bot_user_data (
+            user_id BIGINT PRIMARY KEY,
+            data JSONB NOT NULL,
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS bot_conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state JSONB NOT NULL,
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (name, key)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_bot_conversations_key ON bot_conversations (key)",
+    ]),
+    (13, "outbox of user notifications, with a trigger that wakes the dispatchers", [
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            payload JSONB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'failed', 'blocked')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            claimed_by TEXT,
+            claimed_at TIMESTAMP,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            sent_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (id) WHERE status = 'pending'",
+        """
+        CREATE OR REPLACE FUNCTION notify_outbox() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            -- Identical notifications in one transaction are delivered once
+            PERFORM pg_notify('outbox', '');
+            RETURN NULL;
+        END
+        $$
+        """,
+        "DROP TRIGGER IF EXISTS outbox_queued ON outbox",
+        "CREATE TRIGGER outbox_queued AFTER INSERT ON outbox FOR EACH ROW EXECUTE FUNCTION notify_outbox()",
+    ]),
+    (14, "chat_route_versions to order chat route changes per user", [
+        """
+        CREATE TABLE IF NOT EXISTS chat_route_versions (
+            user_id BIGINT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 1
+        )
+        """,
+    ]),
+    (15, "broadcast_jobs.paced_until to pace a job's sends across replicas", [
+        "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS paced_until TIMESTAMP",
+    ]),
+]
+
+CONCURRENT_INDEX_RE = re.compile(r"CREATE (?:UNIQUE )?INDEX CONCURRENTLY IF NOT EXISTS (\w+)", re.IGNORECASE)
+
+async def drop_invalid_index(conn, statement):
+    """Drop an index left INVALID by an interrupted CONCURRENTLY build so it gets rebuilt"""
+    match = CONCURRENT_INDEX_RE.search(statement)
+    if not match:
+        return
+    index_name = match.group(1)
+    is_invalid = await conn.fetchval("""
+        SELECT NOT i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = $1 AND pg_catalog.pg_table_is_visible(c.oid)
+    """, index_name)
+    if is_invalid:
+        db_logger.warning(f"Rebuilding invalid index {index_name}")
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}", timeout=MIGRATION_TIMEOUT)
+
+async def run_migrations():
+    """Apply pending schema migrations in version order, one replica at a time"""
+    behind_pooler = db_connection_mode not in (None, queries.DIRECT)
+    if behind_pooler and DATABASE_LISTEN_URL:
+        # A session lock needs the same backend for the whole run, which a
+        # transaction pooler doesn't give; use the session-mode URL instead
+        conn = await asyncpg.connect(dsn=DATABASE_LISTEN_URL, ssl=db_connect_args['ssl'], statement_cache_size=0)
+        try:
+            await apply_migrations(conn, lock=True)
+        finally:
+            await conn.close()
+        return
+
+    if behind_pooler:
+        db_logger.warning("No session connection for the migration lock (set DATABASE_LISTEN_URL); "
+                          "replicas starting together may run the same step")
+    async with db_pool.acquire() as conn:
+        await apply_migrations(conn, lock=not behind_pooler)
+
+async def apply_migrations(conn, lock: bool):
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT NOW()
+    )
+    """)
+
+    if lock:
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID, timeout=MIGRATION_TIMEOUT)
+    try:
+        # Read only once the lock is held: the previous holder may have applied steps
+        applied = {row['version'] for row in await conn.fetch("SELECT version FROM schema_version")}
+
+        for version, description, statements in MIGRATIONS:
+            if version in applied:
+                continue
+
+            db_logger.info(f"Migration {version}: {description}")
+            for statement in statements:
+                await drop_invalid_index(conn, statement)
+                await conn.execute(statement, timeout=MIGRATION_TIMEOUT)
+
+            await conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+                version, description
+            )
+
+        current = await conn.fetchval("SELECT MAX(version) FROM schema_version")
+        db_logger.info(f"Schema is at version {current or 0}")
+    finally:
+        if lock:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
 
+@instrumented(kind="db")
 async def save_profile(update, context):
     """Save user profile to PostgreSQL with better error handling"""
     try:
         user = update.effective_user
         if not user:
-            print("❌ No user in update")
+            db_logger.error("No user in update")
             return False
         
         async with db_pool.acquire() as conn:
@@ -267,50 +780,28 @@ async def save_profile(update, context):
             hobbies = context.user_data.get('hobbies')
             preference = context.user_data.get('preference') or "Both"
             
-            print(f"DEBUG: Saving profile for {user_id}, name: {name}")
-            
-            # First check if user exists
-            existing = await conn.fetchrow(
-                "SELECT telegram_id FROM users WHERE telegram_id = $1", 
-                user_id
-            )
+            db_logger.debug(f"Saving profile for {user_id}, name: {name}")
             
-            if existing:
-                # Update existing user
-                await conn.execute("""
-                    UPDATE users SET
-                    username = $1, 
-                    name = $2, 
-                    gender = $3, 
-                    campus = $4,
-                    photo_file_id = $5, 
-                    bio = $6, 
-                    hobbies = $7, 
-                    preference = $8,
-                    updated_at = NOW()
-                    WHERE telegram_id = $9
-                """, 
-                username, name, gender, campus, photo_file_id, 
-                bio, hobbies, preference, user_id
-                )
-                print(f"✅ Updated profile for user {user_id}")
-            else:
-                # Insert new user - FIXED
-                await conn.execute("""
-                    INSERT INTO users 
-                    (telegram_id, username, name, gender, campus, 
-                     photo_file_id, bio, hobbies, preference) 
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-                """, 
-                user_id, username, name, gender, campus, 
+            # Insert or update in one statement; xmax is 0 only for a fresh insert
+            async with conn.transaction():
+                row = await conn.fetchrow(queries.UPSERT_PROFILE,
+                user_id, username, name, gender, campus,
                 photo_file_id, bio, hobbies, preference
                 )
-                print(f"✅ Created new profile for user {user_id}")
+                if row['inserted']:
+                    await bump_stats(conn, users=1)
+            if row['inserted']:
+                db_logger.info(f"Created new profile for user {user_id}")
+            else:
+                db_logger.info(f"Updated profile for user {user_id}")
+            index_candidates('upsert', user_id, gender, campus)
             
-            # ✅ DEBUG: Check if user was saved
+            invalidate_user_cache(user_id)
+        
+        if DIAGNOSTICS:
             await debug_user_exists(user_id)
-            
-            return True
+        
+        return True
             
     except Exception as e:
         # Get user ID safely
@@ -321,64 +812,88 @@ async def save_profile(update, context):
         except:
             pass
         
-        print(f"❌ Error saving profile for user {user_id}: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
+        db_logger.exception(f"Error saving profile for user {user_id}: {type(e).__name__}: {e}")
         return False
+@instrumented(kind="db")
 async def get_user_by_telegram_id(user_id: int):
     """Get user by Telegram ID"""
     try:
         async with db_pool.acquire() as conn:
-            return await conn.fetchrow(
-                "SELECT * FROM users WHERE telegram_id = $1", 
-                user_id
-            )
+            return await conn.fetchrow(queries.USER_BY_ID, user_id)
     except Exception as e:
-        print(f"❌ Error getting user {user_id}: {e}")
+        db_logger.error(f"Error getting user {user_id}: {e}")
         return None
 
 async def is_user_banned(user_id: int) -> bool:
     """Check if user is banned"""
     try:
-        async with db_pool.acquire() as conn:
-            result = await conn.fetchval(
-                "SELECT is_banned FROM users WHERE telegram_id = $1", 
-                user_id
-            )
-            return result if result else False
+        return (await get_cached_user(user_id))['is_banned']
     except Exception as e:
-        print(f"❌ Error checking ban status for user {user_id}: {e}")
+        db_logger.error(f"Error checking ban status for user {user_id}: {e}")
         return False
 
-async def update_last_active(user_id: int):
-    """Update user's last active timestamp"""
+# ---------------- Touch Buffer ----------------
+# last_active is touched on every update, so writing it through would add a
+# statement per message. Instead the latest timestamp per user is kept in
+# memory and written in one UPDATE ... FROM unnest() every few seconds and on
+# shutdown. A crash loses at most one interval of activity times.
+TOUCH_FLUSH_INTERVAL = float(os.getenv("TOUCH_FLUSH_INTERVAL", "5"))
+
+touch_buffer = {}
+touch_stats = {'touched': 0, 'flushed': 0, 'flushes': 0, 'errors': 0}
+
+def update_last_active(user_id: int):
+    """Record activity for user_id; written on the next flush"""
+    touch_buffer[user_id] = datetime.now(timezone.utc)
+    touch_stats['touched'] += 1
+
+async def touch_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs before every handler group and records who was active"""
+    if update.effective_user:
+        update_last_active(update.effective_user.id)
+
+@instrumented(kind="db")
+async def flush_touch_buffer():
+    """Write buffered activity timestamps in a single statement"""
+    global touch_buffer
+    if not touch_buffer or not db_pool:
+        return 0
+    pending, touch_buffer = touch_buffer, {}
     try:
         async with db_pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE users SET last_active = NOW() WHERE telegram_id = $1", 
-                user_id
-            )
-    except:
-        pass  # Silently fail for this non-critical operation
+            await conn.execute(queries.TOUCH_LAST_ACTIVE, list(pending), list(pending.values()))
+    except Exception as e:
+        touch_stats['errors'] += 1
+        db_logger.error(f"Error flushing {len(pending)} activity timestamps: {e}")
+        # Keep them for the next flush unless the user was seen again since
+        for user_id, seen_at in pending.items():
+            touch_buffer.setdefault(user_id, seen_at)
+        return 0
+    touch_stats['flushed'] += len(pending)
+    touch_stats['flushes'] += 1
+    return len(pending)
+
+async def touch_flusher():
+    while True:
+        await asyncio.sleep(TOUCH_FLUSH_INTERVAL)
+        await flush_touch_buffer()
+
+ValueMetric("bot_touch_buffer_pending", "Users whose last_active is waiting to be flushed", lambda: len(touch_buffer))
+ValueMetric("bot_touch_flushed_total", "last_active rows written by the touch buffer", lambda: touch_stats['flushed'], "counter")
 
 async def debug_user_exists(user_id: int):
     """Debug function to check if user exists in database"""
     try:
         async with db_pool.acquire() as conn:
-            user = await conn.fetchrow(
-                "SELECT * FROM users WHERE telegram_id = $1", 
-                user_id
-            )
+            user = await conn.fetchrow(queries.USER_BY_ID, user_id)
             if user:
-                print(f"✅ DEBUG: User {user_id} exists in database:")
-                print(f"   Name: {user['name']}")
-                print(f"   Created: {user['created_at']}")
+                db_logger.debug(f"User {user_id} exists in database", extra={'created_at': user['created_at']})
                 return True
             else:
-                print(f"❌ DEBUG: User {user_id} NOT found in database")
+                db_logger.warning(f"User {user_id} NOT found in database")
                 return False
     except Exception as e:
-        print(f"❌ DEBUG Error: {e}")
+        db_logger.error(f"Error checking user {user_id} exists: {e}")
         return False
 # Add this function right after the debug_user_exists function
 
@@ -390,7 +905,7 @@ async def debug_db(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     async with db_pool.acquire() as conn:
         # Check if user exists
-        user = await conn.fetchrow("SELECT * FROM users WHERE telegram_id = $1", user_id)
+        user = await conn.fetchrow(queries.USER_BY_ID, user_id)
         if user:
             await update.message.reply_text(
                 f"✅ User found in database:\n"
@@ -403,49 +918,195 @@ async def debug_db(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ User NOT found in database")
         
         # Get total user count
-        count = await conn.fetchval("SELECT COUNT(*) FROM users")
+        count = await conn.fetchval(queries.COUNT_USERS)
         await update.message.reply_text(f"📊 Total users in database: {count}")
 
 
+# ---------------- User Context ----------------
+class UserContext:
+    """Snapshot of a user's profile row and active-chat partner for one update"""
+
+    def __init__(self, user_id, row):
+        self.user_id = user_id
+        self.profile = row if row['has_profile'] else None
+        self.partner_id = row['partner_id']
+        # None until the user's channel membership has been checked once
+        self.channel_joined = row['channel_joined']
+        self.channel_fresh = bool(row['channel_fresh'])
+
+    @property
+    def has_profile(self):
+        return self.profile is not None
+
+    @property
+    def is_banned(self):
+        return bool(self.profile and self.profile['is_banned'])
+
+    @property
+    def in_chat(self):
+        return self.partner_id is not None
+
+    @property
+    def name(self):
+        return self.profile['name'] if self.profile else None
+
+    @property
+    def preference(self):
+        return self.profile['preference'] if self.profile else None
+
+@instrumented(kind="db")
+async def fetch_user_context(user_id: int):
+    """Load a user's profile and chat partner in a single round trip"""
+    generation = user_cache_generation
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow(queries.USER_CONTEXT, user_id, CHANNEL_CHECK_TTL)
+    user_ctx = UserContext(user_id, row)
+    cache_user_context(user_ctx, generation)
+    return user_ctx
+
+async def get_user_context(update: Update, context: ContextTypes.DEFAULT_TYPE, refresh: bool = False):
+    """Get the UserContext for the update's user, loading it at most once per update"""
+    user_ctx = getattr(context, 'user_ctx', None)
+    if user_ctx is None or refresh:
+        user_ctx = await fetch_user_context(update.effective_user.id)
+        context.user_ctx = user_ctx
+    return user_ctx
+
+# ---------------- User Cache ----------------
+# Bounded LRU+TTL cache of the fields read on every chat message: ban flag,
+# display name and current partner. Handlers that change any of them must call
+# invalidate_user_cache(); the TTL only bounds staleness from other replicas.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+
+# telegram_id -> (expires_at, {'is_banned': bool, 'name': str, 'partner_id': int})
+user_cache = OrderedDict()
+user_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+user_cache_generation = 0
+
+def cache_user_context(user_ctx, generation):
+    """Store the cached fields of a freshly loaded UserContext"""
+    # Skip if anything was invalidated while the row was being loaded
+    if generation != user_cache_generation:
+        return
+    entry = {
+        'is_banned': user_ctx.is_banned,
+        'name': user_ctx.name,
+        'partner_id': user_ctx.partner_id,
+    }
+    user_cache[user_ctx.user_id] = (time.monotonic() + USER_CACHE_TTL, entry)
+    user_cache.move_to_end(user_ctx.user_id)
+    while len(user_cache) > USER_CACHE_SIZE:
+        user_cache.popitem(last=False)
+
+async def get_cached_user(user_id: int):
+    """Get ban flag, name and partner for a user, hitting the database only on a miss"""
+    cached = user_cache.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        user_cache.move_to_end(user_id)
+        user_cache_stats['hits'] += 1
+        return cached[1]
+
+    user_cache_stats['misses'] += 1
+    user_ctx = await fetch_user_context(user_id)
+    return {'is_banned': user_ctx.is_banned, 'name': user_ctx.name, 'partner_id': user_ctx.partner_id}
+
+def invalidate_user_cache(*user_ids):
+    """Forget cached state for users whose ban, name or chat partner changed"""
+    global user_cache_generation
+    user_cache_generation += 1
+    for user_id in user_ids:
+        if user_id is not None and user_cache.pop(user_id, None) is not None:
+            user_cache_stats['invalidations'] += 1
+
+def user_cache_info():
+    """Cache counters for the admin logs and debug endpoint"""
+    lookups = user_cache_stats['hits'] + user_cache_stats['misses']
+    return {
+        **user_cache_stats,
+        'size': len(user_cache),
+        'hit_rate': round(user_cache_stats['hits'] / lookups, 3) if lookups else 0.0,
+    }
+
 # ---------------- Channel Check ----------------
+# Membership lives in channel_checks and is kept current by chat_member
+# updates for the channel (the bot must be a channel admin to receive them).
+# A positive result is trusted for CHANNEL_CHECK_TTL before getChatMember is
+# asked again; users who haven't joined yet are always checked live.
+CHANNEL_CHECK_TTL = float(os.getenv("CHANNEL_CHECK_TTL", "86400"))
+CHANNEL_MEMBER_STATUSES = ('member', 'administrator', 'creator')
+
 async def check_channel_membership(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """Check if user is a member of the required channel"""
     try:
         chat_member = await context.bot.get_chat_member(CHANNEL_USERNAME, user_id)
-        return chat_member.status in ['member', 'administrator', 'creator']
+        return chat_member.status in CHANNEL_MEMBER_STATUSES
     except Exception as e:
-        print(f"Warning checking channel membership: {e}")
+        profile_logger.warning(f"Error checking channel membership: {e}")
         return False
+
 async def update_channel_check(user_id: int, has_joined: bool):
-    """Update channel check status in database"""
+    """Record a membership result; only writes if it changed or the row is stale"""
     try:
         async with db_pool.acquire() as conn:
-            # Delete old record first, then insert new
-            await conn.execute("DELETE FROM channel_checks WHERE user_id = $1", user_id)
-            await conn.execute("INSERT INTO channel_checks (user_id, has_joined) VALUES ($1, $2)", 
-                              user_id, has_joined)
+            await conn.execute(queries.UPSERT_CHANNEL_CHECK, user_id, has_joined, CHANNEL_CHECK_TTL / 2)
     except Exception as e:
-        print(f"Warning: Failed to update channel check for user {user_id}: {e}")
+        profile_logger.warning(f"Failed to update channel check for user {user_id}: {e}")
+
+async def is_channel_member(update: Update, context: ContextTypes.DEFAULT_TYPE, force: bool = False) -> bool:
+    """Channel gate: answer from channel_checks, asking Telegram only when needed"""
+    user_ctx = await get_user_context(update, context)
+    if not force and user_ctx.channel_joined and user_ctx.channel_fresh:
+        return True
+
+    has_joined = await check_channel_membership(user_ctx.user_id, context)
+    await update_channel_check(user_ctx.user_id, has_joined)
+    user_ctx.channel_joined = has_joined
+    user_ctx.channel_fresh = True
+    return has_joined
+
+def is_required_channel(chat) -> bool:
+    if CHANNEL_USERNAME.startswith("@"):
+        return (chat.username or "").lower() == CHANNEL_USERNAME[1:].lower()
+    return str(chat.id) == CHANNEL_USERNAME
+
+async def track_channel_membership(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Keep channel_checks in sync with join/leave events in the required channel"""
+    member_update = update.chat_member
+    if not member_update or not is_required_channel(member_update.chat):
+        return
+    user_id = member_update.new_chat_member.user.id
+    has_joined = member_update.new_chat_member.status in CHANNEL_MEMBER_STATUSES
+    was_member = member_update.old_chat_member.status in CHANNEL_MEMBER_STATUSES
+    if has_joined != was_member:
+        await update_channel_check(user_id, has_joined)
+        profile_logger.debug(f"Channel membership of {user_id} changed", extra={'has_joined': has_joined})
 
 # ---------------- Start ----------------
+@instrumented
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    print(f"🔍 DEBUG: /start called by user {user_id}")
-    await debug_user_exists(user_id)
+    profile_logger.debug(f"/start called by user {user_id}")
+    if DIAGNOSTICS:
+        await debug_user_exists(user_id)
     
     # Clear any previous context data
     context.user_data.clear()
     
+    user_ctx = await get_user_context(update, context)
+    
     # Check if user is banned
-    async with db_pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT is_banned FROM users WHERE telegram_id = $1", user_id)
-        if row and row['is_banned']:
-            await update.message.reply_text("❌ You have been banned from using this bot.")
-            return ConversationHandler.END
+    if user_ctx.is_banned:
+        await update.message.reply_text("❌ You have been banned from using this bot.")
+        return ConversationHandler.END
+    
+    # Pressing Start again after blocking the bot makes the user reachable again
+    if user_ctx.profile and user_ctx.profile['blocked_bot']:
+        async with db_pool.acquire() as conn:
+            await conn.execute(queries.CLEAR_BLOCKED_BOT, user_id)
     
     # Check channel membership
-    has_joined = await check_channel_membership(user_id, context)
-    await update_channel_check(user_id, has_joined)
+    has_joined = await is_channel_member(update, context)
     
     if not has_joined:
         keyboard = InlineKeyboardMarkup([
@@ -472,22 +1133,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
     
     # Check if user is already in a chat
-    async with db_pool.acquire() as conn:
-        chat_row = await conn.fetchrow("SELECT partner_id FROM active_chats WHERE user_id = $1", user_id)
-        if chat_row:
-            await update.message.reply_text("❌ You are currently in a chat. Please use /stop to end your current conversation before starting a new registration.")
-            return ConversationHandler.END
-    
-    # Check if user already has a profile - FIXED QUERY
-    async with db_pool.acquire() as conn:
-        user = await conn.fetchrow(
-            "SELECT name, telegram_id FROM users WHERE telegram_id = $1", 
-            user_id
-        )
+    if user_ctx.in_chat:
+        await update.message.reply_text("❌ You are currently in a chat. Please use /stop to end your current conversation before starting a new registration.")
+        return ConversationHandler.END
     
-    if user:
+    # Check if user already has a profile
+    if user_ctx.has_profile:
         await update.message.reply_text(
-            f"Welcome back, {user['name']}! 🤗\n\n"
+            f"Welcome back, {user_ctx.name}! 🤗\n\n"
             f"Use /find to meet people or /myprofile to view your profile.\n"
             f"Use /settings to change preferences.\n"
             f"Use /report to report inappropriate behavior.",
@@ -509,18 +1162,17 @@ async def check_channel_callback(update: Update, context: ContextTypes.DEFAULT_T
     await query.answer()
     
     user_id = query.from_user.id
-    has_joined = await check_channel_membership(user_id, context)
-    await update_channel_check(user_id, has_joined)
+    # The user says they just joined, so always ask Telegram
+    has_joined = await is_channel_member(update, context, force=True)
     
     if has_joined:
         # User has joined, now check if they have a profile
-        async with db_pool.acquire() as conn:
-            user = await conn.fetchrow("SELECT name FROM users WHERE telegram_id = $1", user_id)
+        user_ctx = await get_user_context(update, context)
         
-        if user:
+        if user_ctx.has_profile:
             # Existing user
             await query.edit_message_text(
-                f"<b>✅ WELCOME BACK, {user['name']}! 🤗</b>\n\n"
+                f"<b>✅ WELCOME BACK, {user_ctx.name}! 🤗</b>\n\n"
                 f"You're all set! Use the commands below:\n"
                 f"• /find - Meet new people\n"
                 f"• /myprofile - View your profile\n"
@@ -737,7 +1389,7 @@ async def review_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         success = await save_profile(update, context)  # ✅ Get the return value
         
         user_id = update.effective_user.id
-        print(f"🔍 DEBUG: Profile save {'successful' if success else 'failed'} for user {user_id}")
+        profile_logger.debug(f"Profile save {'successful' if success else 'failed'} for user {user_id}")
         
         if 'editing' in context.user_data:
             context.user_data.pop('editing', None)
@@ -900,12 +1552,175 @@ def get_main_menu():
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
+# ---------------- Notifications ----------------
+# One dedicated connection LISTENs on every channel in notify_channels so
+# replicas hear about each other's writes (chat routes, persisted state).
+# Each channel has a callback for payloads and an on_subscribe hook that
+# resyncs whatever may have been missed while disconnected. Transaction
+# poolers drop LISTEN; behind one, set DATABASE_LISTEN_URL to a session-mode
+# URL or notifications are not received at all.
+DATABASE_LISTEN_URL = os.getenv("DATABASE_LISTEN_URL")
+NOTIFY_PING_INTERVAL = float(os.getenv("NOTIFY_PING_INTERVAL", "60"))
+NOTIFY_RECONNECT_DELAY = 5
+
+# channel -> (callback(connection, pid, channel, payload), async on_subscribe())
+notify_channels = {}
+notify_stats = {'listening': False, 'connects': 0}
+
+async def notify_listener():
+    """Hold the LISTEN connection open until cancelled, reconnecting as needed"""
+    if not DATABASE_LISTEN_URL and db_connection_mode != queries.DIRECT:
+        db_logger.warning("No session connection for LISTEN (set DATABASE_LISTEN_URL); cross-replica sync is off")
+        return
+
+    dsn = DATABASE_LISTEN_URL or db_connect_args['dsn']
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(dsn=dsn, ssl=db_connect_args['ssl'], statement_cache_size=0)
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda _: lost.set())
+            for channel, (callback, _) in notify_channels.items():
+                await conn.add_listener(channel, callback)
+            notify_stats['listening'] = True
+            notify_stats['connects'] += 1
+            db_logger.info(f"Listening on {', '.join(notify_channels)}")
+            # Resync after subscribing so changes made while disconnected aren't lost
+            for _, on_subscribe in notify_channels.values():
+                await on_subscribe()
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), NOTIFY_PING_INTERVAL)
+                except asyncio.TimeoutError:
+                    await conn.fetchval("SELECT 1")
+            db_logger.warning("LISTEN connection closed")
+        except Exception as e:
+            db_logger.error(f"LISTEN connection error: {e}")
+        finally:
+            notify_stats['listening'] = False
+            if conn is not None:
+                conn.terminate()
+        await asyncio.sleep(NOTIFY_RECONNECT_DELAY)
+
+# ---------------- Chat Router ----------------
+# user_id -> partner_id for every active chat, kept in memory so relaying a
+# message is a dict lookup. Loaded with one query at startup. The statements
+# that start or end chats (queries.START_CHAT, ACCEPT_CHAT_REQUEST, END_CHATS)
+# bump a per-user version in chat_route_versions and pg_notify the versioned
+# change as part of the write. The writer applies the change as soon as the
+# statement returns and every replica applies the notifications; a change is
+# skipped for users already at that version or later, so the writer's own
+# notification is a no-op and a handler that resumes after a later commit's
+# notification can't roll the routes back.
+CHAT_ROUTER_CHANNEL = "chat_routes"
+# Full reload to repair missed notifications, and the poll interval without LISTEN
+CHAT_ROUTER_RELOAD = float(os.getenv("CHAT_ROUTER_RELOAD", "300"))
+CHAT_ROUTER_POLL = float(os.getenv("CHAT_ROUTER_POLL", "5"))
+# Attempts at a pairing statement that lost a race with a concurrent one
+CHAT_PAIRING_ATTEMPTS = 3
+
+chat_routes = {}
+# user_id -> version of the last route change applied for that user
+chat_route_versions = {}
+chat_router_stats = {'loaded': False, 'notifications': 0, 'reloads': 0}
+# Changes seen while a reload is reading active_chats, replayed onto the result
+chat_routes_journal = None
+
+def apply_chat_routes(routes, versions, changes):
+    """Apply [user_id, partner_id or None, version] changes newer than what's applied; returns the users changed"""
+    changed = []
+    for user_id, partner_id, version in changes:
+        if version <= versions.get(user_id, 0):
+            continue
+        versions[user_id] = version
+        if partner_id is None:
+            routes.pop(user_id, None)
+        else:
+            routes[user_id] = partner_id
+        changed.append(user_id)
+    return changed
+
+def record_chat_routes(changes):
+    if chat_routes_journal is not None:
+        chat_routes_journal.append(changes)
+    return apply_chat_routes(chat_routes, chat_route_versions, changes)
+
+@instrumented(kind="db")
+async def run_chat_statement(sql: str, *args):
+    """Run one of the pairing statements and apply its route changes locally"""
+    for attempt in range(1, CHAT_PAIRING_ATTEMPTS + 1):
+        try:
+            async with db_pool.acquire() as conn:
+                row = await conn.fetchrow(sql, *args, ROLLUP_STATS, CHAT_ROUTER_CHANNEL)
+            break
+        except (asyncpg.UniqueViolationError, asyncpg.DeadlockDetectedError) as e:
+            # A concurrent statement paired one of these users first; the
+            # retry sees its rows and ends that chat instead
+            if attempt == CHAT_PAIRING_ATTEMPTS:
+                raise
+            chat_logger.debug(f"Retrying chat statement after {type(e).__name__} (attempt {attempt})")
+    if row is not None:
+        record_chat_routes(json.loads(row['routes']))
+    return row
+
+def on_chat_routes_notify(connection, pid, channel, payload):
+    try:
+        changes = json.loads(payload)
+    except ValueError:
+        changes = None
+    if not isinstance(changes, list):
+        chat_logger.warning(f"Ignoring malformed chat route notification: {payload[:100]}")
+        return
+    changed = record_chat_routes(changes)
+    chat_router_stats['notifications'] += 1
+    # The user cache holds the partner too; drop it for chats changed elsewhere
+    if changed:
+        invalidate_user_cache(*changed)
+
+async def load_chat_routes():
+    """Replace the routes with a fresh read of active_chats"""
+    global chat_routes, chat_route_versions, chat_routes_journal
+    chat_routes_journal = []
+    try:
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch(queries.CHAT_ROUTES)
+        routes = {row['user_id']: row['partner_id'] for row in rows if row['partner_id'] is not None}
+        versions = {row['user_id']: row['version'] for row in rows}
+        for changes in chat_routes_journal:
+            apply_chat_routes(routes, versions, changes)
+        chat_routes, chat_route_versions = routes, versions
+        chat_router_stats['loaded'] = True
+        chat_router_stats['reloads'] += 1
+        chat_logger.debug(f"Chat routes loaded: {len(routes) // 2} chats")
+    except Exception as e:
+        chat_logger.error(f"Error loading chat routes: {e}")
+    finally:
+        chat_routes_journal = None
+
+async def chat_partner(user_id: int):
+    """Current chat partner, from memory once the routes have been loaded"""
+    if chat_router_stats['loaded']:
+        return chat_routes.get(user_id)
+    return (await get_cached_user(user_id))['partner_id']
+
+async def chat_router_refresher():
+    while True:
+        await asyncio.sleep(CHAT_ROUTER_RELOAD if notify_stats['listening'] else CHAT_ROUTER_POLL)
+        await load_chat_routes()
+
+notify_channels[CHAT_ROUTER_CHANNEL] = (on_chat_routes_notify, load_chat_routes)
+
+ValueMetric("bot_chat_routes", "Users with an in-memory chat route", lambda: len(chat_routes))
+ValueMetric("bot_chat_route_notifications_total", "Chat route notifications applied",
+            lambda: chat_router_stats['notifications'], kind="counter")
+
 # ---------------- Chat System ----------------
+@instrumented
 async def chat_relay(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Relay text messages between matched users"""
     # Check if update.effective_user exists
     if not update.effective_user:
-        print("Warning: update.effective_user is None in chat_relay")
+        chat_logger.warning("update.effective_user is None in chat_relay")
         return
     
     user_id = update.effective_user.id
@@ -919,31 +1734,36 @@ async def chat_relay(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_text_edit(update, context)
         return
     
-    async with db_pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT partner_id FROM active_chats WHERE user_id = $1", user_id)
-        
-        if row:
-            partner_id = row['partner_id']
-            name_row = await conn.fetchrow("SELECT name FROM users WHERE telegram_id = $1", user_id)
-            sender_name = name_row['name'] if name_row else "User"
-
-            try:
-                await context.bot.send_message(
-                    chat_id=partner_id, 
-                    text=f"💬 {sender_name}: {update.message.text}"
-                )
-            except Exception as e:
-                print(f"Error relaying message: {e}")
-                # Clean up if partner is unavailable
-                await conn.execute("DELETE FROM active_chats WHERE user_id = $1 OR partner_id = $1", user_id)
-                await conn.execute("DELETE FROM active_chats WHERE user_id = $1 OR partner_id = $1", partner_id)
-                await update.message.reply_text("❌ Your partner is no longer available. Chat ended.")
+    partner_id = await chat_partner(user_id)
+    
+    if partner_id:
+        sender = await get_cached_user(user_id)
+        sender_name = sender['name'] or "User"
 
+        try:
+            await context.bot.send_message(
+                chat_id=partner_id, 
+                text=f"💬 {sender_name}: {update.message.text}"
+            )
+        except Exception as e:
+            chat_logger.error(f"Error relaying message: {e}")
+            # Clean up if partner is unavailable
+            await end_unavailable_chat(user_id, partner_id)
+            await update.message.reply_text("❌ Your partner is no longer available. Chat ended.")
+
+@instrumented(kind="db")
+async def end_unavailable_chat(user_id: int, partner_id: int):
+    """Drop a chat whose partner can no longer be reached"""
+    row = await run_chat_statement(queries.END_CHATS, [user_id, partner_id], None)
+    invalidate_user_cache(user_id, partner_id, *row['ended'])
+    index_candidates('set_flag', IN_CHAT, False, user_id, partner_id, *row['ended'])
+
+@instrumented
 async def photo_relay(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Relay photos between matched users in active chat"""
     # Check if update.effective_user exists
     if not update.effective_user:
-        print("Warning: update.effective_user is None in photo_relay")
+        chat_logger.warning("update.effective_user is None in photo_relay")
         return
     
     user_id = update.effective_user.id
@@ -954,45 +1774,38 @@ async def photo_relay(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_photo_edit(update, context)
         return
     
-    async with db_pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT partner_id FROM active_chats WHERE user_id = $1", user_id)
-            
-        if row:
-            partner_id = row['partner_id']
-            name_row = await conn.fetchrow("SELECT name FROM users WHERE telegram_id = $1", user_id)
-            sender_name = name_row['name'] if name_row else "User"
-            
-            try:
-                await context.bot.send_photo(
-                    chat_id=partner_id,
-                    photo=update.message.photo[-1].file_id,
-                    caption=f"📷 Photo from {sender_name}"
-                )
-            except Exception as e:
-                print(f"Error sending photo: {e}")
-                await conn.execute("DELETE FROM active_chats WHERE user_id = $1 OR partner_id = $1", user_id)
-                await conn.execute("DELETE FROM active_chats WHERE user_id = $1 OR partner_id = $1", partner_id)
-                await update.message.reply_text("❌ Your partner is no longer available. Chat ended.")
+    partner_id = await chat_partner(user_id)
+        
+    if partner_id:
+        sender = await get_cached_user(user_id)
+        sender_name = sender['name'] or "User"
+        
+        try:
+            await context.bot.send_photo(
+                chat_id=partner_id,
+                photo=update.message.photo[-1].file_id,
+                caption=f"📷 Photo from {sender_name}"
+            )
+        except Exception as e:
+            chat_logger.error(f"Error sending photo: {e}")
+            await end_unavailable_chat(user_id, partner_id)
+            await update.message.reply_text("❌ Your partner is no longer available. Chat ended.")
 
 # ---------------- Report System ----------------
 async def report_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start report process"""
-    user_id = update.effective_user.id
-    
     # Check if user is in a chat
-    async with db_pool.acquire() as conn:
-        chat_row = await conn.fetchrow("SELECT partner_id FROM active_chats WHERE user_id = $1", user_id)
-        if chat_row:
-            partner_id = chat_row['partner_id']
-            context.user_data['reporting_user_id'] = partner_id
-            
-            await update.message.reply_text(
-                "<b>⚠️ REPORTING USER</b>\n\n"
-                "You are about to report the user you're currently chatting with.\n"
-                "Please describe the reason for your report:",
-                parse_mode="HTML"
-            )
-            return REPORT_REASON
+    user_ctx = await get_user_context(update, context)
+    if user_ctx.in_chat:
+        context.user_data['reporting_user_id'] = user_ctx.partner_id
+        
+        await update.message.reply_text(
+            "<b>⚠️ REPORTING USER</b>\n\n"
+            "You are about to report the user you're currently chatting with.\n"
+            "Please describe the reason for your report:",
+            parse_mode="HTML"
+        )
+        return REPORT_REASON
     
     await update.message.reply_text(
         "<b>📢 REPORT A USER</b>\n\n"
@@ -1017,14 +1830,8 @@ async def report_reason(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Reason too long! Max 500 characters.")
         return REPORT_REASON
     
-    # Save report to database
-    async with db_pool.acquire() as conn:
-        await conn.execute(
-            "INSERT INTO reports (reporter_id, reported_id, reason) VALUES ($1, $2, $3)",
-            user_id, reported_id, reason
-        )
-    
     # Notify admin if admin ID is set
+    notifications = []
     if ADMIN_USER_ID:
         admin_message = (
             f"<b>🚨 NEW USER REPORT</b>\n\n"
@@ -1033,14 +1840,14 @@ async def report_reason(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"<b>📝 Reason:</b> {reason}\n\n"
             f"Use /admin to review this report."
         )
-        try:
-            await context.bot.send_message(
-                chat_id=ADMIN_USER_ID, 
-                text=admin_message, 
-                parse_mode="HTML"
-            )
-        except:
-            pass
+        notifications.append((ADMIN_USER_ID, notification(admin_message)))
+    
+    # Save report to database, queueing the admin notification with it
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(queries.INSERT_REPORT, user_id, reported_id, reason)
+            await bump_stats(conn, reports=1, pending_reports=1)
+            await enqueue_notifications(conn, notifications)
     
     await update.message.reply_text(
         "✅ Thank you for your report. We will review it and take appropriate action.\n\n"
@@ -1048,15 +1855,206 @@ async def report_reason(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ConversationHandler.END
 
+# ---------------- Candidate Index ----------------
+# Every profile's gender, campus, ban/in-chat flags and liked ids held in NumPy
+# arrays (see candidate_index.py), so refilling a candidate queue is a masked
+# sample in memory instead of a filtered scan in Postgres. Handlers that change
+# those fields update the index as they write. Other replicas' writes are only
+# picked up by the periodic rebuild, which is why next_candidate still
+# re-reads each row before showing it.
+CANDIDATE_INDEX = os.getenv("CANDIDATE_INDEX", "true").lower() in ("1", "true", "yes")
+CANDIDATE_INDEX_REFRESH = float(os.getenv("CANDIDATE_INDEX_REFRESH", "600"))
+CANDIDATE_INDEX_PREFETCH = int(os.getenv("CANDIDATE_INDEX_PREFETCH", "5000"))
+
+# None until the first build finishes; queues fall back to SQL meanwhile
+candidate_index = None
+# Changes made while a rebuild is streaming, replayed onto the new index
+candidate_index_journal = None
+
+def index_candidates(method: str, *args):
+    """Apply a change to the candidate index and to any rebuild in progress"""
+    if candidate_index is not None:
+        getattr(candidate_index, method)(*args)
+    if candidate_index_journal is not None:
+        candidate_index_journal.append((method, args))
+
+async def build_candidate_index():
+    """Stream every profile into a fresh CandidateIndex"""
+    index = CandidateIndex()
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            async for row in conn.cursor(queries.CANDIDATE_INDEX_ROWS, prefetch=CANDIDATE_INDEX_PREFETCH):
+                index.upsert(row['telegram_id'], row['gender'], row['campus'],
+                             banned=bool(row['is_banned']), in_chat=row['in_chat'])
+                if row['liked']:
+                    index.set_liked(row['telegram_id'], row['liked'])
+    return index
+
+async def refresh_candidate_index():
+    global candidate_index, candidate_index_journal
+    candidate_index_journal = []
+    started = time.monotonic()
+    try:
+        index = await build_candidate_index()
+        for method, args in candidate_index_journal:
+            getattr(index, method)(*args)
+        candidate_index = index
+        profile_bytes, liked_bytes = index.nbytes()
+        match_logger.info(f"Candidate index built: {len(index)} profiles", extra={
+            'seconds': round(time.monotonic() - started, 2),
+            'mb': round((profile_bytes + liked_bytes) / 1e6, 1),
+        })
+    except Exception as e:
+        match_logger.error(f"Error building candidate index: {e}")
+    finally:
+        candidate_index_journal = None
+
+async def candidate_index_refresher():
+    while True:
+        await refresh_candidate_index()
+        await asyncio.sleep(CANDIDATE_INDEX_REFRESH)
+
+ValueMetric("bot_candidate_index_profiles", "Profiles held in the in-memory candidate index",
+            lambda: len(candidate_index) if candidate_index is not None else 0)
+
+# ---------------- Candidate Queue ----------------
+# Each user gets a shuffled batch of eligible profile ids so a swipe only has to
+# re-check the head of the queue and fetch the first eligible row instead of
+# sampling the users table.
+CANDIDATE_BATCH_SIZE = int(os.getenv("CANDIDATE_BATCH_SIZE", "200"))
+CANDIDATE_REFILL_THRESHOLD = max(1, CANDIDATE_BATCH_SIZE // 4)
+# Queued ids re-checked per query on a swipe
+CANDIDATE_CHECK_SIZE = int(os.getenv("CANDIDATE_CHECK_SIZE", "10"))
+# Without the candidate index, a batch is drawn at random from a window of
+# this many times its size
+CANDIDATE_SAMPLE_FACTOR = int(os.getenv("CANDIDATE_SAMPLE_FACTOR", "4"))
+CANDIDATE_MAX_QUEUES = int(os.getenv("CANDIDATE_MAX_QUEUES", "5000"))
+
+# user_id -> {'pref': str, 'ids': deque, 'refill': asyncio.Task or None}
+candidate_queues = OrderedDict()
+
+def preference_genders(pref):
+    """Map a stored preference to the genders it matches"""
+    if pref == "Both":
+        return ['Male', 'Female']
+    return [pref]
+
+@instrumented(kind="db")
+async def fetch_candidate_batch(user_id: int, pref: str, limit: int = CANDIDATE_BATCH_SIZE):
+    """Fetch a random batch of eligible profile ids for a user"""
+    # Don't include:
+    # - Banned users
+    # - Users already liked
+    # - Users currently in active chats
+    if candidate_index is not None:
+        return candidate_index.candidates(user_id, preference_genders(pref), limit)
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(queries.CANDIDATE_BATCH, user_id, preference_genders(pref), limit,
+                                limit * CANDIDATE_SAMPLE_FACTOR)
+    return [row['telegram_id'] for row in rows]
+
+def get_candidate_queue(user_id: int, pref: str):
+    """Get (or create) the candidate queue for a user, dropping it if the preference changed"""
+    entry = candidate_queues.get(user_id)
+    if entry is not None and entry['pref'] != pref:
+        invalidate_candidate_queue(user_id)
+        entry = None
+
+    if entry is None:
+        entry = {'pref': pref, 'ids': deque(), 'refill': None}
+        candidate_queues[user_id] = entry
+        # Evict the least recently used queues
+        while len(candidate_queues) > CANDIDATE_MAX_QUEUES:
+            _, old_entry = candidate_queues.popitem(last=False)
+            if old_entry['refill'] and not old_entry['refill'].done():
+                old_entry['refill'].cancel()
+    else:
+        candidate_queues.move_to_end(user_id)
+    return entry
+
+async def refill_candidate_queue(user_id: int, entry):
+    """Append a fresh shuffled batch to a queue, skipping ids it already holds"""
+    try:
+        ids = await fetch_candidate_batch(user_id, entry['pref'])
+    except Exception as e:
+        match_logger.error(f"Error refilling candidate queue for user {user_id}: {e}")
+        return
+
+    # The queue may have been invalidated while we were fetching
+    if candidate_queues.get(user_id) is not entry:
+        return
+
+    queued = set(entry['ids'])
+    entry['ids'].extend(i for i in ids if i not in queued)
+
+def schedule_candidate_refill(user_id: int, entry):
+    """Refill a queue in the background unless a refill is already running"""
+    if entry['refill'] and not entry['refill'].done():
+        return
+    entry['refill'] = asyncio.create_task(refill_candidate_queue(user_id, entry))
+
+def invalidate_candidate_queue(user_id: int):
+    """Drop a user's queued candidates, e.g. after a preference or ban change"""
+    entry = candidate_queues.pop(user_id, None)
+    if entry and entry['refill'] and not entry['refill'].done():
+        entry['refill'].cancel()
+
+def discard_candidate(user_id: int, candidate_id: int):
+    """Remove a candidate from a user's queue after they swiped on it"""
+    entry = candidate_queues.get(user_id)
+    if entry is None:
+        return
+    try:
+        entry['ids'].remove(candidate_id)
+    except ValueError:
+        pass
+
+@instrumented(kind="db")
+async def next_candidate(user_id: int, pref: str):
+    """Pop the next still-eligible candidate profile for a user"""
+    entry = get_candidate_queue(user_id, pref)
+    genders = preference_genders(pref)
+    refilled = False
+
+    while True:
+        if not entry['ids']:
+            # Only wait on the database once per swipe
+            if refilled:
+                return None
+            if entry['refill'] and not entry['refill'].done():
+                await asyncio.wait([entry['refill']])
+            else:
+                await refill_candidate_queue(user_id, entry)
+            refilled = True
+            if not entry['ids']:
+                return None
+
+        # Re-check the head of the queue in one query; bans, chats and gender
+        # edits may have happened since the batch was fetched. The ids come off
+        # the queue first so a discard or refill meanwhile can't shift them
+        checking = [entry['ids'].popleft() for _ in range(min(CANDIDATE_CHECK_SIZE, len(entry['ids'])))]
+        async with db_pool.acquire() as conn:
+            match = await conn.fetchrow(queries.NEXT_CANDIDATE_PROFILE, checking, genders)
+
+        # The ids after the match weren't ruled out; put them back in order
+        if match:
+            queued = set(entry['ids'])
+            rest = checking[checking.index(match['telegram_id']) + 1:]
+            entry['ids'].extendleft(reversed([i for i in rest if i not in queued]))
+
+        if len(entry['ids']) < CANDIDATE_REFILL_THRESHOLD:
+            schedule_candidate_refill(user_id, entry)
+
+        if match:
+            return match
+
 # ---------------- Profile Management ----------------
 async def set_preference(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Check if user is in a chat
-    user_id = update.effective_user.id
-    async with db_pool.acquire() as conn:
-        chat_row = await conn.fetchrow("SELECT partner_id FROM active_chats WHERE user_id = $1", user_id)
-        if chat_row:
-            await update.message.reply_text("❌ You are currently in a chat. Please use /stop to end your current conversation before changing settings.")
-            return
+    user_ctx = await get_user_context(update, context)
+    if user_ctx.in_chat:
+        await update.message.reply_text("❌ You are currently in a chat. Please use /stop to end your current conversation before changing settings.")
+        return
     
     keyboard = [
         [InlineKeyboardButton("Show Males 👨", callback_data="pref_Male")],
@@ -1071,96 +2069,51 @@ async def save_preference(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.from_user.id
 
     async with db_pool.acquire() as conn:
-        await conn.execute("UPDATE users SET preference = $1 WHERE telegram_id = $2", pref, user_id)
+        await conn.execute(queries.UPDATE_PREFERENCE, pref, user_id)
+    invalidate_candidate_queue(user_id)
 
     await query.answer()
     await query.edit_message_text(f"✅ Preference updated! I will now show you: {pref}")
 
+@instrumented
 async def find_match(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # Check if user is banned
     user_id = update.effective_user.id
-    async with db_pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT is_banned FROM users WHERE telegram_id = $1", user_id)
-        if row and row['is_banned']:
-            text = "❌ You have been banned from using this bot."
-            if update.callback_query:
-                await update.callback_query.message.reply_text(text)
-            else:
-                await update.message.reply_text(text)
-            return
+    user_ctx = await get_user_context(update, context)
+    
+    # Check if user is banned
+    if user_ctx.is_banned:
+        text = "❌ You have been banned from using this bot."
+        if update.callback_query:
+            await update.callback_query.message.reply_text(text)
+        else:
+            await update.message.reply_text(text)
+        return
     
     # Check if user is in a chat
-    async with db_pool.acquire() as conn:
-        chat_row = await conn.fetchrow("SELECT partner_id FROM active_chats WHERE user_id = $1", user_id)
-        if chat_row:
-            text = "❌ You are currently in a chat. Please use /stop to end your current conversation before finding new matches."
-            if update.callback_query:
-                await update.callback_query.message.reply_text(text)
-            else:
-                await update.message.reply_text(text)
-            return
+    if user_ctx.in_chat:
+        text = "❌ You are currently in a chat. Please use /stop to end your current conversation before finding new matches."
+        if update.callback_query:
+            await update.callback_query.message.reply_text(text)
+        else:
+            await update.message.reply_text(text)
+        return
     
     is_callback = update.callback_query is not None
     
     if is_callback:
         await update.callback_query.answer()
 
-    async with db_pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT preference FROM users WHERE telegram_id = $1", user_id)
-        if not row:
-            text = "❌ Create a profile first using /start."
-            if is_callback:
-                await update.callback_query.message.reply_text(text)
-            else:
-                await update.message.reply_text(text)
-            return
-        
-        pref = row['preference']
-
-        # Don't show:
-        # - Banned users
-        # - Users already liked
-        # - Users currently in active chats
-        if pref == "Both":
-            query = """
-            SELECT u.telegram_id, u.name, u.gender, u.campus, u.bio, u.photo_file_id
-            FROM users u
-            WHERE u.gender IN ('Male', 'Female') 
-            AND u.is_banned = FALSE
-            AND u.telegram_id != $1
-            AND u.telegram_id NOT IN (
-                SELECT liked_id FROM swipes WHERE liker_id = $1
-            )
-            AND u.telegram_id NOT IN (
-                SELECT user_id FROM active_chats 
-                UNION 
-                SELECT partner_id FROM active_chats
-            )
-            ORDER BY RANDOM()
-            LIMIT 1
-            """
-            params = (user_id,)
+    if not user_ctx.has_profile:
+        text = "❌ Create a profile first using /start."
+        if is_callback:
+            await update.callback_query.message.reply_text(text)
         else:
-            query = """
-            SELECT u.telegram_id, u.name, u.gender, u.campus, u.bio, u.photo_file_id
-            FROM users u
-            WHERE u.gender = $1 
-            AND u.is_banned = FALSE
-            AND u.telegram_id != $2
-            AND u.telegram_id NOT IN (
-                SELECT liked_id FROM swipes WHERE liker_id = $2
-            )
-            AND u.telegram_id NOT IN (
-                SELECT user_id FROM active_chats 
-                UNION 
-                SELECT partner_id FROM active_chats
-            )
-            ORDER BY RANDOM()
-            LIMIT 1
-            """
-            params = (pref, user_id)
-        
-        match = await conn.fetchrow(query, *params)
+            await update.message.reply_text(text)
+        return
+    
+    pref = user_ctx.preference
+
+    match = await next_candidate(user_id, pref)
 
     if not match:
         text = f"😔 No new profiles matching your preference ({pref}) right now."
@@ -1239,13 +2192,7 @@ async def find_match(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_my_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show user's own profile"""
-    user_id = update.effective_user.id
-    
-    async with db_pool.acquire() as conn:
-        user = await conn.fetchrow(
-            "SELECT name, gender, campus, bio, hobbies, photo_file_id FROM users WHERE telegram_id = $1", 
-            user_id
-        )
+    user = (await get_user_context(update, context)).profile
 
     if not user:
         await update.message.reply_text("❌ You don't have a profile yet! Type /start.")
@@ -1284,21 +2231,19 @@ async def show_my_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=reply_markup
         )
 
+@instrumented
 async def handle_like(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_ctx = await get_user_context(update, context)
+    
     # Check if user is banned
-    user_id = update.effective_user.id
-    async with db_pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT is_banned FROM users WHERE telegram_id = $1", user_id)
-        if row and row['is_banned']:
-            await update.callback_query.answer("❌ You have been banned from using this bot.")
-            return
+    if user_ctx.is_banned:
+        await update.callback_query.answer("❌ You have been banned from using this bot.")
+        return
     
     # Check if user is in a chat
-    async with db_pool.acquire() as conn:
-        chat_row = await conn.fetchrow("SELECT partner_id FROM active_chats WHERE user_id = $1", user_id)
-        if chat_row:
-            await update.callback_query.answer("❌ You are currently in a chat. Please use /stop to end your current conversation before liking new profiles.")
-            return
+    if user_ctx.in_chat:
+        await update.callback_query.answer("❌ You are currently in a chat. Please use /stop to end your current conversation before liking new profiles.")
+        return
     
     query = update.callback_query
     await query.answer()
@@ -1314,19 +2259,39 @@ async def handle_like(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id 
     liked_id = int(query.data.split('_')[1]) 
 
-    async with db_pool.acquire() as conn:
-        # Insert the like
-        await conn.execute("INSERT INTO swipes (liker_id, liked_id) VALUES ($1, $2) ON CONFLICT DO NOTHING", user_id, liked_id)
-
-        # Check if it's a match (the liked user already liked the current user)
-        is_match = await conn.fetchrow("SELECT 1 FROM swipes WHERE liker_id = $1 AND liked_id = $2", liked_id, user_id)
+    # Current user's info for notifications
+    me = user_ctx.profile
 
-        # Get current user's info for notifications
-        me = await conn.fetchrow("SELECT name, gender, photo_file_id FROM users WHERE telegram_id = $1", user_id)
-        
-        # Get liked user's info
-        liked_user = await conn.fetchrow("SELECT name FROM users WHERE telegram_id = $1", liked_id)
-        liked_name = liked_user['name'] if liked_user else "someone"
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            # Insert the like, check if it's a match (the liked user already liked
+            # the current user) and get the liked user's info in one statement,
+            # after any concurrent like between the same two users commits
+            await conn.execute(queries.LOCK_LIKE_PAIR, user_id, liked_id)
+            like = await conn.fetchrow(queries.RECORD_LIKE, user_id, liked_id)
+            if like['new_match']:
+                await bump_stats(conn, matches=1)
+            is_match = like['is_match']
+            liked_name = like['liked_name'] or "someone"
+            match_alert = "<b>🎆 BOOM! IT'S A MATCH! 🎆</b>\n\nYou both liked each other! Don't wait, say hi! 👋"
+
+            # The liked user's notification is queued with the like and sent by
+            # the outbox dispatcher; the liker is answered below, inline
+            notifications = []
+            if is_match and not like['liked_partner_id']:
+                # IT'S A MATCH! 🎉
+                notifications.append((liked_id, notification(
+                    f"{match_alert}\n\nMatched with: {me['name']}",
+                    button=InlineKeyboardButton("💬 Send Message", callback_data=f"chat_{user_id}"))))
+            elif not is_match:
+                gender_emoji = "👨" if me['gender'] == "Male" else "👩" if me['gender'] == "Female" else "⚧"
+                caption = f"<b>🔥 SOMEONE LIKED YOU!</b>\n\n{gender_emoji} <b>{me['name']}</b> just swiped right on your profile. Swipe /find to see who it is!"
+                notifications.append((liked_id, notification(
+                    caption, photo=me['photo_file_id'],
+                    button=InlineKeyboardButton("💖 Like Back", callback_data=f"like_{user_id}"))))
+            await enqueue_notifications(conn, notifications)
+    discard_candidate(user_id, liked_id)
+    index_candidates('add_like', user_id, liked_id)
 
     # Send confirmation to the liker that their like was sent
     try:
@@ -1336,28 +2301,12 @@ async def handle_like(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode="HTML"
         )
     except Exception as e:
-        print(f"Failed to send like confirmation: {e}")
+        match_logger.error(f"Failed to send like confirmation: {e}")
 
-    if is_match:
-        # IT'S A MATCH! 🎉
-        match_alert = "<b>🎆 BOOM! IT'S A MATCH! 🎆</b>\n\nYou both liked each other! Don't wait, say hi! 👋"
-        
-        # Check if the matched user is in a chat
-        async with db_pool.acquire() as conn:
-            liked_user_chat = await conn.fetchrow("SELECT partner_id FROM active_chats WHERE user_id = $1", liked_id)
-            if liked_user_chat:
-                # Notify the liker that the other user is busy
-                await query.message.reply_text("🎯 You have a match! However, your match is currently in another conversation. Try again later!")
-                return await find_match(update, context)
-        
-        # Notify the liked user about the match
-        await context.bot.send_message(
-            chat_id=liked_id, 
-            text=f"{match_alert}\n\nMatched with: {me['name']}",
-            parse_mode="HTML",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💬 Send Message", callback_data=f"chat_{user_id}")]])
-        )
-        
+    if is_match and like['liked_partner_id']:
+        # The matched user is in a chat; tell the liker they're busy
+        await query.message.reply_text("🎯 You have a match! However, your match is currently in another conversation. Try again later!")
+    elif is_match:
         # Notify the current user about the match
         await query.message.reply_text(
             text=match_alert,
@@ -1365,31 +2314,8 @@ async def handle_like(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💬 Start Chatting", callback_data=f"chat_{liked_id}")]])
         )
     else:
-        # Not a match yet - just update the current message and notify the liked user
+        # Not a match yet - just update the current message
         await query.edit_message_caption(caption="⚡ Like sent! Looking for more...")
-        
-        # Send notification to the liked user that someone liked them
-        try:
-            gender_emoji = "👨" if me['gender'] == "Male" else "👩" if me['gender'] == "Female" else "⚧"
-            caption = f"<b>🔥 SOMEONE LIKED YOU!</b>\n\n{gender_emoji} <b>{me['name']}</b> just swiped right on your profile. Swipe /find to see who it is!"
-            
-            if me['photo_file_id']:
-                await context.bot.send_photo(
-                    chat_id=liked_id, 
-                    photo=me['photo_file_id'], 
-                    caption=caption, 
-                    parse_mode="HTML",
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💖 Like Back", callback_data=f"like_{user_id}")]])
-                )
-            else:
-                await context.bot.send_message(
-                    chat_id=liked_id, 
-                    text=caption, 
-                    parse_mode="HTML",
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💖 Like Back", callback_data=f"like_{user_id}")]])
-                )
-        except Exception as e:
-            print(f"Failed to send like notification to {liked_id}: {e}")
 
     # Continue showing more profiles
     return await find_match(update, context)
@@ -1403,11 +2329,7 @@ async def start_edit_profile(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = query.from_user.id
     
     # Load existing profile data into context.user_data for editing
-    async with db_pool.acquire() as conn:
-        user = await conn.fetchrow(
-            "SELECT name, gender, campus, photo_file_id, bio, hobbies, preference FROM users WHERE telegram_id = $1", 
-            user_id
-        )
+    user = (await get_user_context(update, context)).profile
     
     if user:
         context.user_data['name'] = user['name']
@@ -1444,7 +2366,7 @@ async def start_edit_profile(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
     except Exception as e:
-        print(f"Error in start_edit_profile: {e}")
+        profile_logger.error(f"Error in start_edit_profile: {e}")
         await context.bot.send_message(
             chat_id=user_id,
             text="<b>🔧 EDIT YOUR PROFILE</b>\n\nWhich part do you want to edit?",
@@ -1491,7 +2413,7 @@ async def handle_edit_existing(update: Update, context: ContextTypes.DEFAULT_TYP
         else:
             await query.edit_message_text(text=text, reply_markup=keyboard)
     except Exception as e:
-        print(f"Error editing message: {e}")
+        profile_logger.error(f"Error editing message: {e}")
         await context.bot.send_message(
             chat_id=query.from_user.id,
             text=text,
@@ -1509,28 +2431,31 @@ async def handle_save_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
         gender = query.data.replace("save_gender_", "")
         context.user_data['gender'] = gender
         async with db_pool.acquire() as conn:
-            await conn.execute("UPDATE users SET gender = $1 WHERE telegram_id = $2", gender, user_id)
+            await conn.execute(queries.UPDATE_GENDER, gender, user_id)
+        index_candidates('set_gender', user_id, gender)
         
     elif query.data.startswith("save_campus_"):
         campus = query.data.replace("save_campus_", "")
         context.user_data['campus'] = campus
         async with db_pool.acquire() as conn:
-            await conn.execute("UPDATE users SET campus = $1 WHERE telegram_id = $2", campus, user_id)
+            await conn.execute(queries.UPDATE_CAMPUS, campus, user_id)
+        index_candidates('set_campus', user_id, campus)
         
     elif query.data.startswith("skip_"):
         field = query.data.replace("skip_", "")
         if field == "photo":
             context.user_data['photo_file_id'] = None
             async with db_pool.acquire() as conn:
-                await conn.execute("UPDATE users SET photo_file_id = NULL WHERE telegram_id = $1", user_id)
+                await conn.execute(queries.CLEAR_PHOTO, user_id)
         elif field == "bio":
             context.user_data['bio'] = None
             async with db_pool.acquire() as conn:
-                await conn.execute("UPDATE users SET bio = NULL WHERE telegram_id = $1", user_id)
+                await conn.execute(queries.CLEAR_BIO, user_id)
         elif field == "hobbies":
             context.user_data['hobbies'] = None
             async with db_pool.acquire() as conn:
-                await conn.execute("UPDATE users SET hobbies = NULL WHERE telegram_id = $1", user_id)
+                await conn.execute(queries.CLEAR_HOBBIES, user_id)
+    invalidate_user_cache(user_id)
     
     # Return to edit menu
     keyboard = [
@@ -1562,18 +2487,13 @@ async def handle_text_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Check if we're in edit mode
     if 'editing_existing' not in context.user_data:
         # Not in edit mode, check if user is in chat
-        async with db_pool.acquire() as conn:
-            chat_row = await conn.fetchrow("SELECT partner_id FROM active_chats WHERE user_id = $1", user_id)
-            if chat_row:
-                # User is in chat, relay message instead
-                await chat_relay(update, context)
-                return
+        if await chat_partner(user_id):
+            # User is in chat, relay message instead
+            await chat_relay(update, context)
+            return
         
         # Not in chat, not editing - check if user has a profile
-        async with db_pool.acquire() as conn:
-            has_profile = await conn.fetchrow("SELECT name FROM users WHERE telegram_id = $1", user_id)
-        
-        if has_profile:
+        if (await get_user_context(update, context)).has_profile:
             await show_my_profile(update, context)
         else:
             await update.message.reply_text("❌ You don't have a profile yet! Use /start to create one.")
@@ -1605,7 +2525,8 @@ async def handle_text_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Save to database
     async with db_pool.acquire() as conn:
-        await conn.execute(f"UPDATE users SET {field} = $1 WHERE telegram_id = $2", text, user_id)
+        await conn.execute(queries.UPDATE_PROFILE_TEXT[field], text, user_id)
+    invalidate_user_cache(user_id)
     
     # Show edit menu again
     keyboard = [
@@ -1630,22 +2551,17 @@ async def handle_photo_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Check if we're in edit mode
     if 'editing_existing' not in context.user_data:
         # Check if user is in chat
-        async with db_pool.acquire() as conn:
-            chat_row = await conn.fetchrow("SELECT partner_id FROM active_chats WHERE user_id = $1", user_id)
-            if chat_row:
-                # User is in chat, relay photo instead
-                await photo_relay(update, context)
-                return
+        if await chat_partner(user_id):
+            # User is in chat, relay photo instead
+            await photo_relay(update, context)
         return
     
     if update.message.photo:
         context.user_data['photo_file_id'] = update.message.photo[-1].file_id
         
         async with db_pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE users SET photo_file_id = $1 WHERE telegram_id = $2",
-                context.user_data['photo_file_id'], user_id
-            )
+            await conn.execute(queries.UPDATE_PHOTO, context.user_data['photo_file_id'], user_id)
+        invalidate_user_cache(user_id)
         
         # Show edit menu again
         keyboard = [
@@ -1676,10 +2592,7 @@ async def finish_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Show updated profile
     async with db_pool.acquire() as conn:
-        user = await conn.fetchrow(
-            "SELECT name, gender, campus, bio, hobbies, photo_file_id FROM users WHERE telegram_id = $1", 
-            user_id
-        )
+        user = await conn.fetchrow(queries.PROFILE_SUMMARY, user_id)
 
     if user:
         name = user['name']
@@ -1714,7 +2627,7 @@ async def finish_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     reply_markup=InlineKeyboardMarkup(keyboard)
                 )
         except Exception as e:
-            print(f"Error in finish_edit: {e}")
+            profile_logger.error(f"Error in finish_edit: {e}")
             if photo_id:
                 await context.bot.send_photo(
                     chat_id=user_id,
@@ -1730,8 +2643,208 @@ async def finish_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     parse_mode="HTML",
                     reply_markup=InlineKeyboardMarkup(keyboard)
                 )
+# ---------------- Admin List Pagination ----------------
+# Admin lists page with keyset cursors instead of LIMIT/OFFSET. Each Prev/Next
+# button carries the sort key and id of the row the next page continues from
+# in its callback_data, so any page is one index range scan and rows added in
+# the meantime don't shift pages. Sort keys are created_at, or an integer
+# rank for search results. Totals are approximate, read from the bot_stats
+# counters or pg_class.reltuples rather than a COUNT(*) per page.
+KEYSET_EPOCH = datetime(1970, 1, 1)
+# Sort after every real row, so the first page needs no special query. The
+# id bound must fit the id column's type: Postgres types the parameter from it
+KEYSET_START = (datetime.max, 2 ** 63 - 1)
+REPORTS_START = (datetime.max, 2 ** 31 - 1)
+RANK_START = (2 ** 31 - 1, 2 ** 63 - 1)
+BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+def to_base36(n: int) -> str:
+    digits = ""
+    while True:
+        n, r = divmod(n, 36)
+        digits = BASE36[r] + digits
+        if not n:
+            return digits
+
+def encode_cursor(list_name: str, direction: str, page: int, sort_key, row_id: int) -> str:
+    """callback_data for a page of list_name continuing from (sort_key, row_id)"""
+    if isinstance(sort_key, datetime):
+        sort_key = (sort_key - KEYSET_EPOCH) // timedelta(microseconds=1)
+    return f"kp_{list_name}_{direction}_{page}_{to_base36(sort_key)}_{to_base36(row_id)}"
+
+def decode_cursor(data: str):
+    """(list_name, direction, page, cursor) from encode_cursor's callback_data"""
+    _, list_name, direction, page, sort_key, row_id = data.split('_')
+    sort_key = int(sort_key, 36)
+    if list_name in ADMIN_LISTS and ADMIN_LISTS[list_name]['key'][0] == 'created_at':
+        sort_key = KEYSET_EPOCH + timedelta(microseconds=sort_key)
+    return list_name, direction, int(page), (sort_key, int(row_id, 36))
+
+def format_user_row(user):
+    status = "🔴 BANNED" if user['is_banned'] else "🟢 ACTIVE"
+    username_display = f"@{user['username']}" if user['username'] else "No username"
+    return (
+        f"<b>ID:</b> <code>{user['telegram_id']}</code>\n"
+        f"<b>Name:</b> {user['name']}\n"
+        f"<b>Username:</b> {username_display}\n"
+        f"<b>Gender:</b> {user['gender']}\n"
+        f"<b>Campus:</b> {user['campus']}\n"
+        f"<b>Status:</b> {status}\n"
+        f"<b>Joined:</b> {user['created_at'].strftime('%Y-%m-%d')}\n"
+        + "─" * 30 + "\n"
+    )
+
+def format_banned_row(user):
+    username_display = f"(@{user['username']})" if user['username'] else ""
+    return (
+        f"<b>👤 {user['name']}</b> {username_display}\n"
+        f"<b>ID:</b> <code>{user['telegram_id']}</code>\n"
+        f"<b>Banned since:</b> {user['created_at'].strftime('%Y-%m-%d')}\n"
+        + "─" * 30 + "\n"
+    )
+
+def format_report_row(report):
+    return (
+        f"<b>Report ID:</b> {report['id']}\n"
+        f"<b>Reporter:</b> {report['reporter_name']} ({report['reporter_id']})\n"
+        f"<b>Reported:</b> {report['reported_name']} ({report['reported_id']})\n"
+        f"<b>Reason:</b> {report['reason'][:100]}...\n"
+        f"<b>Date:</b> {report['created_at'].strftime('%Y-%m-%d %H:%M')}\n"
+        + "-" * 30 + "\n"
+    )
+
+def search_args(term: str):
+    """Query parameters for a name/username search term"""
+    term = term.strip().lstrip('@')
+    escaped = term.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped, term
+
+def format_search_row(user):
+    status = "🔴 BANNED" if user['is_banned'] else "🟢 ACTIVE"
+    username_display = f"@{user['username']}" if user['username'] else "No username"
+    return (
+        f"<b>👤 {user['name']}</b>\n"
+        f"<b>ID:</b> <code>{user['telegram_id']}</code>\n"
+        f"<b>Username:</b> {username_display}\n"
+        f"<b>Status:</b> {status}\n"
+        + "─" * 30 + "\n"
+    )
+
+# list name -> page queries (newer/older than the cursor), key columns, page
+# size, approximate total (bot_stats name, table), row rendering and footer
+ADMIN_LISTS = {
+    'users': {
+        'next': queries.USERS_PAGE_NEXT, 'prev': queries.USERS_PAGE_PREV,
+        'key': ('created_at', 'telegram_id'), 'size': 5, 'total': ('users', 'users'),
+        'title': "📋 USERS", 'noun': "users", 'empty': "📭 No users found.",
+        'format': format_user_row,
+        'buttons': lambda u: [InlineKeyboardButton(f"👤 {u['name']}", callback_data=f"admin_view_user_{u['telegram_id']}")],
+        'footer': [
+            [InlineKeyboardButton("🔙 Back to User Mgmt", callback_data="admin_users")],
+            [InlineKeyboardButton("🏠 Main Admin", callback_data="admin_back")],
+        ],
+    },
+    'banned': {
+        'next': queries.BANNED_PAGE_NEXT, 'prev': queries.BANNED_PAGE_PREV,
+        'key': ('created_at', 'telegram_id'), 'size': 10, 'total': ('banned_users', None),
+        'title': "🚫 BANNED USERS", 'noun': "banned", 'empty': "✅ No banned users.",
+        'format': format_banned_row,
+        'buttons': lambda u: [InlineKeyboardButton(f"✅ Unban {u['name']}", callback_data=f"admin_unban_{u['telegram_id']}")],
+        'footer': [[InlineKeyboardButton("🔙 Back", callback_data="admin_users")]],
+    },
+    'reports': {
+        'next': queries.PENDING_REPORTS_NEXT, 'prev': queries.PENDING_REPORTS_PREV,
+        'key': ('created_at', 'id'), 'start': REPORTS_START, 'size': 5, 'total': ('pending_reports', None),
+        'title': "🚨 PENDING REPORTS", 'noun': "pending", 'empty': "✅ No pending reports.",
+        'format': format_report_row,
+        'buttons': lambda r: [
+            InlineKeyboardButton(f"✅ Approve {r['id']}", callback_data=f"approve_{r['id']}"),
+            InlineKeyboardButton(f"❌ Reject {r['id']}", callback_data=f"reject_{r['id']}"),
+        ],
+        'footer': [[InlineKeyboardButton("🔙 Back", callback_data="admin_back")]],
+    },
+    'search': {
+        'next': queries.SEARCH_PAGE_NEXT, 'prev': queries.SEARCH_PAGE_PREV,
+        'key': ('rank', 'telegram_id'), 'start': RANK_START, 'size': 10, 'total': None,
+        'title': "🔍 SEARCH RESULTS", 'noun': "matching", 'empty': "❌ No users found matching your search.",
+        'format': format_search_row,
+        'buttons': lambda u: [InlineKeyboardButton(f"View {u['name']}", callback_data=f"admin_view_user_{u['telegram_id']}")],
+        'footer': [[InlineKeyboardButton("🔙 Back", callback_data="admin_users")]],
+        # The search term doesn't fit in callback_data, so it stays in user_data
+        'args': lambda context: search_args(context.user_data.get('admin_search_term', '')),
+    },
+}
+
+@instrumented(kind="db")
+async def fetch_keyset_page(list_name: str, direction: str, cursor, args=()):
+    """One page of rows, newest first, plus whether more rows lie in that direction"""
+    spec = ADMIN_LISTS[list_name]
+    sql = spec['prev'] if direction == 'p' else spec['next']
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(sql, *cursor, spec['size'] + 1, *args)
+        total = await conn.fetchval(queries.APPROX_COUNT, *spec['total']) if spec['total'] else None
+    more = len(rows) > spec['size']
+    rows = rows[:spec['size']]
+    if direction == 'p':
+        rows.reverse()
+    return rows, more, total
+
+async def render_admin_list(list_name: str, context, direction: str = 'n', page: int = 1, cursor=None):
+    """Message text and keyboard for one page of an admin list"""
+    spec = ADMIN_LISTS[list_name]
+    cursor = cursor or spec.get('start', KEYSET_START)
+    args = spec['args'](context) if 'args' in spec else ()
+    rows, more, total = await fetch_keyset_page(list_name, direction, cursor, args)
+    if not rows:
+        return spec['empty'], InlineKeyboardMarkup(spec['footer'])
+
+    has_next = more if direction == 'n' else True
+    has_prev = page > 1 if direction == 'n' else more
+    if total is not None:
+        pages = max(page, (total + spec['size'] - 1) // spec['size'])
+        heading = f"<b>{spec['title']} (Page {page}/~{pages}, ~{total} {spec['noun']})</b>\n\n"
+    else:
+        heading = f"<b>{spec['title']} (Page {page})</b>\n\n"
+    text = heading + "".join(spec['format'](row) for row in rows)
+
+    keyboard = [spec['buttons'](row) for row in rows]
+    first_key, second_key = spec['key']
+    nav_buttons = []
+    if has_prev:
+        first = rows[0]
+        nav_buttons.append(InlineKeyboardButton("◀️ Prev", callback_data=encode_cursor(
+            list_name, 'p', page - 1, first[first_key], first[second_key])))
+    if has_next:
+        last = rows[-1]
+        nav_buttons.append(InlineKeyboardButton("Next ▶️", callback_data=encode_cursor(
+            list_name, 'n', page + 1, last[first_key], last[second_key])))
+    if nav_buttons:
+        keyboard.append(nav_buttons)
+    keyboard.extend(spec['footer'])
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def show_admin_list(query, context, list_name: str, direction: str = 'n', page: int = 1, cursor=None):
+    text, markup = await render_admin_list(list_name, context, direction, page, cursor)
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=markup)
+
+@instrumented
+async def admin_list_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Prev/Next on any admin list"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = update.effective_user.id
+    if user_id != ADMIN_USER_ID:
+        return
+    
+    list_name, direction, page, cursor = decode_cursor(query.data)
+    if list_name not in ADMIN_LISTS:
+        return
+    await show_admin_list(query, context, list_name, direction, page, cursor)
+
 # ---------------- Enhanced Admin Functions ----------------
 
+@instrumented
 async def admin_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show user management panel"""
     query = update.callback_query
@@ -1752,87 +2865,14 @@ async def admin_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
+@instrumented
 async def admin_list_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List all users with pagination"""
     query = update.callback_query
     await query.answer()
-    
-    # Get page number from callback or default to 1
-    page = int(context.user_data.get('admin_user_page', 1))
-    users_per_page = 5
-    
-    async with db_pool.acquire() as conn:
-        # Get total count
-        total_users = await conn.fetchval("SELECT COUNT(*) FROM users")
-        
-        # Get users for current page
-        offset = (page - 1) * users_per_page
-        users = await conn.fetch("""
-            SELECT telegram_id, username, name, gender, campus, is_banned, created_at
-            FROM users 
-            ORDER BY created_at DESC
-            LIMIT $1 OFFSET $2
-        """, users_per_page, offset)
-    
-    if not users:
-        await query.edit_message_text(
-            "📭 No users found.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin_users")]])
-        )
-        return
-    
-    # Build message
-    text = f"<b>📋 USERS (Page {page}/{max(1, (total_users + users_per_page - 1) // users_per_page)})</b>\n\n"
-    
-    keyboard = []
-    for user in users:
-        status = "🔴 BANNED" if user['is_banned'] else "🟢 ACTIVE"
-        username_display = f"@{user['username']}" if user['username'] else "No username"
-        
-        text += f"<b>ID:</b> <code>{user['telegram_id']}</code>\n"
-        text += f"<b>Name:</b> {user['name']}\n"
-        text += f"<b>Username:</b> {username_display}\n"
-        text += f"<b>Gender:</b> {user['gender']}\n"
-        text += f"<b>Campus:</b> {user['campus']}\n"
-        text += f"<b>Status:</b> {status}\n"
-        text += f"<b>Joined:</b> {user['created_at'].strftime('%Y-%m-%d')}\n"
-        text += "─" * 30 + "\n"
-        
-        # Add action buttons for each user
-        keyboard.append([
-            InlineKeyboardButton(f"👤 {user['name']}", callback_data=f"admin_view_user_{user['telegram_id']}")
-        ])
-    
-    # Pagination buttons
-    nav_buttons = []
-    if page > 1:
-        nav_buttons.append(InlineKeyboardButton("◀️ Prev", callback_data=f"admin_users_page_{page-1}"))
-    if offset + users_per_page < total_users:
-        nav_buttons.append(InlineKeyboardButton("Next ▶️", callback_data=f"admin_users_page_{page+1}"))
-    
-    if nav_buttons:
-        keyboard.append(nav_buttons)
-    
-    keyboard.append([InlineKeyboardButton("🔙 Back to User Mgmt", callback_data="admin_users")])
-    keyboard.append([InlineKeyboardButton("🏠 Main Admin", callback_data="admin_back")])
-    
-    await query.edit_message_text(
-        text,
-        parse_mode="HTML",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
-
-async def admin_users_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle user list pagination"""
-    query = update.callback_query
-    await query.answer()
-    
-    page = int(query.data.split('_')[-1])
-    context.user_data['admin_user_page'] = page
-    
-    # Call list users again
-    await admin_list_users(update, context)
+    await show_admin_list(query, context, 'users')
 
+@instrumented
 async def admin_view_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """View detailed user information"""
     query = update.callback_query
@@ -1840,41 +2880,18 @@ async def admin_view_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user_id = int(query.data.split('_')[-1])
     
+    # Profile, counters from user_stats and chat partner in one row
     async with db_pool.acquire() as conn:
-        # Get user details
-        user = await conn.fetchrow("""
-            SELECT * FROM users WHERE telegram_id = $1
-        """, user_id)
-        
-        if not user:
-            await query.edit_message_text("❌ User not found.")
-            return
-        
-        # Get user stats
-        likes_given = await conn.fetchval("SELECT COUNT(*) FROM swipes WHERE liker_id = $1", user_id)
-        likes_received = await conn.fetchval("SELECT COUNT(*) FROM swipes WHERE liked_id = $1", user_id)
-        
-        # Get matches
-        matches = await conn.fetchval("""
-            SELECT COUNT(*) FROM (
-                SELECT s1.liker_id, s1.liked_id 
-                FROM swipes s1
-                INNER JOIN swipes s2 ON s1.liker_id = s2.liked_id AND s1.liked_id = s2.liker_id
-                WHERE s1.liker_id = $1 OR s1.liked_id = $1
-            ) as matches
-        """, user_id)
-        
-        # Get reports
-        reports_made = await conn.fetchval("SELECT COUNT(*) FROM reports WHERE reporter_id = $1", user_id)
-        reports_received = await conn.fetchval("SELECT COUNT(*) FROM reports WHERE reported_id = $1 AND status = 'pending'", user_id)
-        
-        # Check if currently in chat
-        in_chat = await conn.fetchrow("SELECT partner_id FROM active_chats WHERE user_id = $1", user_id)
+        user = await conn.fetchrow(queries.USER_DETAILS, user_id)
+    
+    if not user:
+        await query.edit_message_text("❌ User not found.")
+        return
     
     # Build detailed profile
     username_display = f"@{user['username']}" if user['username'] else "No username"
     status = "🔴 BANNED" if user['is_banned'] else "🟢 ACTIVE"
-    chat_status = "💬 In chat" if in_chat else "💤 Not in chat"
+    chat_status = "💬 In chat" if user['partner_id'] else "💤 Not in chat"
     
     profile_text = (
         f"<b>👤 USER DETAILS</b>\n\n"
@@ -1889,11 +2906,11 @@ async def admin_view_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"<b>📊 Status:</b> {status}\n"
         f"<b>💬 Chat:</b> {chat_status}\n\n"
         f"<b>📈 STATISTICS</b>\n"
-        f"<b>❤️ Likes Given:</b> {likes_given}\n"
-        f"<b>💖 Likes Received:</b> {likes_received}\n"
-        f"<b>💕 Total Matches:</b> {matches}\n"
-        f"<b>📝 Reports Made:</b> {reports_made}\n"
-        f"<b>⚠️ Reports Received:</b> {reports_received}\n\n"
+        f"<b>❤️ Likes Given:</b> {user['likes_given']}\n"
+        f"<b>💖 Likes Received:</b> {user['likes_received']}\n"
+        f"<b>💕 Total Matches:</b> {user['matches']}\n"
+        f"<b>📝 Reports Made:</b> {user['reports_made']}\n"
+        f"<b>⚠️ Reports Received:</b> {user['reports_pending_against']}\n\n"
         f"<b>📅 Joined:</b> {user['created_at'].strftime('%Y-%m-%d %H:%M')}\n"
         f"<b>🕒 Last Active:</b> {user['last_active'].strftime('%Y-%m-%d %H:%M') if user['last_active'] else 'Never'}"
     )
@@ -1935,6 +2952,7 @@ async def admin_view_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
 
+@instrumented
 async def admin_ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ban a user"""
     query = update.callback_query
@@ -1943,26 +2961,26 @@ async def admin_ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = int(query.data.split('_')[-1])
     
     async with db_pool.acquire() as conn:
-        await conn.execute("UPDATE users SET is_banned = TRUE WHERE telegram_id = $1", user_id)
+        async with conn.transaction():
+            banned = rows_affected(await conn.execute(queries.BAN_USER, user_id))
+            await bump_stats(conn, banned_users=banned)
+            # Notify user, once, through the outbox
+            if banned:
+                await enqueue_notifications(conn, [(user_id, notification(
+                    "<b>❌ ACCOUNT BANNED</b>\n\nYour account has been banned by an administrator. If you believe this is a mistake, please contact support."))])
         
         # Get user info for logging
-        user = await conn.fetchrow("SELECT name FROM users WHERE telegram_id = $1", user_id)
-    
-    # Notify user
-    try:
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="<b>❌ ACCOUNT BANNED</b>\n\nYour account has been banned by an administrator. If you believe this is a mistake, please contact support.",
-            parse_mode="HTML"
-        )
-    except:
-        pass
+        user = await conn.fetchrow(queries.USER_NAME, user_id)
+    invalidate_candidate_queue(user_id)
+    invalidate_user_cache(user_id)
+    index_candidates('set_flag', BANNED, True, user_id)
     
     await query.edit_message_text(
         f"✅ User {user['name']} ({user_id}) has been banned.",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin_list_users")]])
     )
 
+@instrumented
 async def admin_unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Unban a user"""
     query = update.callback_query
@@ -1971,66 +2989,32 @@ async def admin_unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = int(query.data.split('_')[-1])
     
     async with db_pool.acquire() as conn:
-        await conn.execute("UPDATE users SET is_banned = FALSE WHERE telegram_id = $1", user_id)
+        async with conn.transaction():
+            unbanned = rows_affected(await conn.execute(queries.UNBAN_USER, user_id))
+            await bump_stats(conn, banned_users=-unbanned)
+            # Notify user, once, through the outbox
+            if unbanned:
+                await enqueue_notifications(conn, [(user_id, notification(
+                    "<b>✅ ACCOUNT UNBANNED</b>\n\nYour account has been unbanned. You can now use the bot again."))])
         
         # Get user info for logging
-        user = await conn.fetchrow("SELECT name FROM users WHERE telegram_id = $1", user_id)
-    
-    # Notify user
-    try:
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="<b>✅ ACCOUNT UNBANNED</b>\n\nYour account has been unbanned. You can now use the bot again.",
-            parse_mode="HTML"
-        )
-    except:
-        pass
+        user = await conn.fetchrow(queries.USER_NAME, user_id)
+    invalidate_user_cache(user_id)
+    index_candidates('set_flag', BANNED, False, user_id)
     
     await query.edit_message_text(
         f"✅ User {user['name']} ({user_id}) has been unbanned.",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin_list_users")]])
     )
 
+@instrumented
 async def admin_banned_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """List all banned users"""
+    """List banned users with pagination"""
     query = update.callback_query
     await query.answer()
-    
-    async with db_pool.acquire() as conn:
-        users = await conn.fetch("""
-            SELECT telegram_id, name, username, created_at 
-            FROM users 
-            WHERE is_banned = TRUE
-            ORDER BY updated_at DESC
-        """)
-    
-    if not users:
-        await query.edit_message_text(
-            "✅ No banned users.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin_users")]])
-        )
-        return
-    
-    text = "<b>🚫 BANNED USERS</b>\n\n"
-    keyboard = []
-    
-    for user in users:
-        username_display = f"(@{user['username']})" if user['username'] else ""
-        text += f"<b>👤 {user['name']}</b> {username_display}\n"
-        text += f"<b>ID:</b> <code>{user['telegram_id']}</code>\n"
-        text += f"<b>Banned since:</b> {user['created_at'].strftime('%Y-%m-%d')}\n"
-        text += "─" * 30 + "\n"
-        
-        keyboard.append([InlineKeyboardButton(f"✅ Unban {user['name']}", callback_data=f"admin_unban_{user['telegram_id']}")])
-    
-    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="admin_users")])
-    
-    await query.edit_message_text(
-        text,
-        parse_mode="HTML",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    await show_admin_list(query, context, 'banned')
 
+@instrumented
 async def admin_search_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start user search"""
     query = update.callback_query
@@ -2045,6 +3029,7 @@ async def admin_search_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode="HTML"
     )
 
+@instrumented
 async def admin_handle_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle user search query"""
     if 'admin_searching' not in context.user_data:
@@ -2062,55 +3047,490 @@ async def admin_handle_search(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("Search cancelled.")
         return
     
-    async with db_pool.acquire() as conn:
-        # Try to search by telegram_id (exact match)
-        try:
-            telegram_id = int(search_term)
-            users = await conn.fetch("SELECT * FROM users WHERE telegram_id = $1", telegram_id)
-        except ValueError:
-            # Search by username or name
-            users = await conn.fetch("""
-                SELECT * FROM users 
-                WHERE username ILIKE $1 OR name ILIKE $1
-                ORDER BY created_at DESC
-                LIMIT 10
-            """, f"%{search_term}%")
-    
-    if not users:
-        await update.message.reply_text("❌ No users found matching your search.")
-        return
-    
-    # Show search results
-    text = f"<b>🔍 SEARCH RESULTS for '{search_term}'</b>\n\n"
-    keyboard = []
-    
-    for user in users:
-        status = "🔴 BANNED" if user['is_banned'] else "🟢 ACTIVE"
-        username_display = f"@{user['username']}" if user['username'] else "No username"
-        
-        text += f"<b>👤 {user['name']}</b>\n"
-        text += f"<b>ID:</b> <code>{user['telegram_id']}</code>\n"
-        text += f"<b>Username:</b> {username_display}\n"
-        text += f"<b>Status:</b> {status}\n"
-        text += "─" * 30 + "\n"
-        
-        keyboard.append([InlineKeyboardButton(f"View {user['name']}", callback_data=f"admin_view_user_{user['telegram_id']}")])
+    # Try to search by telegram_id (exact match)
+    try:
+        telegram_id = int(search_term)
+    except ValueError:
+        telegram_id = None
     
-    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="admin_users")])
+    if telegram_id is not None:
+        async with db_pool.acquire() as conn:
+            user = await conn.fetchrow(queries.USER_BY_ID, telegram_id)
+        if not user:
+            await update.message.reply_text("❌ No users found matching your search.")
+            return
+        text = f"<b>🔍 SEARCH RESULTS for '{search_term}'</b>\n\n" + format_search_row(user)
+        keyboard = [ADMIN_LISTS['search']['buttons'](user)] + ADMIN_LISTS['search']['footer']
+        markup = InlineKeyboardMarkup(keyboard)
+    else:
+        # Search by username or name; later pages reuse the stored term
+        context.user_data['admin_search_term'] = search_term
+        text, markup = await render_admin_list('search', context)
     
     await update.message.reply_text(
         text,
         parse_mode="HTML",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=markup
     )
     
     context.user_data.pop('admin_searching', None)
 
+# ---------------- Broadcast Engine ----------------
+# Every broadcast goes through one shared token bucket sized under Telegram's
+# global limit (~30 msg/s), a bounded pool of sender workers, and a per-chat
+# spacing check. RetryAfter pauses the whole bucket; Forbidden (the user
+# blocked the bot) prunes the recipient from future broadcasts.
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+BROADCAST_BATCH_SIZE = 1000
+PER_CHAT_INTERVAL = 1.0
+BROADCAST_HEADER = "<b>📢 ADMIN ANNOUNCEMENT</b>\n\n"
+
+class TokenBucket:
+    """Async token bucket shared by everything that sends in bulk"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        # A small burst allowance keeps any 1s window under rate * 1.2
+        self.capacity = capacity or max(1.0, rate / 5)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Stop handing out tokens, e.g. after Telegram answers with RetryAfter"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+telegram_rate_limiter = TokenBucket(BROADCAST_RATE)
+
+# chat_id -> monotonic time of the last bulk send to that chat
+chat_last_sent = OrderedDict()
+
+async def throttle_chat(chat_id: int):
+    """Keep bulk sends to the same chat at least PER_CHAT_INTERVAL apart"""
+    last = chat_last_sent.get(chat_id)
+    if last is not None:
+        wait = last + PER_CHAT_INTERVAL - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+    chat_last_sent[chat_id] = time.monotonic()
+    chat_last_sent.move_to_end(chat_id)
+    while len(chat_last_sent) > 10000:
+        chat_last_sent.popitem(last=False)
+
+async def send_broadcast_payload(bot, chat_id: int, payload: dict):
+    """Send one broadcast (or outbox) payload to one chat"""
+    kind = payload['type']
+    markup = payload.get('reply_markup')
+    reply_markup = InlineKeyboardMarkup.de_json(markup, bot) if markup else None
+    if kind == "copy":
+        await bot.copy_message(
+            chat_id=chat_id,
+            from_chat_id=payload['from_chat_id'],
+            message_id=payload['message_id']
+        )
+    elif kind == "photo":
+        await bot.send_photo(chat_id=chat_id, photo=payload['media'], caption=payload['caption'], parse_mode="HTML", reply_markup=reply_markup)
+    elif kind == "video":
+        await bot.send_video(chat_id=chat_id, video=payload['media'], caption=payload['caption'], parse_mode="HTML", reply_markup=reply_markup)
+    elif kind == "document":
+        await bot.send_document(chat_id=chat_id, document=payload['media'], caption=payload['caption'], parse_mode="HTML", reply_markup=reply_markup)
+    else:  # text
+        await bot.send_message(chat_id=chat_id, text=payload['text'], parse_mode="HTML", reply_markup=reply_markup)
+
+async def send_with_retry(bot, chat_id: int, payload: dict, limiter=None):
+    """Send a payload honouring RetryAfter; returns 'sent', 'blocked' or 'failed'"""
+    limiter = limiter or telegram_rate_limiter
+    for attempt in range(BROADCAST_MAX_RETRIES + 1):
+        await limiter.acquire()
+        await throttle_chat(chat_id)
+        try:
+            await send_broadcast_payload(bot, chat_id, payload)
+            return "sent"
+        except RetryAfter as e:
+            broadcast_logger.warning(f"Flood control hit, pausing broadcast for {e.retry_after}s")
+            limiter.pause(e.retry_after)
+        except Forbidden:
+            return "blocked"
+        except BadRequest as e:
+            broadcast_logger.warning(f"Failed to send to {chat_id}: {e}")
+            return "failed"
+        except NetworkError as e:
+            broadcast_logger.warning(f"Network error sending to {chat_id} (attempt {attempt + 1}): {e}")
+            await asyncio.sleep(2 ** attempt)
+        except TelegramError as e:
+            broadcast_logger.warning(f"Failed to send to {chat_id}: {e}")
+            return "failed"
+    return "failed"
+
+async def deliver_broadcast(bot, payload: dict, recipients, stats: dict, on_result=None,
+                            workers: int = BROADCAST_WORKERS, limiter=None):
+    """Fan a payload out to an async iterable of chat ids with a bounded worker pool"""
+    queue = asyncio.Queue(maxsize=workers * 2)
+
+    async def worker():
+        while True:
+            chat_id = await queue.get()
+            if chat_id is None:
+                return
+            status = await send_with_retry(bot, chat_id, payload, limiter)
+            stats[status] += 1
+            if status != "sent":
+                stats.setdefault(f"{status}_ids", []).append(chat_id)
+            if on_result:
+                await on_result(chat_id, status)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        async for chat_id in recipients:
+            await queue.put(chat_id)
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return stats
+
+# Broadcast jobs live in Postgres so a redeploy mid-broadcast resumes instead
+# of re-sending. Recipients are snapshotted into broadcast_deliveries by the
+# server, and every replica claims small batches of pending rows with
+# FOR UPDATE SKIP LOCKED. A claim older than BROADCAST_CLAIM_TIMEOUT belongs
+# to a process that died and is handed out again. Each claim also reserves the
+# next len(batch) / BROADCAST_RATE seconds of the job's send time in
+# broadcast_jobs.paced_until, and the claimer waits for its window to open, so
+# the replicas together stay at BROADCAST_RATE instead of each sending at it.
+BROADCAST_CLAIM_SIZE = int(os.getenv("BROADCAST_CLAIM_SIZE", "50"))
+BROADCAST_CLAIM_TIMEOUT = float(os.getenv("BROADCAST_CLAIM_TIMEOUT", "120"))
+BROADCAST_POLL_INTERVAL = float(os.getenv("BROADCAST_POLL_INTERVAL", "30"))
+BROADCAST_RETENTION_DAYS = int(os.getenv("BROADCAST_RETENTION_DAYS", "30"))
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# job_id -> task for the jobs this process is working on
+broadcast_runners = {}
+
+@instrumented(kind="db")
+async def create_broadcast_job(payload: dict, progress_message):
+    """Store a job and snapshot its recipients without pulling ids into Python"""
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            job_id = await conn.fetchval(queries.CREATE_BROADCAST_JOB, json.dumps(payload), progress_message.chat_id, progress_message.message_id)
+            result = await conn.execute(queries.SNAPSHOT_BROADCAST_RECIPIENTS, job_id)
+            total = int(result.split()[-1])
+            await conn.execute(queries.SET_BROADCAST_TOTAL, job_id, total)
+    broadcast_logger.info(f"Broadcast job {job_id} created for {total} recipients")
+    return job_id
+
+@instrumented(kind="db")
+async def claim_broadcast_deliveries(job_id: int):
+    """Claim the next batch of pending (or abandoned) deliveries and its send window
+
+    Returns the chat ids and the seconds until the window reserved for them opens.
+    """
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            rows = await conn.fetch(queries.CLAIM_BROADCAST_DELIVERIES, job_id, INSTANCE_ID, BROADCAST_CLAIM_TIMEOUT, BROADCAST_CLAIM_SIZE)
+            if not rows:
+                return [], 0.0
+            wait = await conn.fetchval(queries.RESERVE_BROADCAST_WINDOW, job_id, len(rows) / BROADCAST_RATE)
+    return [row['telegram_id'] for row in rows], max(0.0, wait)
+
+@instrumented(kind="db")
+async def record_broadcast_results(job_id: int, results):
+    """Persist delivery outcomes and stop broadcasting to users who blocked the bot"""
+    if not results:
+        return
+    chat_ids = [chat_id for chat_id, _ in results]
+    statuses = [status for _, status in results]
+    blocked = [chat_id for chat_id, status in results if status == "blocked"]
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(queries.RECORD_BROADCAST_RESULTS, job_id, chat_ids, statuses)
+            if blocked:
+                await conn.execute(queries.MARK_BLOCKED_BOT, blocked)
+    if blocked:
+        broadcast_logger.info(f"Pruned {len(blocked)} users who blocked the bot")
+
+async def broadcast_job_counts(job_id: int):
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(queries.BROADCAST_STATUS_COUNTS, job_id)
+    return {row['status']: row['n'] for row in rows}
+
+async def finish_broadcast_job(job_id: int):
+    """Mark a job completed once nothing is left; only one replica gets the row back"""
+    async with db_pool.acquire() as conn:
+        return await conn.fetchrow(queries.FINISH_BROADCAST_JOB, job_id)
+
+async def send_broadcast_report(bot, job):
+    """Replace the admin's progress message with the final delivery report"""
+    counts = await broadcast_job_counts(job['id'])
+    async with db_pool.acquire() as conn:
+        failed_rows = await conn.fetch(queries.BROADCAST_FAILED_SAMPLE, job['id'])
+    failed_users = [str(row['telegram_id']) for row in failed_rows]
+    failed = counts.get('failed', 0)
+
+    report_text = (
+        f"<b>📢 BROADCAST COMPLETE</b>\n\n"
+        f"<b>✅ Successful:</b> {counts.get('sent', 0)}\n"
+        f"<b>❌ Failed:</b> {failed}\n"
+        f"<b>🚫 Blocked the bot:</b> {counts.get('blocked', 0)}\n"
+        f"<b>👥 Total Users:</b> {job['total']}\n"
+    )
+    if failed_users:
+        report_text += f"\n<b>Failed Users:</b> {', '.join(failed_users)}"
+        if failed > len(failed_users):
+            report_text += f" and {failed - len(failed_users)} more..."
+
+    keyboard = [[InlineKeyboardButton("🔙 Back to Admin", callback_data="admin_back")]]
+    try:
+        await bot.edit_message_text(
+            chat_id=job['progress_chat_id'],
+            message_id=job['progress_message_id'],
+            text=report_text,
+            parse_mode="HTML",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    except Exception:
+        # If message can't be edited, send new message
+        await bot.send_message(
+            chat_id=job['progress_chat_id'],
+            text=report_text,
+            parse_mode="HTML",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+
+async def run_broadcast_job(bot, job_id: int):
+    """Work through a job's pending deliveries alongside any other replicas"""
+    async with db_pool.acquire() as conn:
+        job = await conn.fetchrow(queries.BROADCAST_JOB, job_id)
+    if not job or job['status'] != 'running':
+        return
+    payload = json.loads(job['payload'])
+    stats = {'sent': 0, 'failed': 0, 'blocked': 0}
+    results = []
+
+    async def flush_results():
+        batch = results[:]
+        results.clear()
+        await record_broadcast_results(job_id, batch)
+
+    async def on_result(chat_id, status):
+        results.append((chat_id, status))
+        if len(results) >= BROADCAST_CLAIM_SIZE:
+            await flush_results()
+
+    async def claimed_recipients():
+        while True:
+            await flush_results()
+            chat_ids, wait = await claim_broadcast_deliveries(job_id)
+            if not chat_ids:
+                return
+            if wait > 0:
+                await asyncio.sleep(wait)
+            for chat_id in chat_ids:
+                yield chat_id
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            try:
+                counts = await broadcast_job_counts(job_id)
+                done = counts.get('sent', 0) + counts.get('failed', 0) + counts.get('blocked', 0)
+                await bot.edit_message_text(
+                    chat_id=job['progress_chat_id'],
+                    message_id=job['progress_message_id'],
+                    text=f"📤 Broadcasting... {done}/{job['total']} sent"
+                )
+            except Exception:
+                pass  # Message might be too old to edit, or unchanged
+
+    reporter = asyncio.create_task(report_progress()) if job['progress_chat_id'] else None
+    try:
+        await deliver_broadcast(bot, payload, claimed_recipients(), stats, on_result=on_result)
+        await flush_results()
+    except Exception as e:
+        broadcast_logger.error(f"Broadcast job {job_id} interrupted: {type(e).__name__}: {e}")
+        return
+    finally:
+        if reporter:
+            reporter.cancel()
+
+    broadcast_logger.info(f"Broadcast job {job_id} finished on this replica", extra=stats)
+    finished = await finish_broadcast_job(job_id)
+    if finished and finished['progress_chat_id']:
+        try:
+            await send_broadcast_report(bot, finished)
+        except Exception as e:
+            broadcast_logger.error(f"Error sending broadcast report: {e}")
+
+def launch_broadcast_job(bot, job_id: int):
+    """Start working on a job unless this process already is"""
+    if job_id in broadcast_runners:
+        return
+    task = asyncio.create_task(run_broadcast_job(bot, job_id))
+    broadcast_runners[job_id] = task
+    task.add_done_callback(lambda _: broadcast_runners.pop(job_id, None))
+
+async def broadcast_job_poller(bot):
+    """Resume jobs left running by a restart and help with jobs started on other replicas"""
+    while True:
+        try:
+            async with db_pool.acquire() as conn:
+                rows = await conn.fetch(queries.RUNNING_BROADCAST_JOBS)
+                await conn.execute(queries.PURGE_BROADCAST_JOBS, BROADCAST_RETENTION_DAYS)
+            for row in rows:
+                launch_broadcast_job(bot, row['id'])
+        except Exception as e:
+            broadcast_logger.error(f"Error polling broadcast jobs: {e}")
+        await asyncio.sleep(BROADCAST_POLL_INTERVAL)
+
+async def start_broadcast(context: ContextTypes.DEFAULT_TYPE, payload: dict, progress_message):
+    """Persist a broadcast job and deliver it in the background so the handler returns immediately"""
+    job_id = await create_broadcast_job(payload, progress_message)
+    launch_broadcast_job(context.bot, job_id)
+
+# ---------------- Outbox ----------------
+# Notifications to other users (likes, matches, reports, bans, ended chats)
+# are inserted into the outbox table in the same transaction as the change
+# they announce, so handlers only wait on Postgres and nothing is lost to a
+# restart. The dispatcher claims due rows with FOR UPDATE SKIP LOCKED and
+# sends them through the broadcast engine's token bucket and retry loop,
+# one chat's messages in order and up to OUTBOX_WORKERS chats at a time.
+# Failed sends are retried with backoff; the outbox_queued trigger wakes
+# every listening dispatcher when new rows commit.
+OUTBOX_CHANNEL = "outbox"
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "8"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_CLAIM_TIMEOUT = float(os.getenv("OUTBOX_CLAIM_TIMEOUT", "120"))
+# Poll interval without LISTEN, and the recheck for retries coming due with it
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+OUTBOX_RECHECK_INTERVAL = float(os.getenv("OUTBOX_RECHECK_INTERVAL", "10"))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+OUTBOX_PURGE_INTERVAL = 3600
+
+outbox_wakeup = asyncio.Event()
+outbox_stats = {'sent': 0, 'blocked': 0, 'failed': 0, 'batches': 0}
+
+def notification(text: str, photo: str = None, button: InlineKeyboardButton = None) -> str:
+    """Serialize an HTML message for the outbox in send_broadcast_payload's format"""
+    payload = {'type': "photo", 'media': photo, 'caption': text} if photo else {'type': "text", 'text': text}
+    if button:
+        payload['reply_markup'] = InlineKeyboardMarkup([[button]]).to_dict()
+    return json.dumps(payload)
+
+async def enqueue_notifications(conn, notifications):
+    """Queue (chat_id, payload) pairs on conn, inside the caller's transaction"""
+    if notifications:
+        await conn.execute(queries.ENQUEUE_OUTBOX,
+                           [chat_id for chat_id, _ in notifications], [payload for _, payload in notifications])
+
+@instrumented(kind="db")
+async def claim_outbox():
+    async with db_pool.acquire() as conn:
+        return await conn.fetch(queries.CLAIM_OUTBOX, INSTANCE_ID, OUTBOX_CLAIM_TIMEOUT, OUTBOX_BATCH_SIZE)
+
+@instrumented(kind="db")
+async def record_outbox_results(results):
+    """Store send outcomes and stop broadcasting to users who blocked the bot"""
+    blocked = list({chat_id for _, chat_id, status in results if status == "blocked"})
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(queries.RECORD_OUTBOX_RESULTS, [row_id for row_id, _, _ in results],
+                               [status for _, _, status in results], OUTBOX_MAX_ATTEMPTS)
+            if blocked:
+                await conn.execute(queries.MARK_BLOCKED_BOT, blocked)
+
+async def deliver_outbox_batch(bot) -> int:
+    """Send one claimed batch; returns how many rows were claimed"""
+    rows = await claim_outbox()
+    if not rows:
+        return 0
+
+    by_chat = {}
+    for row in rows:
+        by_chat.setdefault(row['chat_id'], []).append(row)
+    workers = asyncio.Semaphore(OUTBOX_WORKERS)
+    results = []
+
+    async def send_chat(chat_id, chat_rows):
+        async with workers:
+            for row in chat_rows:
+                try:
+                    status = await send_with_retry(bot, chat_id, json.loads(row['payload']))
+                except Exception as e:
+                    broadcast_logger.error(f"Error sending outbox message {row['id']}: {e}")
+                    status = "failed"
+                results.append((row['id'], chat_id, status))
+
+    await asyncio.gather(*(send_chat(chat_id, chat_rows) for chat_id, chat_rows in by_chat.items()))
+    await record_outbox_results(results)
+
+    for _, _, status in results:
+        outbox_stats[status] += 1
+    outbox_stats['batches'] += 1
+    return len(rows)
+
+def on_outbox_notify(connection, pid, channel, payload):
+    outbox_wakeup.set()
+
+async def wake_outbox():
+    outbox_wakeup.set()
+
+async def outbox_dispatcher(bot):
+    """Drain the outbox until cancelled, waiting for new rows when it is empty"""
+    purged_at = 0.0
+    while True:
+        outbox_wakeup.clear()
+        claimed = 0
+        try:
+            claimed = await deliver_outbox_batch(bot)
+            if time.monotonic() - purged_at > OUTBOX_PURGE_INTERVAL:
+                async with db_pool.acquire() as conn:
+                    await conn.execute(queries.PURGE_OUTBOX, OUTBOX_RETENTION_DAYS)
+                purged_at = time.monotonic()
+        except Exception as e:
+            broadcast_logger.error(f"Error dispatching outbox: {e}")
+        if claimed:
+            continue
+        try:
+            timeout = OUTBOX_RECHECK_INTERVAL if notify_stats['listening'] else OUTBOX_POLL_INTERVAL
+            await asyncio.wait_for(outbox_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+notify_channels[OUTBOX_CHANNEL] = (on_outbox_notify, wake_outbox)
+
+ValueMetric("bot_outbox_sent_total", "Outbox notifications sent", lambda: outbox_stats['sent'], kind="counter")
+ValueMetric("bot_outbox_failed_total", "Outbox send attempts that failed (retried with backoff)",
+            lambda: outbox_stats['failed'], kind="counter")
+ValueMetric("bot_outbox_blocked_total", "Outbox notifications dropped because the user blocked the bot",
+            lambda: outbox_stats['blocked'], kind="counter")
+
 # ---------------- Enhanced Broadcast System ----------------
 
 # Broadcast states (make sure these numbers don't conflict with other states)
 BROADCAST_TEXT, BROADCAST_MEDIA = range(16, 18)  # Using 16 and 17 to avoid conflicts
 
+@instrumented
 async def admin_broadcast_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show broadcast options"""
     query = update.callback_query
@@ -2160,10 +3580,10 @@ async def broadcast_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def broadcast_receive_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Receive and process text broadcast"""
-    print("📝 broadcast_receive_text called")
+    broadcast_logger.debug("broadcast_receive_text called")
     
     if 'broadcast_type' not in context.user_data:
-        print("❌ No broadcast_type in user_data")
+        broadcast_logger.error("No broadcast_type in user_data")
         await update.message.reply_text("❌ Broadcast session expired. Please start over.")
         return ConversationHandler.END
     
@@ -2177,7 +3597,7 @@ async def broadcast_receive_text(update: Update, context: ContextTypes.DEFAULT_T
     
     # Store the text
     context.user_data['broadcast_text'] = text
-    print(f"✅ Stored broadcast text: {text[:50]}...")
+    broadcast_logger.debug(f"Stored broadcast text: {text[:50]}...")
     
     # Create keyboard with buttons
     keyboard = [
@@ -2195,37 +3615,36 @@ async def broadcast_receive_text(update: Update, context: ContextTypes.DEFAULT_T
         reply_markup=reply_markup
     )
     
-    print("✅ Preview sent with buttons")
+    broadcast_logger.debug("Preview sent with buttons")
     return ConversationHandler.END
 
 async def broadcast_receive_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Receive and process media broadcast"""
-    print("📸 broadcast_receive_media called")
+    broadcast_logger.debug("broadcast_receive_media called")
     
     if 'broadcast_type' not in context.user_data:
-        print("❌ No broadcast_type in user_data")
+        broadcast_logger.error("No broadcast_type in user_data")
         await update.message.reply_text("❌ Broadcast session expired. Please start over.")
         return ConversationHandler.END
     
     broadcast_type = context.user_data['broadcast_type']
-    print(f"Broadcast type: {broadcast_type}")
+    broadcast_logger.debug(f"Broadcast type: {broadcast_type}")
     
     # Store media info based on type
     if broadcast_type == "photo" and update.message.photo:
         context.user_data['broadcast_media'] = update.message.photo[-1].file_id
         context.user_data['broadcast_caption'] = update.message.caption or ""
-        print(f"✅ Stored photo: {context.user_data['broadcast_media']}")
-        print(f"✅ Stored caption: {context.user_data['broadcast_caption']}")
+        broadcast_logger.debug(f"Stored photo: {context.user_data['broadcast_media']}")
         
     elif broadcast_type == "video" and update.message.video:
         context.user_data['broadcast_media'] = update.message.video.file_id
         context.user_data['broadcast_caption'] = update.message.caption or ""
-        print(f"✅ Stored video: {context.user_data['broadcast_media']}")
+        broadcast_logger.debug(f"Stored video: {context.user_data['broadcast_media']}")
         
     elif broadcast_type == "document" and update.message.document:
         context.user_data['broadcast_media'] = update.message.document.file_id
         context.user_data['broadcast_caption'] = update.message.caption or ""
-        print(f"✅ Stored document: {context.user_data['broadcast_media']}")
+        broadcast_logger.debug(f"Stored document: {context.user_data['broadcast_media']}")
         
     else:
         await update.message.reply_text(f"❌ Please send a valid {broadcast_type}.")
@@ -2237,13 +3656,13 @@ async def broadcast_receive_media(update: Update, context: ContextTypes.DEFAULT_
 
 async def show_broadcast_preview(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show broadcast preview before sending"""
-    print("🖼️ show_broadcast_preview called")
+    broadcast_logger.debug("show_broadcast_preview called")
     
     broadcast_type = context.user_data.get('broadcast_type')
     caption = context.user_data.get('broadcast_caption', "")
     
     if not broadcast_type:
-        print("❌ No broadcast_type found")
+        broadcast_logger.error("No broadcast_type found")
         await update.message.reply_text("❌ Error: Broadcast type not found. Please start over.")
         return
     
@@ -2254,7 +3673,7 @@ async def show_broadcast_preview(update: Update, context: ContextTypes.DEFAULT_T
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    preview_text = f"<b>📢 BROADCAST PREVIEW</b>\n\n"
+    preview_text = "<b>📢 BROADCAST PREVIEW</b>\n\n"
     if caption:
         preview_text += f"<b>Caption:</b> {caption}\n\n"
     
@@ -2291,147 +3710,128 @@ async def show_broadcast_preview(update: Update, context: ContextTypes.DEFAULT_T
                 parse_mode="HTML",
                 reply_markup=reply_markup
             )
-        print("✅ Preview sent successfully with buttons")
+        broadcast_logger.debug("Preview sent successfully with buttons")
     except Exception as e:
-        print(f"❌ Error sending preview: {e}")
+        broadcast_logger.error(f"Error sending preview: {e}")
         await update.message.reply_text(f"❌ Error: {e}")
 
-async def broadcast_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def broadcast_preview_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Confirm and send broadcast to all users"""
-    print("✅ broadcast_confirm called!")
+    broadcast_logger.debug("broadcast_preview_confirm called")
     query = update.callback_query
     await query.answer()
     
-    print(f"User data: {context.user_data}")
-    
-    await query.edit_message_text("📤 Broadcasting to all users... This may take a while.")
-    
-    # Get all users
-    try:
-        async with db_pool.acquire() as conn:
-            users = await conn.fetch("SELECT telegram_id FROM users WHERE is_banned = FALSE")
-    except Exception as e:
-        print(f"❌ Database error: {e}")
-        await query.edit_message_text("❌ Error accessing database.")
+    if query.from_user.id != ADMIN_USER_ID:
         return
     
-    if not users:
-        await query.edit_message_text(
-            "❌ No users found in database.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin_back")]])
-        )
-        context.user_data.clear()
+    if 'broadcast_type' not in context.user_data:
+        await query.message.reply_text("❌ Broadcast session expired. Please start over.")
         return
     
-    total = len(users)
-    success = 0
-    failed = 0
-    failed_users = []
-    
     broadcast_type = context.user_data.get('broadcast_type', 'text')
-    media_id = context.user_data.get('broadcast_media')
-    caption = context.user_data.get('broadcast_caption', "")
-    text = context.user_data.get('broadcast_text', "")
     
     # Add broadcast header
-    header = "<b>📢 ADMIN ANNOUNCEMENT</b>\n\n"
-    full_caption = header + caption
-    full_text = header + text
-    
-    # Send to each user
-    for i, user in enumerate(users):
-        try:
-            if broadcast_type == "photo":
-                await context.bot.send_photo(
-                    chat_id=user['telegram_id'],
-                    photo=media_id,
-                    caption=full_caption,
-                    parse_mode="HTML"
-                )
-            elif broadcast_type == "video":
-                await context.bot.send_video(
-                    chat_id=user['telegram_id'],
-                    video=media_id,
-                    caption=full_caption,
-                    parse_mode="HTML"
-                )
-            elif broadcast_type == "document":
-                await context.bot.send_document(
-                    chat_id=user['telegram_id'],
-                    document=media_id,
-                    caption=full_caption,
-                    parse_mode="HTML"
-                )
-            else:  # text
-                await context.bot.send_message(
-                    chat_id=user['telegram_id'],
-                    text=full_text,
-                    parse_mode="HTML"
-                )
-            success += 1
-            
-            # Update progress every 10 users
-            if i % 10 == 0 and i > 0:
-                try:
-                    await query.message.edit_text(f"📤 Broadcasting... {i}/{total} sent")
-                except:
-                    pass  # Message might be too old to edit
-                
-        except Exception as e:
-            failed += 1
-            failed_users.append(str(user['telegram_id']))
-            print(f"Failed to send to {user['telegram_id']}: {e}")
-        
-        # Small delay to avoid rate limiting
-        await asyncio.sleep(0.1)
+    if broadcast_type in ("photo", "video", "document"):
+        payload = {
+            'type': broadcast_type,
+            'media': context.user_data.get('broadcast_media'),
+            'caption': BROADCAST_HEADER + context.user_data.get('broadcast_caption', ""),
+        }
+    else:
+        payload = {'type': "text", 'text': BROADCAST_HEADER + context.user_data.get('broadcast_text', "")}
     
     # Clear broadcast data
     context.user_data.clear()
     
-    # Send report
-    report_text = (
-        f"<b>📢 BROADCAST COMPLETE</b>\n\n"
-        f"<b>✅ Successful:</b> {success}\n"
-        f"<b>❌ Failed:</b> {failed}\n"
-        f"<b>👥 Total Users:</b> {total}\n"
-    )
-    
-    if failed_users:
-        report_text += f"\n<b>Failed Users:</b> {', '.join(failed_users[:10])}"
-        if len(failed_users) > 10:
-            report_text += f" and {len(failed_users) - 10} more..."
-    
-    keyboard = [[InlineKeyboardButton("🔙 Back to Admin", callback_data="admin_back")]]
-    
+    # The preview may be a media message, so report progress in a new message
     try:
-        await query.message.edit_text(
-            report_text,
-            parse_mode="HTML",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        await query.edit_message_reply_markup(reply_markup=None)
     except:
-        # If message can't be edited, send new message
-        await context.bot.send_message(
-            chat_id=query.from_user.id,
-            text=report_text,
-            parse_mode="HTML",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        pass
+    progress_msg = await query.message.reply_text("📤 Broadcasting to all users... This may take a while.")
+    await start_broadcast(context, payload, progress_msg)
 
-async def broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def broadcast_preview_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel broadcast"""
-    print("❌ broadcast_cancel called")
+    broadcast_logger.debug("broadcast_preview_cancel called")
     query = update.callback_query
     await query.answer()
     
     context.user_data.clear()
     
-    await query.edit_message_text(
+    try:
+        await query.edit_message_reply_markup(reply_markup=None)
+    except:
+        pass
+    await query.message.reply_text(
         "❌ Broadcast cancelled.",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back to Admin", callback_data="admin_back")]])
     )
+# ---------------- Stats Counters ----------------
+# The admin dashboards read running totals from bot_stats and hourly/daily
+# rollups from bot_stats_rollups instead of counting whole tables. Handlers
+# bump them with one statement next to the write they count, inside the same
+# transaction, so the write and its count commit or fail together; the
+# reconciler recounts from the source tables every STATS_RECONCILE_INTERVAL
+# seconds to correct drift from writes made outside the bot.
+STATS_RECONCILE_INTERVAL = float(os.getenv("STATS_RECONCILE_INTERVAL", "3600"))
+STATS_RECONCILE_DAYS = int(os.getenv("STATS_RECONCILE_DAYS", "2"))
+STATS_BACKFILL_DAYS = int(os.getenv("STATS_BACKFILL_DAYS", "30"))
+STATS_HOURLY_RETENTION_DAYS = int(os.getenv("STATS_HOURLY_RETENTION_DAYS", "35"))
+
+# Event counts that also get hourly/daily rows, e.g. signups per day
+ROLLUP_STATS = ['users', 'matches', 'reports', 'chats_started']
+
+def rows_affected(status: str) -> int:
+    """Row count from an asyncpg command status such as 'DELETE 2'"""
+    return int(status.split()[-1])
+
+async def bump_stats(conn, **deltas):
+    """Add deltas to the running totals and to this hour's and day's rollups
+
+    Call it inside the transaction of the write it counts; errors propagate
+    and roll that write back rather than leaving the totals behind.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    await conn.execute(queries.BUMP_STATS, list(deltas), list(deltas.values()), ROLLUP_STATS)
+
+@instrumented(kind="db")
+async def fetch_stats():
+    """name -> (value, last_24h, last_7d) for every counter"""
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(queries.STATS_SNAPSHOT)
+    return {row['name']: row for row in rows}
+
+def stat(stats, name, column='value'):
+    row = stats.get(name)
+    return row[column] if row else 0
+
+async def reconcile_stats(days: int = STATS_RECONCILE_DAYS):
+    """Recount the totals and recent rollups from the source tables"""
+    async with db_pool.acquire() as conn:
+        drifted = await conn.fetch(queries.RECONCILE_STAT_TOTALS)
+        await conn.execute(queries.RECONCILE_STAT_ROLLUPS, days)
+        await conn.execute(queries.PURGE_HOURLY_STATS, STATS_HOURLY_RETENTION_DAYS)
+    for row in drifted:
+        if row['previous'] is not None:
+            admin_logger.warning(f"Stat {row['name']} drifted: {row['previous']} -> {row['value']}")
+
+async def stats_reconciler():
+    # The first pass also back-fills the trend rollups
+    days = STATS_BACKFILL_DAYS
+    while True:
+        try:
+            await reconcile_stats(days)
+            days = STATS_RECONCILE_DAYS
+        except Exception as e:
+            admin_logger.error(f"Error reconciling stats: {e}")
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+
 # ---------------- Updated Admin Panel ----------------
 
+@instrumented
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show admin panel"""
     user_id = update.effective_user.id
@@ -2456,33 +3856,27 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
+@instrumented
 async def admin_logs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show recent system logs"""
     query = update.callback_query
     await query.answer()
     
-    # Get some basic stats for now
-    async with db_pool.acquire() as conn:
-        recent_users = await conn.fetch("""
-            SELECT COUNT(*) FROM users WHERE created_at > NOW() - INTERVAL '24 hours'
-        """)
-        
-        recent_matches = await conn.fetchval("""
-            SELECT COUNT(*) FROM (
-                SELECT s1.liker_id, s1.liked_id 
-                FROM swipes s1
-                INNER JOIN swipes s2 ON s1.liker_id = s2.liked_id AND s1.liked_id = s2.liker_id
-                WHERE s1.created_at > NOW() - INTERVAL '24 hours'
-            ) as matches
-        """)
-        
-        active_chats = await conn.fetchval("SELECT COUNT(*) FROM active_chats")
+    stats = await fetch_stats()
+    recent_users = stat(stats, 'users', 'last_24h')
+    recent_matches = stat(stats, 'matches', 'last_24h')
+    active_chats = stat(stats, 'active_chats')
     
+    cache = user_cache_info()
+    updates = update_queue_info()
     log_text = (
         f"<b>📝 SYSTEM LOGS (Last 24h)</b>\n\n"
-        f"<b>👥 New Users:</b> {recent_users[0] if recent_users else 0}\n"
+        f"<b>👥 New Users:</b> {recent_users}\n"
         f"<b>💕 New Matches:</b> {recent_matches or 0}\n"
         f"<b>💬 Active Chats:</b> {active_chats or 0}\n\n"
+        f"<b>🗃️ User Cache:</b> {cache['hits']} hits / {cache['misses']} misses ({cache['hit_rate']:.0%})\n"
+        f"<b>📥 Update Queue:</b> {updates['depth']}/{updates['capacity']} queued, "
+        f"{updates['shed']} shed, {updates['avg_latency'] * 1000:.0f}ms avg wait\n\n"
         f"<b>🕒 Server Time:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
         f"<b>✅ Bot Status:</b> Online\n"
         f"<b>📦 Database:</b> Connected"
@@ -2496,36 +3890,20 @@ async def admin_logs(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
+@instrumented
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show statistics"""
     query = update.callback_query
     await query.answer()
     
-    async with db_pool.acquire() as conn:
-        # Total users
-        total_users = await conn.fetchval("SELECT COUNT(*) FROM users")
-        
-        # Active users (created in last 7 days)
-        active_users = await conn.fetchval("SELECT COUNT(*) FROM users WHERE created_at > NOW() - INTERVAL '7 days'")
-        
-        # Banned users
-        banned_users = await conn.fetchval("SELECT COUNT(*) FROM users WHERE is_banned = TRUE")
-        
-        # Total matches
-        total_matches = await conn.fetchval("""
-            SELECT COUNT(*) FROM (
-                SELECT s1.liker_id, s1.liked_id 
-                FROM swipes s1
-                INNER JOIN swipes s2 ON s1.liker_id = s2.liked_id AND s1.liked_id = s2.liker_id
-                WHERE s1.liker_id < s1.liked_id
-            ) as matches
-        """)
-        
-        # Total reports
-        pending_reports = await conn.fetchval("SELECT COUNT(*) FROM reports WHERE status = 'pending'")
-        
-        # Active chats
-        active_chats = await conn.fetchval("SELECT COUNT(*) FROM active_chats")
+    stats = await fetch_stats()
+    total_users = stat(stats, 'users')
+    # Active users (created in last 7 days)
+    active_users = stat(stats, 'users', 'last_7d')
+    banned_users = stat(stats, 'banned_users')
+    total_matches = stat(stats, 'matches')
+    pending_reports = stat(stats, 'pending_reports')
+    active_chats = stat(stats, 'active_chats')
     
     stats_text = (
         f"<b>📊 BOT STATISTICS</b>\n\n"
@@ -2541,55 +3919,14 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="admin_back")]]
     await query.edit_message_text(stats_text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
 
+@instrumented
 async def admin_reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show pending reports"""
     query = update.callback_query
     await query.answer()
-    
-    async with db_pool.acquire() as conn:
-        reports = await conn.fetch("""
-            SELECT r.id, r.reporter_id, r.reported_id, r.reason, r.created_at,
-                   u1.name as reporter_name, u2.name as reported_name
-            FROM reports r
-            LEFT JOIN users u1 ON r.reporter_id = u1.telegram_id
-            LEFT JOIN users u2 ON r.reported_id = u2.telegram_id
-            WHERE r.status = 'pending'
-            ORDER BY r.created_at DESC
-            LIMIT 10
-        """)
-    
-    if not reports:
-        await query.edit_message_text(
-            "✅ No pending reports.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin_back")]])
-        )
-        return
-    
-    text = "<b>🚨 PENDING REPORTS</b>\n\n"
-    keyboard = []
-    
-    for report in reports:
-        report_id = report['id']
-        text += f"<b>Report ID:</b> {report_id}\n"
-        text += f"<b>Reporter:</b> {report['reporter_name']} ({report['reporter_id']})\n"
-        text += f"<b>Reported:</b> {report['reported_name']} ({report['reported_id']})\n"
-        text += f"<b>Reason:</b> {report['reason'][:100]}...\n"
-        text += f"<b>Date:</b> {report['created_at'].strftime('%Y-%m-%d %H:%M')}\n"
-        text += "-" * 30 + "\n"
-        
-        keyboard.append([
-            InlineKeyboardButton(f"✅ Approve {report_id}", callback_data=f"approve_{report_id}"),
-            InlineKeyboardButton(f"❌ Reject {report_id}", callback_data=f"reject_{report_id}")
-        ])
-    
-    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="admin_back")])
-    
-    await query.edit_message_text(
-        text,
-        parse_mode="HTML",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    await show_admin_list(query, context, 'reports')
 
+@instrumented
 async def admin_handle_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle report approval/rejection"""
     query = update.callback_query
@@ -2606,34 +3943,35 @@ async def admin_handle_report(update: Update, context: ContextTypes.DEFAULT_TYPE
     else:
         return
     
+    banned = 0
     async with db_pool.acquire() as conn:
-        # Get report details
-        report = await conn.fetchrow("""
-            SELECT reporter_id, reported_id, reason FROM reports WHERE id = $1
-        """, report_id)
-        
-        if report:
-            # Update report status
-            await conn.execute("UPDATE reports SET status = $1 WHERE id = $2", status, report_id)
+        async with conn.transaction():
+            # Get report details
+            report = await conn.fetchrow(queries.REPORT_BY_ID, report_id)
             
-            # If approved, ban the reported user
-            if status == "approved":
-                await conn.execute("UPDATE users SET is_banned = TRUE WHERE telegram_id = $1", report['reported_id'])
+            if report:
+                # Update report status
+                await conn.execute(queries.SET_REPORT_STATUS, status, report_id)
                 
-                # Notify the reported user
-                try:
-                    await context.bot.send_message(
-                        chat_id=report['reported_id'],
-                        text="❌ Your account has been banned due to user reports. Contact admin for appeal."
-                    )
-                except:
-                    pass
+                # If approved, ban the reported user and queue their notice with the ban
+                if status == "approved":
+                    banned = rows_affected(await conn.execute(queries.BAN_USER, report['reported_id']))
+                    if banned:
+                        await enqueue_notifications(conn, [(report['reported_id'], notification(
+                            "❌ Your account has been banned due to user reports. Contact admin for appeal."))])
+                await bump_stats(conn, pending_reports=-1 if report['status'] == 'pending' else 0, banned_users=banned)
+    
+    if report and status == "approved":
+        invalidate_candidate_queue(report['reported_id'])
+        invalidate_user_cache(report['reported_id'])
+        index_candidates('set_flag', BANNED, True, report['reported_id'])
     
     await query.edit_message_text(
         f"✅ Report {report_id} {action}!",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin_reports")]])
     )
 
+@instrumented
 async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start broadcast process"""
     query = update.callback_query
@@ -2665,55 +4003,22 @@ async def handle_broadcast_message(update: Update, context: ContextTypes.DEFAULT
         await update.message.reply_text("Broadcast cancelled.")
         return
     
-    # Get all users
-    async with db_pool.acquire() as conn:
-        users = await conn.fetch("SELECT telegram_id FROM users WHERE is_banned = FALSE")
-    
-    total = len(users)
-    success = 0
-    failed = 0
-    
-    await update.message.reply_text(f"📤 Broadcasting to {total} users...")
-    
-    # Send to each user
-    for user in users:
-        try:
-            if update.message.text:
-                await context.bot.send_message(
-                    chat_id=user['telegram_id'],
-                    text=f"<b>📢 ADMIN ANNOUNCEMENT</b>\n\n{update.message.text}",
-                    parse_mode="HTML"
-                )
-            elif update.message.photo:
-                await context.bot.send_photo(
-                    chat_id=user['telegram_id'],
-                    photo=update.message.photo[-1].file_id,
-                    caption=f"<b>📢 ADMIN ANNOUNCEMENT</b>\n\n{update.message.caption or ''}",
-                    parse_mode="HTML"
-                )
-            elif update.message.document:
-                await context.bot.send_document(
-                    chat_id=user['telegram_id'],
-                    document=update.message.document.file_id,
-                    caption=f"<b>📢 ADMIN ANNOUNCEMENT</b>\n\n{update.message.caption or ''}",
-                    parse_mode="HTML"
-                )
-            success += 1
-        except Exception as e:
-            failed += 1
-            print(f"Failed to send to {user['telegram_id']}: {e}")
-        
-        # Small delay to avoid rate limiting
-        await asyncio.sleep(0.1)
+    if update.message.text:
+        payload = {'type': "text", 'text': BROADCAST_HEADER + update.message.text}
+    elif update.message.photo:
+        payload = {'type': "photo", 'media': update.message.photo[-1].file_id, 'caption': BROADCAST_HEADER + (update.message.caption or '')}
+    elif update.message.document:
+        payload = {'type': "document", 'media': update.message.document.file_id, 'caption': BROADCAST_HEADER + (update.message.caption or '')}
+    else:
+        await update.message.reply_text("❌ Please send text, a photo or a document.")
+        return
     
     context.user_data.pop('broadcasting', None)
     
-    await update.message.reply_text(
-        f"✅ Broadcast completed!\n\n"
-        f"✅ Successful: {success}\n"
-        f"❌ Failed: {failed}"
-    )
+    progress_msg = await update.message.reply_text("📤 Broadcasting to all users...")
+    await start_broadcast(context, payload, progress_msg)
 
+@instrumented
 async def admin_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Return to admin panel"""
     query = update.callback_query
@@ -2814,55 +4119,11 @@ async def broadcast_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data.clear()
         return
     
-    # Get all active users (non-banned)
-    async with db_pool.acquire() as conn:
-        users = await conn.fetch("SELECT telegram_id FROM users WHERE is_banned = FALSE")
-    
-    if not users:
-        await query.edit_message_text("❌ No users found in database.")
-        context.user_data.clear()
-        return
-    
-    total = len(users)
-    successful = 0
-    failed = 0
-    
     # Send progress message
-    progress_msg = await query.message.reply_text(f"📤 Broadcasting... 0/{total}")
-    
-    for i, user in enumerate(users):
-        try:
-            # copy_message works for ALL message types!
-            await context.bot.copy_message(
-                chat_id=user['telegram_id'],
-                from_chat_id=from_chat_id,
-                message_id=msg_id
-            )
-            successful += 1
-        except Exception as e:
-            failed += 1
-            print(f"Failed to send to {user['telegram_id']}: {e}")
-        
-        # Update progress every 10 users
-        if i % 10 == 0 and i > 0:
-            try:
-                await progress_msg.edit_text(f"📤 Broadcasting... {successful + failed}/{total}")
-            except:
-                pass
-        
-        # Small delay to avoid rate limiting
-        await asyncio.sleep(0.05)
-    
-    # Final report
-    await progress_msg.edit_text(
-        f"✅ <b>Broadcast Complete!</b>\n\n"
-        f"✅ Successful: {successful}\n"
-        f"❌ Failed: {failed}\n"
-        f"👥 Total: {total}",
-        parse_mode="HTML"
-    )
+    progress_msg = await query.message.reply_text("📤 Broadcasting...")
+    await start_broadcast(context, {'type': "copy", 'from_chat_id': from_chat_id, 'message_id': msg_id}, progress_msg)
     
-    await query.edit_message_text("✅ Broadcast completed.")
+    await query.edit_message_text("✅ Broadcast started. Progress is reported below.")
     context.user_data.clear()
 
 async def broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2880,60 +4141,38 @@ async def start_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     partner_id = int(query.data.split('_')[1])
     
-    async with db_pool.acquire() as conn:
-        # Check if user is already in a chat
-        existing_chat = await conn.fetchrow("SELECT partner_id FROM active_chats WHERE user_id = $1", user_id)
-        if existing_chat:
-            await query.message.reply_text("❌ You are already in a chat! Use /stop to end your current conversation before starting a new one.")
-            return
-        
-        # Check pending request
-        pending_request = await conn.fetchrow("""
-            SELECT id FROM chat_requests 
-            WHERE requester_id = $1 AND requested_id = $2 AND status = 'pending'
-        """, partner_id, user_id)
-        
-        if pending_request:
-            await conn.execute("DELETE FROM chat_requests WHERE id = $1", pending_request['id'])
-        else:
-            # Check if partner is already in a chat
-            partner_chat = await conn.fetchrow("SELECT partner_id FROM active_chats WHERE user_id = $1", partner_id)
-            if partner_chat:
-                await conn.execute(
-                    "INSERT INTO chat_requests (requester_id, requested_id) VALUES ($1, $2)",
-                    user_id, partner_id
-                )
-                
-                try:
-                    await context.bot.send_message(
-                        chat_id=partner_id,
-                        text=f"<b>💬 Chat Request</b>\n\n"
-                             f"Someone wants to chat with you! Use /requests to view pending requests.",
-                        parse_mode="HTML"
-                    )
-                except:
-                    pass
-                
-                await query.message.reply_text(
-                    "📨 Chat request sent! The other user will be notified.\n"
-                    "You can check your pending requests with /requests."
-                )
-                return
-
-        # Clear any old active chats
-        await conn.execute("DELETE FROM active_chats WHERE user_id = $1 OR partner_id = $1", user_id)
-        await conn.execute("DELETE FROM active_chats WHERE user_id = $1 OR partner_id = $1", partner_id)
-        
-        # Create the new connection
-        await conn.execute("INSERT INTO active_chats (user_id, partner_id) VALUES ($1, $2)", user_id, partner_id)
-        await conn.execute("INSERT INTO active_chats (user_id, partner_id) VALUES ($1, $2)", partner_id, user_id)
-
-        # Get names
-        partner_row = await conn.fetchrow("SELECT name FROM users WHERE telegram_id = $1", partner_id)
-        partner_name = partner_row['name'] if partner_row else "your match"
+    # One statement decides between busy/requested/paired, ends old chats,
+    # pairs both directions and returns both names
+    row = await run_chat_statement(queries.START_CHAT, user_id, partner_id)
+    
+    if row['outcome'] == 'busy':
+        await query.message.reply_text("❌ You are already in a chat! Use /stop to end your current conversation before starting a new one.")
+        return
+    
+    if row['outcome'] == 'requested':
+        # Partner is already in a chat, so a request was left instead
+        try:
+            await context.bot.send_message(
+                chat_id=partner_id,
+                text="<b>💬 Chat Request</b>\n\n"
+                     "Someone wants to chat with you! Use /requests to view pending requests.",
+                parse_mode="HTML"
+            )
+        except:
+            pass
         
-        my_row = await conn.fetchrow("SELECT name FROM users WHERE telegram_id = $1", user_id)
-        my_name = my_row['name'] if my_row else "Someone"
+        await query.message.reply_text(
+            "📨 Chat request sent! The other user will be notified.\n"
+            "You can check your pending requests with /requests."
+        )
+        return
+    
+    invalidate_user_cache(user_id, partner_id, *row['ended'])
+    index_candidates('set_flag', IN_CHAT, False, *row['ended'])
+    index_candidates('set_flag', IN_CHAT, True, user_id, partner_id)
+    
+    partner_name = row['partner_name'] or "your match"
+    my_name = row['user_name'] or "Someone"
 
     ice_breaker = (
         "<b>🎬 THE STAGE IS YOURS!</b>\n\n"
@@ -2960,34 +4199,20 @@ async def start_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         pass
 
+CHAT_ENDED_NOTICE = notification(
+    "<b>❌ YOUR CHAT PARTNER HAS ENDED THE CONVERSATION.</b>\n\n"
+    "If you want to reconnect, they will need to accept your new request.\n"
+    "Use /requests to manage reconnection requests."
+)
+
 async def stop_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    partner_id = None
     
-    async with db_pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT partner_id FROM active_chats WHERE user_id = $1", user_id)
-        if row:
-            partner_id = row['partner_id']
-        
-        await conn.execute("DELETE FROM active_chats WHERE user_id = $1 OR partner_id = $1", user_id)
-        await conn.execute("DELETE FROM active_chats WHERE user_id = $1 OR partner_id = $1", partner_id)
-        
-        if partner_id:
-            await conn.execute(
-                "INSERT INTO chat_requests (requester_id, requested_id, status) VALUES ($1, $2, 'pending')",
-                partner_id, user_id
-            )
-    
-    if partner_id:
-        try:
-            await context.bot.send_message(
-                chat_id=partner_id,
-                text="<b>❌ YOUR CHAT PARTNER HAS ENDED THE CONVERSATION.</b>\n\n"
-                     "If you want to reconnect, they will need to accept your new request.\n"
-                     "Use /requests to manage reconnection requests."
-            )
-        except:
-            pass
+    # Ends the chat, leaves the partner a reconnection request and queues
+    # their notice in the outbox in one statement
+    row = await run_chat_statement(queries.END_CHATS, [user_id], CHAT_ENDED_NOTICE)
+    invalidate_user_cache(user_id, *row['ended'])
+    index_candidates('set_flag', IN_CHAT, False, user_id, *row['ended'])
     
     await update.message.reply_text("📴 Chat ended. The other user will need your permission to reconnect.")
 
@@ -2996,13 +4221,7 @@ async def view_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     async with db_pool.acquire() as conn:
-        requests = await conn.fetch("""
-            SELECT cr.id, cr.requester_id, u.name, u.campus
-            FROM chat_requests cr
-            JOIN users u ON cr.requester_id = u.telegram_id
-            WHERE cr.requested_id = $1 AND cr.status = 'pending'
-            ORDER BY cr.created_at DESC
-        """, user_id)
+        requests = await conn.fetch(queries.PENDING_REQUESTS_FOR, user_id)
     
     if not requests:
         await update.message.reply_text("You have no pending chat requests.")
@@ -3035,52 +4254,36 @@ async def handle_request_action(update: Update, context: ContextTypes.DEFAULT_TY
     if query.data.startswith("accept_"):
         request_id = int(query.data.split('_')[1])
         
-        async with db_pool.acquire() as conn:
-            # Get request details
-            request = await conn.fetchrow("""
-                SELECT requester_id, requested_id FROM chat_requests WHERE id = $1
-            """, request_id)
+        row = await run_chat_statement(queries.ACCEPT_CHAT_REQUEST, request_id)
+        
+        if row:
+            requester_id = row['requester_id']
+            requested_id = row['requested_id']
+            invalidate_user_cache(requester_id, requested_id, *row['ended'])
+            index_candidates('set_flag', IN_CHAT, False, *row['ended'])
+            index_candidates('set_flag', IN_CHAT, True, requester_id, requested_id)
             
-            if request:
-                requester_id = request['requester_id']
-                requested_id = request['requested_id']
-                
-                # Clear old chats
-                await conn.execute("DELETE FROM active_chats WHERE user_id = $1 OR partner_id = $1", requester_id)
-                await conn.execute("DELETE FROM active_chats WHERE user_id = $1 OR partner_id = $1", requested_id)
-                
-                # Create new chat
-                await conn.execute("INSERT INTO active_chats (user_id, partner_id) VALUES ($1, $2)", requester_id, requested_id)
-                await conn.execute("INSERT INTO active_chats (user_id, partner_id) VALUES ($1, $2)", requested_id, requester_id)
-                
-                # Delete the request
-                await conn.execute("DELETE FROM chat_requests WHERE id = $1", request_id)
-                
-                # Get names
-                requester_name = await conn.fetchval("SELECT name FROM users WHERE telegram_id = $1", requester_id)
-                requested_name = await conn.fetchval("SELECT name FROM users WHERE telegram_id = $1", requested_id)
-                
-                # Notify both users
-                try:
-                    await context.bot.send_message(
-                        chat_id=requester_id,
-                        text=f"<b>✅ CHAT REQUEST ACCEPTED!</b>\n\n"
-                             f"You are now connected with {requested_name}! Say hello! 👋",
-                        parse_mode="HTML"
-                    )
-                except:
-                    pass
-                
-                await query.edit_message_text(
-                    f"✅ Chat request accepted! You are now connected with {requester_name}.",
-                    reply_markup=None
+            # Notify both users
+            try:
+                await context.bot.send_message(
+                    chat_id=requester_id,
+                    text=f"<b>✅ CHAT REQUEST ACCEPTED!</b>\n\n"
+                         f"You are now connected with {row['requested_name']}! Say hello! 👋",
+                    parse_mode="HTML"
                 )
+            except:
+                pass
+            
+            await query.edit_message_text(
+                f"✅ Chat request accepted! You are now connected with {row['requester_name']}.",
+                reply_markup=None
+            )
     
     elif query.data.startswith("decline_"):
         request_id = int(query.data.split('_')[1])
         
         async with db_pool.acquire() as conn:
-            await conn.execute("DELETE FROM chat_requests WHERE id = $1", request_id)
+            await conn.execute(queries.DELETE_CHAT_REQUEST, request_id)
         
         await query.edit_message_text(
             "❌ Chat request declined.",
@@ -3091,7 +4294,7 @@ async def handle_request_action(update: Update, context: ContextTypes.DEFAULT_TY
         user_id = query.from_user.id
         
         async with db_pool.acquire() as conn:
-            await conn.execute("DELETE FROM chat_requests WHERE requested_id = $1", user_id)
+            await conn.execute(queries.CLEAR_CHAT_REQUESTS, user_id)
         
         await query.edit_message_text(
             "🗑️ All pending requests cleared.",
@@ -3099,7 +4302,7 @@ async def handle_request_action(update: Update, context: ContextTypes.DEFAULT_TY
         )
 
 # ---------------- Conversation Handler ----------------
-conv_handler = ConversationHandler(
+conv_handler = SharedConversationHandler(
     entry_points=[CommandHandler('start', start)],
     states={
         NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_name)],
@@ -3120,27 +4323,269 @@ conv_handler = ConversationHandler(
         REPORT_REASON: [MessageHandler(filters.TEXT & ~filters.COMMAND, report_reason)]
     },
     fallbacks=[CommandHandler('cancel', cancel)],
-    per_message=False
+    per_message=False,
+    name="registration",
+    persistent=True
 )
 
+# ---------------- Persistence ----------------
+# user_data and the registration/broadcast conversation states are kept in
+# Postgres (see persistence.py) so a restart doesn't drop half-finished flows
+# and any replica can handle a user's next update. load_persisted_state runs
+# first for every update and reads the user's user_data and conversation
+# states only on a cache miss. Changes are written in batches every PERSISTENCE_FLUSH_INTERVAL seconds and
+# announced on PERSISTENCE_CHANNEL so other replicas reload those users.
+PERSISTENCE_CHANNEL = "bot_state"
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv("PERSISTENCE_FLUSH_INTERVAL", "2"))
+PERSISTENCE_CACHE_SIZE = int(os.getenv("PERSISTENCE_CACHE_SIZE", "10000"))
+# Idle time after which a user's state is re-read even without a notification
+PERSISTENCE_CACHE_TTL = float(os.getenv("PERSISTENCE_CACHE_TTL", "600"))
+# Age after which a user's state is re-read while LISTEN isn't running
+PERSISTENCE_POLL_TTL = float(os.getenv("PERSISTENCE_POLL_TTL", "5"))
+
+# Created in main() once the pool exists
+bot_persistence = None
+
+async def load_persisted_state(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Load the user's stored state before any handler, conversations included, looks at it"""
+    if bot_persistence is None or not update.effective_user:
+        return
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id if update.effective_chat else user_id
+    try:
+        await bot_persistence.load(context.application, user_id, chat_id)
+    except Exception as e:
+        db_logger.error(f"Error loading persisted state for {user_id}: {e}")
+
+async def flush_persisted_state(application: Application):
+    """Hand dirty state to the persistence and write it in one batch"""
+    if bot_persistence is None:
+        return
+    await application.update_persistence()
+    await bot_persistence.flush()
+
+async def persistence_flusher(application: Application):
+    while True:
+        await asyncio.sleep(PERSISTENCE_FLUSH_INTERVAL)
+        try:
+            await flush_persisted_state(application)
+        except Exception as e:
+            db_logger.error(f"Error flushing persisted state: {e}")
+
+def on_state_notify(connection, pid, channel, payload):
+    if bot_persistence is not None:
+        bot_persistence.on_notify(connection, pid, channel, payload)
+
+async def clear_persisted_state_cache():
+    if bot_persistence is not None:
+        bot_persistence.clear_cache()
+
+notify_channels[PERSISTENCE_CHANNEL] = (on_state_notify, clear_persisted_state_cache)
+
+ValueMetric("bot_persistence_cache_hits_total", "Updates whose state was already loaded",
+            lambda: bot_persistence.stats['hits'] if bot_persistence else 0, kind="counter")
+ValueMetric("bot_persistence_cache_misses_total", "Updates that read state from Postgres",
+            lambda: bot_persistence.stats['misses'] if bot_persistence else 0, kind="counter")
+ValueMetric("bot_persistence_rows_written_total", "user_data and conversation rows flushed",
+            lambda: bot_persistence.stats['rows'] if bot_persistence else 0, kind="counter")
+ValueMetric("bot_persistence_pending", "Changes waiting for the next flush",
+            lambda: len(bot_persistence.pending_users) + len(bot_persistence.pending_conversations)
+            if bot_persistence else 0)
+
+# ---------------- Update Queue ----------------
+# The webhook only validates an update and starts a task for it. Updates run
+# concurrently through PTB's update processor (ApplicationBuilder
+# .concurrent_updates), UPDATE_CONCURRENCY at a time, so one slow find_match
+# or broadcast no longer holds up everyone else. A per-user lock keeps each
+# user's updates in arrival order; an update waits for its lock before taking
+# a processing slot, so a user with a slow update only delays themselves.
+# When UPDATE_QUEUE_SIZE updates are in flight the webhook answers 503 and
+# Telegram redelivers the update later.
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1600"))
+
+class UserLocks:
+    """One asyncio.Lock per user, dropped as soon as no update holds or waits on it"""
+
+    def __init__(self):
+        self.locks = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self.locks)
+
+    def get(self, key):
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        return lock
+
+update_locks = UserLocks()
+update_application = None
+# Updates accepted and not finished yet, waiting or running
+update_tasks = set()
+update_queue_stats = {
+    'enqueued': 0, 'processed': 0, 'shed': 0, 'errors': 0, 'running': 0, 'contended': 0,
+    'max_depth': 0, 'total_latency': 0.0, 'max_latency': 0.0,
+}
+
+def update_lock_key(update: Update):
+    """Updates from the same user (or chat, for userless updates) run in order"""
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+def enqueue_update(update: Update):
+    """Start processing an update; returns False if it had to be shed"""
+    if len(update_tasks) >= UPDATE_QUEUE_SIZE:
+        update_queue_stats['shed'] += 1
+        return False
+    # Tasks start in creation order and a free lock is taken without
+    # yielding, so each user's updates reach their lock in arrival order
+    task = asyncio.create_task(run_update(update_application, update, time.monotonic()))
+    update_tasks.add(task)
+    task.add_done_callback(update_tasks.discard)
+    update_queue_stats['enqueued'] += 1
+    depth = len(update_tasks) - update_queue_stats['running']
+    update_queue_stats['max_depth'] = max(update_queue_stats['max_depth'], depth)
+    return True
+
+async def run_update(application: Application, update: Update, enqueued_at: float):
+    key = update_lock_key(update)
+    lock = update_locks.get(key) if key is not None else None
+    if lock is not None:
+        if lock.locked():
+            update_queue_stats['contended'] += 1
+        await lock.acquire()
+        update_lock_wait.observe(time.monotonic() - enqueued_at)
+    try:
+        await application.update_processor.process_update(update, handle_update(application, update, enqueued_at))
+    finally:
+        if lock is not None:
+            lock.release()
+
+async def handle_update(application: Application, update: Update, enqueued_at: float):
+    """Process an update once it holds its user's lock and a processing slot"""
+    latency = time.monotonic() - enqueued_at
+    update_wait.observe(latency)
+    update_queue_stats['total_latency'] += latency
+    update_queue_stats['max_latency'] = max(update_queue_stats['max_latency'], latency)
+    update_queue_stats['running'] += 1
+    started = time.monotonic()
+    try:
+        await application.process_update(update)
+        log_sampled(update_logger, logging.INFO, "Update processed", update_id=update.update_id,
+                    wait_ms=round(latency * 1000, 1),
+                    handle_ms=round((time.monotonic() - started) * 1000, 1))
+    except Exception as e:
+        update_queue_stats['errors'] += 1
+        update_logger.exception(f"Error processing update {update.update_id}: {type(e).__name__}: {e}")
+    finally:
+        update_duration.observe(time.monotonic() - started)
+        update_queue_stats['running'] -= 1
+        update_queue_stats['processed'] += 1
+
+def start_update_processing(application: Application):
+    global update_application
+    update_application = application
+    update_logger.info(f"Processing up to {application.update_processor.max_concurrent_updates} updates "
+                       f"concurrently (queue size {UPDATE_QUEUE_SIZE})")
+
+async def stop_update_processing(timeout: float = 10):
+    """Give accepted updates a chance to finish, then cancel the rest"""
+    if not update_tasks:
+        return
+    _, pending = await asyncio.wait(set(update_tasks), timeout=timeout)
+    if pending:
+        update_logger.warning(f"{len(pending)} queued updates dropped at shutdown")
+    for task in pending:
+        task.cancel()
+
+def update_queue_info():
+    """Backpressure counters for the admin logs and debug endpoint"""
+    started = update_queue_stats['processed']
+    return {
+        **update_queue_stats,
+        'depth': len(update_tasks) - update_queue_stats['running'],
+        'capacity': UPDATE_QUEUE_SIZE,
+        'locks': len(update_locks),
+        'avg_latency': round(update_queue_stats['total_latency'] / started, 4) if started else 0.0,
+        'max_latency': round(update_queue_stats['max_latency'], 4),
+        'total_latency': round(update_queue_stats['total_latency'], 3),
+    }
+
+ValueMetric("bot_update_queue_depth", "Updates waiting for their user's lock or a processing slot",
+            lambda: len(update_tasks) - update_queue_stats['running'])
+ValueMetric("bot_update_queue_capacity", "Updates that can be in flight before shedding", lambda: UPDATE_QUEUE_SIZE)
+ValueMetric("bot_updates_running", "Updates being processed right now", lambda: update_queue_stats['running'])
+ValueMetric("bot_update_locks", "Users with an update holding or waiting for their lock", lambda: len(update_locks))
+ValueMetric("bot_update_lock_contended_total", "Updates that found their user's lock held",
+            lambda: update_queue_stats['contended'], "counter")
+ValueMetric("bot_updates_enqueued_total", "Updates accepted by the webhook", lambda: update_queue_stats['enqueued'], "counter")
+ValueMetric("bot_updates_processed_total", "Updates handled; rate() gives updates/s", lambda: update_queue_stats['processed'], "counter")
+ValueMetric("bot_updates_shed_total", "Updates answered with 503 because the queue was full", lambda: update_queue_stats['shed'], "counter")
+
 # ---------------- MAIN FUNCTION - WEBHOOK VERSION ----------------
+async def start_placeholder_server():
+    """Answer health checks on PORT while migrations and the bot start up"""
+    async def handle_starting(request):
+        if request.path == '/health':
+            return web.Response(text="Bot is starting")
+        # Telegram redelivers webhook calls answered with 503
+        return web.Response(status=503, text="Bot is starting")
+
+    web_app = web.Application()
+    web_app.router.add_route('*', '/{tail:.*}', handle_starting)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', PORT).start()
+    return runner
+
+def install_stop_signals():
+    """An event set on SIGTERM (Render and Docker stop) or SIGINT (Ctrl+C)"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows event loops have no signal handlers; Ctrl+C still raises KeyboardInterrupt
+            pass
+    return stop
+
+async def shutdown_step(description, step):
+    """Run one shutdown step, logging a failure instead of skipping the steps after it"""
+    try:
+        await step()
+    except Exception as e:
+        logger.error(f"Error during shutdown ({description}): {e}")
+
 async def main():
     """Main function using webhook (recommended for Render)"""
+    global bot_persistence
+    
+    # Bind the port before migrations, which can build indexes for up to
+    # MIGRATION_TIMEOUT, so the platform's health check passes meanwhile
+    placeholder_runner = await start_placeholder_server()
     
     # Initialize database FIRST
-    print("🔄 Initializing database...")
+    logger.info("Initializing database...")
     try:
         await init_db()
-        print("✅ Database initialized successfully!")
+        logger.info("Database initialized successfully!")
+        await load_chat_routes()
     except Exception as e:
-        print(f"❌ Failed to initialize database: {e}")
+        logger.error(f"Failed to initialize database: {e}")
+        await placeholder_runner.cleanup()
         return
     
     # Get Render URL from environment
     RENDER_URL = os.getenv("RENDER_URL")
     if not RENDER_URL:
-        print("❌ ERROR: RENDER_URL environment variable is required for webhook mode!")
-        print("Please add it in Render dashboard: https://au-university-dating-telegram-bot.onrender.com")
+        logger.error("RENDER_URL environment variable is required for webhook mode! "
+                     "Please add it in Render dashboard: https://au-university-dating-telegram-bot.onrender.com")
+        await placeholder_runner.cleanup()
         return
     
     # Remove any trailing slash
@@ -3149,19 +4594,34 @@ async def main():
     WEBHOOK_PATH = "/webhook"
     WEBHOOK_URL = f"{RENDER_URL}{WEBHOOK_PATH}"
     
-    print(f"🌐 Configured webhook URL: {WEBHOOK_URL}")
-    print(f"🔍 To test manually, visit: {RENDER_URL}/health")
-    print(f"🔍 For debug info, visit: {RENDER_URL}/test")
+    logger.info(f"Configured webhook URL: {WEBHOOK_URL}")
+    logger.debug(f"To test manually, visit: {RENDER_URL}/health")
+    logger.debug(f"For debug info, visit: {RENDER_URL}/test")
     
     # Create Telegram application
-    print("🤖 Creating Telegram bot application...")
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    logger.info("Creating Telegram bot application...")
+    bot_persistence = PostgresPersistence(
+        db_pool, PERSISTENCE_CHANNEL, origin=f"{socket.gethostname()}:{os.getpid()}",
+        cache_size=PERSISTENCE_CACHE_SIZE, cache_ttl=PERSISTENCE_CACHE_TTL,
+        poll_ttl=PERSISTENCE_POLL_TTL, listening=lambda: notify_stats['listening'],
+        update_interval=PERSISTENCE_FLUSH_INTERVAL,
+    )
+    builder = ApplicationBuilder().token(BOT_TOKEN).request(InstrumentedRequest(connection_pool_size=256))
+    builder = builder.concurrent_updates(UPDATE_CONCURRENCY)
+    builder = builder.persistence(bot_persistence)
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(TELEGRAM_API_BASE_URL)
+    app = builder.build()
 
     # Add all handlers (keep ALL your existing handlers here)
-    print("🔧 Adding handlers...")
+    logger.info("Adding handlers...")
     
     # Conversation handler for registration
+    # Groups -2 and -1 run before every other handler without stopping them
+    app.add_handler(TypeHandler(Update, load_persisted_state), group=-2)
+    app.add_handler(TypeHandler(Update, touch_activity), group=-1)
     app.add_handler(conv_handler)
+    app.add_handler(ChatMemberHandler(track_channel_membership, ChatMemberHandler.CHAT_MEMBER))
     
     # Basic commands
     app.add_handler(CommandHandler("find", find_match))
@@ -3171,7 +4631,8 @@ async def main():
     app.add_handler(CommandHandler("report", report_user))
     app.add_handler(CommandHandler("requests", view_requests))
     app.add_handler(CommandHandler("admin", admin_panel))
-    app.add_handler(CommandHandler("debug", debug_db))
+    if DIAGNOSTICS:
+        app.add_handler(CommandHandler("debug", debug_db))
     app.add_handler(CommandHandler("broadcast", broadcast_command))
 
 # Add these with your other callback query handlers
@@ -3189,6 +4650,8 @@ async def main():
     app.add_handler(CallbackQueryHandler(check_channel_callback, pattern="^check_channel$"))
     app.add_handler(CallbackQueryHandler(broadcast_confirm, pattern="^confirm_broadcast$"))
     app.add_handler(CallbackQueryHandler(broadcast_cancel, pattern="^cancel_broadcast$"))
+    app.add_handler(CallbackQueryHandler(broadcast_preview_confirm, pattern="^broadcast_confirm$"))
+    app.add_handler(CallbackQueryHandler(broadcast_preview_cancel, pattern="^broadcast_cancel$"))
     
     # Admin callbacks - Basic
     app.add_handler(CallbackQueryHandler(admin_stats, pattern="^admin_stats$"))
@@ -3200,7 +4663,7 @@ async def main():
     # Admin callbacks - Enhanced User Management
     app.add_handler(CallbackQueryHandler(admin_users, pattern="^admin_users$"))
     app.add_handler(CallbackQueryHandler(admin_list_users, pattern="^admin_list_users$"))
-    app.add_handler(CallbackQueryHandler(admin_users_page, pattern="^admin_users_page_"))
+    app.add_handler(CallbackQueryHandler(admin_list_page, pattern="^kp_"))
     app.add_handler(CallbackQueryHandler(admin_view_user, pattern="^admin_view_user_"))
     app.add_handler(CallbackQueryHandler(admin_ban_user, pattern="^admin_ban_"))
     app.add_handler(CallbackQueryHandler(admin_unban_user, pattern="^admin_unban_"))
@@ -3232,8 +4695,8 @@ async def main():
     
     # Create broadcast conversation handler
         # Create broadcast conversation handler
-    broadcast_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(broadcast_start, pattern="^broadcast_")],
+    broadcast_conv_handler = SharedConversationHandler(
+        entry_points=[CallbackQueryHandler(broadcast_start, pattern="^broadcast_(text|photo|video|document)$")],
         states={
             BROADCAST_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, broadcast_receive_text)],
             BROADCAST_MEDIA: [
@@ -3244,26 +4707,29 @@ async def main():
         },
         fallbacks=[CommandHandler('cancel', cancel)],
         per_message=False,
-        name="broadcast_conversation"
+        name="broadcast_conversation",
+        persistent=True
     )
     
     app.add_handler(broadcast_conv_handler)
+    bot_persistence.track_conversations(conv_handler, broadcast_conv_handler)
     
-    print("✅ All handlers added!")
-    print(f"👑 Admin User ID: {ADMIN_USER_ID if ADMIN_USER_ID else 'Not set'}")
-    print(f"📢 Channel: {CHANNEL_USERNAME}")
+    logger.info("All handlers added!")
+    logger.info(f"Admin User ID: {ADMIN_USER_ID if ADMIN_USER_ID else 'Not set'}")
+    logger.info(f"Channel: {CHANNEL_USERNAME}")
     
     # CRITICAL FIX: Initialize the application BEFORE setting webhook
-    print("🔧 Initializing application...")
+    logger.info("Initializing application...")
     await app.initialize()
-    print("✅ Application initialized!")
+    logger.info("Application initialized!")
+    start_update_processing(app)
     
     # Set up webhook with verification
-    print("🔧 Setting webhook...")
+    logger.info("Setting webhook...")
     
     # Delete any existing webhook first
     delete_result = await app.bot.delete_webhook(drop_pending_updates=True)
-    print(f"✅ Delete webhook result: {delete_result}")
+    logger.info(f"Delete webhook result: {delete_result}")
     
     # Set the new webhook
     set_result = await app.bot.set_webhook(
@@ -3272,22 +4738,21 @@ async def main():
         drop_pending_updates=True,
         max_connections=40
     )
-    print(f"✅ Set webhook result: {set_result}")
+    logger.info(f"Set webhook result: {set_result}")
     
     # Verify webhook was set correctly
     webhook_info = await app.bot.get_webhook_info()
-    print(f"📊 Webhook info:")
-    print(f"   URL: {webhook_info.url}")
-    print(f"   Pending updates: {webhook_info.pending_update_count}")
-    print(f"   Max connections: {webhook_info.max_connections}")
+    logger.info("Webhook info", extra={
+        'url': webhook_info.url,
+        'pending_updates': webhook_info.pending_update_count,
+        'max_connections': webhook_info.max_connections,
+    })
     
     if webhook_info.url != WEBHOOK_URL:
-        print(f"⚠️ Warning: Webhook URL mismatch!")
-        print(f"   Expected: {WEBHOOK_URL}")
-        print(f"   Actual: {webhook_info.url}")
+        logger.warning("Webhook URL mismatch!", extra={'expected': WEBHOOK_URL, 'actual': webhook_info.url})
     
     # Start webhook server
-    print(f"🌐 Starting webhook server on port {PORT}...")
+    logger.info(f"Starting webhook server on port {PORT}...")
     
     # Create aiohttp web application
     web_app = web.Application()
@@ -3298,53 +4763,33 @@ async def main():
     
     # ENHANCED DEBUG WEBHOOK HANDLER
     async def handle_webhook(request):
-        """Handle incoming updates from Telegram with comprehensive error logging"""
-        print("=" * 60)
-        print(f"📨 WEBHOOK TRIGGERED at {datetime.now()}")
-        print(f"Method: {request.method}")
-        print(f"Path: {request.path}")
-        print(f"Headers: {dict(request.headers)}")
-
+        """Validate an incoming update and queue it for processing"""
         try:
-            # 1. Read the raw body first
             body = await request.read()
-            body_str = body.decode('utf-8')
-            print(f"Raw Body (first 500 chars): {body_str[:500]}")
-
-            # 2. Parse JSON
-            import json
-            data = json.loads(body_str)
-            print(f"Parsed JSON keys: {list(data.keys())}")
+            data = json.loads(body)
 
-            # 3. Confirm it's a Telegram update
             if 'update_id' in data:
-                print(f"✅ Valid Telegram Update ID: {data['update_id']}")
-
-                # 4. Create Update object and process
                 update = Update.de_json(data, app.bot)
-                print(f"✅ Update object created. Processing now...")
-                await app.process_update(update)
-                print(f"✅ Update processed successfully.")
-
+                if not enqueue_update(update):
+                    webhook_logger.warning("Update queue full, shedding update", extra={'update_id': data['update_id']})
+                    return web.Response(status=503, text="Update queue full")
+                log_sampled(webhook_logger, logging.INFO, "Update received",
+                            update_id=data['update_id'], kind=next((k for k in data if k != 'update_id'), None))
+                if webhook_logger.isEnabledFor(logging.DEBUG):
+                    webhook_logger.debug("Update body", extra={'update_id': data['update_id'], 'body': body[:500].decode('utf-8', 'replace')})
             else:
-                print(f"⚠️ Received data is not a Telegram update.")
+                webhook_logger.warning("Received data is not a Telegram update", extra={'keys': list(data.keys())})
 
-            print(f"✅ Sending 200 OK response to Telegram.")
-            print("=" * 60)
             return web.Response(status=200, text="OK")
 
         except json.JSONDecodeError as e:
             error_msg = f"❌ JSON Decode Error: {e}"
-            print(error_msg)
-            print("=" * 60)
+            webhook_logger.error(error_msg)
             return web.Response(status=500, text=error_msg)
 
         except Exception as e:
             error_msg = f"❌ UNEXPECTED ERROR in webhook: {type(e).__name__}: {e}"
-            print(error_msg)
-            import traceback
-            traceback.print_exc()
-            print("=" * 60)
+            webhook_logger.exception(error_msg)
             # Return the error message in the response for debugging
             return web.Response(status=500, text=error_msg)
     
@@ -3360,10 +4805,18 @@ async def main():
                 "bot_username": bot_info.username,
                 "bot_id": bot_info.id,
                 "webhook_url": WEBHOOK_URL,
+                "user_cache": user_cache_info(),
+                "update_queue": update_queue_info(),
+                "database_mode": db_connection_mode,
+                "chat_router": {**chat_router_stats, 'routes': len(chat_routes)},
+                "notify": notify_stats,
+                "persistence": bot_persistence.stats,
+                "outbox": outbox_stats,
                 "endpoints": {
                     "webhook": WEBHOOK_PATH,
                     "health": "/health",
                     "test": "/test",
+                    "metrics": "/metrics",
                     "root": "/"
                 }
             })
@@ -3374,6 +4827,10 @@ async def main():
                 "time": str(datetime.now())
             }, status=500)
     
+    # Prometheus scrape endpoint
+    async def handle_metrics(request):
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+    
     # Root endpoint
     async def handle_root(request):
         return web.Response(
@@ -3386,9 +4843,10 @@ async def main():
     web_app.router.add_get('/', handle_root)
     web_app.router.add_get('/health', handle_health)
     web_app.router.add_get('/test', handle_test)
+    web_app.router.add_get('/metrics', handle_metrics)
     
     # Verify all endpoints are registered (FIXED VERSION)
-    print("📋 Registered routes:")
+    routes = []
     for route in web_app.router.routes():
         # Get the path safely for different aiohttp versions
         try:
@@ -3401,73 +4859,75 @@ async def main():
                 path = route.path
             else:
                 path = str(route)
-            print(f"   {route.method} {path}")
+            routes.append(f"{route.method} {path}")
         except Exception as e:
-            print(f"   {route.method} - Error getting path: {e}")
+            routes.append(f"{route.method} - Error getting path: {e}")
+    logger.info("Registered routes", extra={'routes': routes})
     
-    # Start the web server
+    # Start the web server in place of the placeholder
     runner = web.AppRunner(web_app)
     await runner.setup()
+    await placeholder_runner.cleanup()
     site = web.TCPSite(runner, '0.0.0.0', PORT)
     await site.start()
     
-    print(f"✅ Webhook server running on port {PORT}")
+    logger.info(f"Webhook server running on port {PORT}")
     
     # Get bot info
     bot_info = await app.bot.get_me()
-    print(f"✅ Bot info:")
-    print(f"   Name: {bot_info.first_name}")
-    print(f"   Username: @{bot_info.username}")
-    print(f"   ID: {bot_info.id}")
-    
-    print("=" * 50)
-    print("🎉 AU DATING BOT IS RUNNING WITH WEBHOOK!")
-    print(f"📱 Webhook URL: {WEBHOOK_URL}")
-    print(f"💡 Health check: {RENDER_URL}/health")
-    print(f"🔧 Test endpoint: {RENDER_URL}/test")
-    print(f"📝 To test manually, send a POST request to {WEBHOOK_URL}")
-    print("=" * 50)
-    
-    # Keep the bot running
+    logger.info("AU DATING BOT IS RUNNING WITH WEBHOOK!", extra={
+        'bot_name': bot_info.first_name,
+        'bot_username': f"@{bot_info.username}",
+        'bot_id': bot_info.id,
+        'webhook_url': WEBHOOK_URL,
+        'health_check': f"{RENDER_URL}/health",
+        'test_endpoint': f"{RENDER_URL}/test",
+    })
+    
+    # Resume unfinished broadcasts and pick up jobs started on other replicas
+    broadcast_poller = asyncio.create_task(broadcast_job_poller(app.bot))
+    touch_flush_task = asyncio.create_task(touch_flusher())
+    index_refresher = asyncio.create_task(candidate_index_refresher()) if CANDIDATE_INDEX else None
+    stats_task = asyncio.create_task(stats_reconciler())
+    chat_router_task = asyncio.create_task(chat_router_refresher())
+    listener_task = asyncio.create_task(notify_listener())
+    persistence_task = asyncio.create_task(persistence_flusher(app))
+    outbox_task = asyncio.create_task(outbox_dispatcher(app.bot))
+    
+    # Keep the bot running until SIGTERM or SIGINT
+    stop = install_stop_signals()
     try:
-        # Keep the script alive
-        await asyncio.Event().wait()
-    except KeyboardInterrupt:
-        print("\n👋 Shutting down gracefully...")
+        await stop.wait()
+        logger.info("Shutting down gracefully...")
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logger.info("Shutting down gracefully...")
     except Exception as e:
-        print(f"❌ Unexpected error: {e}")
+        logger.error(f"Unexpected error: {e}")
     finally:
-        # Clean shutdown
-        print("🔄 Cleaning up...")
-        await app.bot.delete_webhook()
-        await app.stop()
-        await app.shutdown()
-        await runner.cleanup()
-        print("✅ Shutdown complete!")
+        # Clean shutdown; every step runs even if an earlier one fails
+        logger.info("Cleaning up...")
+        touch_flush_task.cancel()
+        await shutdown_step("flush activity timestamps", flush_touch_buffer)
+        broadcast_poller.cancel()
+        outbox_task.cancel()
+        stats_task.cancel()
+        chat_router_task.cancel()
+        listener_task.cancel()
+        if index_refresher:
+            index_refresher.cancel()
+        await shutdown_step("finish queued updates", stop_update_processing)
+        persistence_task.cancel()
+        await shutdown_step("flush persisted state", lambda: flush_persisted_state(app))
+        # Updates finished above may have touched users again
+        await shutdown_step("flush activity timestamps", flush_touch_buffer)
+        if app.running:
+            await shutdown_step("stop application", app.stop)
+        await shutdown_step("shut down application", app.shutdown)
+        await shutdown_step("stop web server", runner.cleanup)
+        logger.info("Shutdown complete!")
 # Start the bot
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except Exception as e:
-        print(f"❌ Fatal error starting bot: {e}")
-        import traceback
-        traceback.print_exc()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+        logger.exception(f"Fatal error starting bot: {e}")
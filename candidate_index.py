@@ -0,0 +1,135 @@
+"""In-process eligibility index for matchmaking.
+
+One row per profile in parallel NumPy arrays (telegram_id, gender code,
+campus code, flag bits) plus a sorted int64 array of liked ids per user.
+Picking candidates is a handful of vectorised mask operations and a random
+sample, so /find no longer asks Postgres to filter every profile per swipe.
+
+The index is a prefilter, not the source of truth: the bot still re-reads
+each candidate row before showing it, and rebuilds the index periodically to
+pick up writes made by other replicas.
+
+Memory per 100k users with 50 likes each (benchmarks/candidate_index.py):
+1.2 MB of profile arrays (12 bytes per user), 40 MB of liked ids (8 bytes
+per like), about 70 MB in total once array headers and the dicts are counted.
+"""
+import numpy as np
+
+BANNED = 1
+IN_CHAT = 2
+
+GENDERS = ('Male', 'Female')
+INITIAL_CAPACITY = 1024
+
+
+class CandidateIndex:
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.size = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.gender = np.full(capacity, -1, dtype=np.int8)
+        self.campus = np.full(capacity, -1, dtype=np.int16)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        # telegram_id -> row, campus name -> code
+        self.rows = {}
+        self.campuses = {}
+        # liker telegram_id -> sorted np.int64 array of liked ids
+        self.liked = {}
+        self.rng = np.random.default_rng()
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self):
+        capacity = len(self.ids) * 2
+        for name in ('ids', 'gender', 'campus', 'flags'):
+            old = getattr(self, name)
+            new = np.resize(old, capacity)
+            new[len(old):] = 0 if name in ('ids', 'flags') else -1
+            setattr(self, name, new)
+
+    def _campus_code(self, campus):
+        return self.campuses.setdefault(campus, len(self.campuses))
+
+    def upsert(self, telegram_id, gender, campus, banned=None, in_chat=None):
+        """Add a profile or refresh its gender and campus; flags left as None keep their value"""
+        row = self.rows.get(telegram_id)
+        if row is None:
+            if self.size == len(self.ids):
+                self._grow()
+            row = self.size
+            self.size += 1
+            self.rows[telegram_id] = row
+            self.ids[row] = telegram_id
+            self.flags[row] = 0
+        self.gender[row] = GENDERS.index(gender) if gender in GENDERS else -1
+        self.campus[row] = self._campus_code(campus)
+        if banned is not None:
+            self.set_flag(BANNED, banned, telegram_id)
+        if in_chat is not None:
+            self.set_flag(IN_CHAT, in_chat, telegram_id)
+
+    def set_gender(self, telegram_id, gender):
+        row = self.rows.get(telegram_id)
+        if row is not None:
+            self.gender[row] = GENDERS.index(gender) if gender in GENDERS else -1
+
+    def set_campus(self, telegram_id, campus):
+        row = self.rows.get(telegram_id)
+        if row is not None:
+            self.campus[row] = self._campus_code(campus)
+
+    def set_flag(self, flag, value, *telegram_ids):
+        for telegram_id in telegram_ids:
+            row = self.rows.get(telegram_id)
+            if row is None:
+                continue
+            if value:
+                self.flags[row] |= flag
+            else:
+                self.flags[row] &= ~np.uint8(flag)
+
+    def set_liked(self, telegram_id, liked_ids):
+        """Replace a user's liked ids, e.g. while building from the database"""
+        self.liked[telegram_id] = np.unique(np.asarray(liked_ids, dtype=np.int64))
+
+    def add_like(self, liker_id, liked_id):
+        liked = self.liked.get(liker_id)
+        if liked is None:
+            self.liked[liker_id] = np.array([liked_id], dtype=np.int64)
+            return
+        pos = np.searchsorted(liked, liked_id)
+        if pos == len(liked) or liked[pos] != liked_id:
+            self.liked[liker_id] = np.insert(liked, pos, liked_id)
+
+    def candidates(self, user_id, genders, limit, campus=None):
+        """Random sample of up to limit eligible telegram ids for user_id"""
+        n = self.size
+        codes = [GENDERS.index(g) for g in genders if g in GENDERS]
+        mask = np.isin(self.gender[:n], codes)
+        mask &= self.flags[:n] == 0
+        if campus is not None:
+            if campus not in self.campuses:
+                return []
+            mask &= self.campus[:n] == self.campuses[campus]
+
+        own = self.rows.get(user_id)
+        if own is not None:
+            mask[own] = False
+        liked = self.liked.get(user_id)
+        if liked is not None and len(liked):
+            rows = [self.rows[i] for i in liked.tolist() if i in self.rows]
+            mask[rows] = False
+
+        eligible = np.flatnonzero(mask)
+        if len(eligible) > limit:
+            eligible = self.rng.choice(eligible, size=limit, replace=False)
+        else:
+            self.rng.shuffle(eligible)
+        return self.ids[eligible].tolist()
+
+    def nbytes(self):
+        """Bytes held by the NumPy arrays: (profile arrays, liked arrays)"""
+        n = self.size
+        profile = self.ids[:n].nbytes + self.gender[:n].nbytes + self.campus[:n].nbytes + self.flags[:n].nbytes
+        liked = sum(a.nbytes for a in self.liked.values())
+        return profile, liked
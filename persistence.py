@@ -0,0 +1,254 @@
+"""Postgres-backed PTB persistence for user_data and conversation states.
+
+user_data lives in bot_user_data and ConversationHandler states in
+bot_conversations, so registrations and admin flows survive restarts and any
+replica can pick up a user's next update with their current user_data.
+
+Reads are lazy and per user: load() runs before the conversation handlers
+check an update and reads that user's user_data and conversation states in
+one query, then serves them from memory until the user has been idle for
+cache_ttl or another replica reports a write. Without a LISTEN connection no
+writes are reported, so a user's state is re-read once it is poll_ttl old. The states reach the handlers
+through SharedConversationHandler.set_state; get_conversations() still seeds
+every stored state when the application initializes. Writes are batched: PTB
+hands changes to update_user_data/update_conversation, unchanged user_data is
+dropped, and flush() writes the rest in one transaction of array upserts and
+notifies the other replicas which users it touched.
+"""
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+
+import queries
+
+logger = logging.getLogger("au_bot.persistence")
+
+# Notifications carry at most this many user ids (pg_notify payloads are capped at 8000 bytes)
+NOTIFY_BATCH = 400
+
+
+def dump(data):
+    """Canonical JSON, so unchanged user_data compares equal"""
+    return json.dumps(data, sort_keys=True)
+
+
+class SharedConversationHandler(ConversationHandler):
+    """ConversationHandler whose state for one key can be replaced by a newer stored one
+
+    PTB 20.7 only fills a handler's states from BasePersistence.get_conversations
+    at initialize and has no per-key refresh, so set_state writes the handler's
+    own dict without tracking: a state read from the database isn't a change to
+    persist back.
+    """
+
+    def set_state(self, key, state):
+        if state is None:
+            self._conversations.data.pop(key, None)
+        else:
+            self._conversations.update_no_track({key: state})
+
+
+class PostgresPersistence(BasePersistence):
+    def __init__(self, pool, channel, origin, cache_size=10000, cache_ttl=600, poll_ttl=5,
+                 listening=lambda: True, update_interval=2):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.pool = pool
+        self.channel = channel
+        self.origin = origin
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.poll_ttl = poll_ttl
+        # Whether other replicas' write notifications are arriving
+        self.listening = listening
+        # user_id -> (load time, idle expiry) of the state loaded into the application
+        self.cached = OrderedDict()
+        # user_id -> user_data JSON as last read from or written to the database
+        self.stored = {}
+        # Changes waiting for the next flush; None deletes the row
+        self.pending_users = {}
+        self.pending_conversations = {}
+        # Users with a key in pending_conversations, so load() doesn't scan it
+        self.pending_conversation_users = set()
+        # Users whose changes are being written by a flush right now
+        self.flushing = set()
+        # name -> SharedConversationHandler whose states load() refreshes
+        self.conversation_handlers = {}
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'flushes': 0, 'rows': 0, 'errors': 0}
+
+    def track_conversations(self, *handlers):
+        for handler in handlers:
+            self.conversation_handlers[handler.name] = handler
+
+    # ---- Reads ----
+    async def load(self, application, user_id, chat_id):
+        """Make sure the application holds this user's current state"""
+        now = time.monotonic()
+        loaded_at, expires = self.cached.get(user_id, (None, None))
+        if loaded_at is not None:
+            fresh = expires > now if self.listening() else now - loaded_at < self.poll_ttl
+        else:
+            fresh = False
+        # Never overwrite changes that haven't reached the database yet
+        if fresh or self.is_pending(user_id):
+            self.cached[user_id] = (loaded_at if loaded_at is not None else now, now + self.cache_ttl)
+            self.cached.move_to_end(user_id)
+            self.stats['hits'] += 1
+            return
+
+        self.stats['misses'] += 1
+        key = (chat_id, user_id)
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(queries.LOAD_PERSISTED_STATE, user_id, json.dumps(key))
+
+        data = json.loads(row['user_data']) if row['user_data'] else {}
+        user_data = application.user_data[user_id]
+        user_data.clear()
+        user_data.update(data)
+        self.stored[user_id] = dump(data)
+
+        states = json.loads(row['conversations']) if row['conversations'] else {}
+        for name, handler in self.conversation_handlers.items():
+            handler.set_state(key, states.get(name))
+
+        self.cached[user_id] = (now, now + self.cache_ttl)
+        self.cached.move_to_end(user_id)
+        while len(self.cached) > self.cache_size:
+            evicted, _ = self.cached.popitem(last=False)
+            self.stored.pop(evicted, None)
+
+    def is_pending(self, user_id):
+        return (user_id in self.pending_users or user_id in self.pending_conversation_users
+                or user_id in self.flushing)
+
+    def invalidate(self, user_ids):
+        """Reload these users on their next update, unless they have unflushed changes here"""
+        for user_id in user_ids:
+            if not self.is_pending(user_id) and self.cached.pop(user_id, None) is not None:
+                self.stats['invalidations'] += 1
+
+    def clear_cache(self):
+        """Forget every loaded user, e.g. after missing notifications while disconnected"""
+        self.cached.clear()
+
+    def on_notify(self, connection, pid, channel, payload):
+        try:
+            change = json.loads(payload)
+        except ValueError:
+            logger.warning(f"Ignoring malformed state notification: {payload[:100]}")
+            return
+        if change.get('origin') != self.origin:
+            self.invalidate(change.get('users', []))
+
+    # ---- Writes, called by Application.update_persistence ----
+    async def update_user_data(self, user_id, data):
+        try:
+            serialized = dump(data)
+        except TypeError as e:
+            logger.error(f"user_data for {user_id} is not JSON serializable: {e}")
+            return
+        if serialized != self.stored.get(user_id) or user_id in self.pending_users:
+            self.pending_users[user_id] = serialized
+
+    async def drop_user_data(self, user_id):
+        self.pending_users[user_id] = None
+
+    async def update_conversation(self, name, key, new_state):
+        self.pending_conversations[(name, tuple(key))] = new_state
+        self.pending_conversation_users.add(key[-1])
+
+    async def flush(self):
+        """Write every pending change in one transaction and tell the other replicas"""
+        users, self.pending_users = self.pending_users, {}
+        conversations, self.pending_conversations = self.pending_conversations, {}
+        self.pending_conversation_users = set()
+        if not users and not conversations:
+            return
+
+        upserts = {user_id: data for user_id, data in users.items() if data is not None}
+        states = {key: state for key, state in conversations.items() if state is not None}
+        ended = [key for key, state in conversations.items() if state is None]
+        touched = sorted(set(users) | {key[-1] for _, key in conversations})
+        self.flushing = set(touched)
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    if upserts:
+                        await conn.execute(queries.UPSERT_USER_DATA, list(upserts), list(upserts.values()))
+                    if len(upserts) < len(users):
+                        await conn.execute(queries.DELETE_USER_DATA, [u for u in users if u not in upserts])
+                    if states:
+                        await conn.execute(
+                            queries.UPSERT_CONVERSATIONS,
+                            [name for name, _ in states], [json.dumps(key) for _, key in states],
+                            [json.dumps(state) for state in states.values()],
+                        )
+                    if ended:
+                        await conn.execute(queries.DELETE_CONVERSATIONS,
+                                           [name for name, _ in ended], [json.dumps(key) for _, key in ended])
+                    for i in range(0, len(touched), NOTIFY_BATCH):
+                        payload = json.dumps({'origin': self.origin, 'users': touched[i:i + NOTIFY_BATCH]})
+                        await conn.execute(queries.NOTIFY, self.channel, payload)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Error flushing persisted state ({len(users)} users, {len(conversations)} states): {e}")
+            # Keep anything newer that arrived while this batch was being written
+            self.pending_users = {**users, **self.pending_users}
+            self.pending_conversations = {**conversations, **self.pending_conversations}
+            self.pending_conversation_users = {key[-1] for _, key in self.pending_conversations}
+            return
+        finally:
+            self.flushing = set()
+
+        for user_id, data in users.items():
+            if data is None:
+                self.stored.pop(user_id, None)
+            else:
+                self.stored[user_id] = data
+        self.stats['flushes'] += 1
+        self.stats['rows'] += len(users) + len(conversations)
+
+    async def get_conversations(self, name):
+        """Every stored state of one ConversationHandler, read once at initialize"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(queries.LOAD_CONVERSATIONS, name)
+        return {tuple(json.loads(row['key'])): json.loads(row['state']) for row in rows}
+
+    # ---- Loaded lazily by load(), or not stored ----
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
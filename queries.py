@@ -0,0 +1,828 @@
+"""SQL used by the bot's handlers and helpers, plus connection-mode detection.
+
+Every statement the handlers run lives here as a module constant so the text
+is byte-identical on every call. That is what lets asyncpg's statement cache
+(and pgbouncer's prepared-statement tracking) reuse one parse and plan
+instead of re-planning each query. Schema creation and migrations stay in
+bot.py; they run once at startup and gain nothing from caching.
+"""
+import asyncio
+from urllib.parse import urlparse
+
+import asyncpg
+
+# ---------------- Connection Mode ----------------
+# DIRECT: a real Postgres backend per connection, asyncpg's named statement
+#   cache works as designed.
+# POOLER_PREPARED: a transaction pooler that tracks protocol-level prepared
+#   statements (pgbouncer 1.21+ with max_prepared_statements > 0, which
+#   Supavisor/Supabase also support), so the cache can stay on.
+# POOLER: a transaction pooler that does not, so named statements would land
+#   on the wrong backend. asyncpg then sends every query as an unnamed
+#   statement, parsed and executed in the same round trip.
+DIRECT = "direct"
+POOLER = "pooler"
+POOLER_PREPARED = "pooler-prepared"
+MODES = (DIRECT, POOLER, POOLER_PREPARED)
+
+TRANSACTION_POOLER_PORT = 6543
+PROBE_QUERY = "SELECT pg_backend_pid()"
+PROBE_ROUNDS = 8
+
+
+async def detect_connection_mode(dsn, ssl=None, override="auto"):
+    """Work out whether dsn reaches Postgres directly or through a transaction pooler"""
+    if override in MODES:
+        return override
+
+    conn = await asyncpg.connect(dsn=dsn, ssl=ssl, statement_cache_size=0)
+    try:
+        # Outside a transaction each query may run on a different server
+        # connection when a transaction pooler sits in between
+        pids = {await conn.fetchval(PROBE_QUERY) for _ in range(PROBE_ROUNDS)}
+        behind_pooler = len(pids) > 1 or urlparse(dsn).port == TRANSACTION_POOLER_PORT
+
+        try:
+            statement = await conn.prepare(PROBE_QUERY)
+            for _ in range(PROBE_ROUNDS):
+                await statement.fetchval()
+                # Give the pooler a chance to hand us a different backend
+                await asyncio.sleep(0)
+        except asyncpg.PostgresError:
+            return POOLER
+    finally:
+        await conn.close()
+
+    return POOLER_PREPARED if behind_pooler else DIRECT
+
+
+def pool_options(mode, cache_size=100):
+    """asyncpg.create_pool keyword arguments for a connection mode"""
+    if mode == POOLER:
+        return {'statement_cache_size': 0}
+    return {'statement_cache_size': cache_size}
+
+
+# ---------------- Profiles ----------------
+UPSERT_PROFILE = """
+    INSERT INTO users
+    (telegram_id, username, name, gender, campus,
+     photo_file_id, bio, hobbies, preference)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+    ON CONFLICT (telegram_id) DO UPDATE SET
+    username = EXCLUDED.username,
+    name = EXCLUDED.name,
+    gender = EXCLUDED.gender,
+    campus = EXCLUDED.campus,
+    photo_file_id = EXCLUDED.photo_file_id,
+    bio = EXCLUDED.bio,
+    hobbies = EXCLUDED.hobbies,
+    preference = EXCLUDED.preference,
+    updated_at = NOW()
+    RETURNING (xmax = 0) AS inserted
+"""
+USER_BY_ID = "SELECT * FROM users WHERE telegram_id = $1"
+TOUCH_LAST_ACTIVE = """
+    UPDATE users u SET last_active = GREATEST(u.last_active, t.seen_at)
+    FROM unnest($1::bigint[], $2::timestamptz[]) AS t(telegram_id, seen_at)
+    WHERE u.telegram_id = t.telegram_id
+"""
+COUNT_USERS = "SELECT COUNT(*) FROM users"
+
+# ---------------- User Context ----------------
+USER_CONTEXT = """
+    SELECT u.*, ac.partner_id, (u.telegram_id IS NOT NULL) AS has_profile,
+           cc.has_joined AS channel_joined,
+           COALESCE(cc.last_checked > NOW() - make_interval(secs => $2), FALSE) AS channel_fresh
+    FROM (SELECT $1::bigint AS telegram_id) k
+    LEFT JOIN users u ON u.telegram_id = k.telegram_id
+    LEFT JOIN active_chats ac ON ac.user_id = k.telegram_id
+    LEFT JOIN channel_checks cc ON cc.user_id = k.telegram_id
+"""
+
+# ---------------- Channel Check ----------------
+UPSERT_CHANNEL_CHECK = """
+    INSERT INTO channel_checks (user_id, has_joined, last_checked, joined_at)
+    VALUES ($1, $2, NOW(), CASE WHEN $2 THEN NOW() END)
+    ON CONFLICT (user_id) DO UPDATE SET
+        has_joined = EXCLUDED.has_joined,
+        last_checked = NOW(),
+        joined_at = CASE
+            WHEN EXCLUDED.has_joined AND NOT channel_checks.has_joined THEN NOW()
+            ELSE channel_checks.joined_at
+        END
+    WHERE channel_checks.has_joined IS DISTINCT FROM EXCLUDED.has_joined
+    OR channel_checks.last_checked < NOW() - make_interval(secs => $3)
+"""
+
+# ---------------- Start ----------------
+CLEAR_BLOCKED_BOT = "UPDATE users SET blocked_bot = FALSE WHERE telegram_id = $1"
+
+# ---------------- Chat System ----------------
+
+# ---------------- Report System ----------------
+INSERT_REPORT = """
+    WITH r AS (
+        INSERT INTO reports (reporter_id, reported_id, reason) VALUES ($1, $2, $3)
+        RETURNING reporter_id, reported_id
+    )
+    INSERT INTO user_stats (telegram_id, reports_made, reports_pending_against)
+    SELECT telegram_id, SUM(made), SUM(against)
+    FROM (
+        SELECT reporter_id AS telegram_id, 1 AS made, 0 AS against FROM r
+        UNION ALL SELECT reported_id, 0, 1 FROM r
+    ) c
+    GROUP BY telegram_id
+    ON CONFLICT (telegram_id) DO UPDATE SET
+        reports_made = user_stats.reports_made + EXCLUDED.reports_made,
+        reports_pending_against = user_stats.reports_pending_against + EXCLUDED.reports_pending_against,
+        updated_at = NOW()
+"""
+
+# ---------------- Candidate Queue ----------------
+CANDIDATE_ELIGIBLE = """
+    u.gender = ANY($2::text[])
+    AND u.is_banned = FALSE
+    AND u.telegram_id != $1
+    AND NOT EXISTS (
+        SELECT 1 FROM swipes s WHERE s.liker_id = $1 AND s.liked_id = u.telegram_id
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM active_chats ac
+        WHERE ac.user_id = u.telegram_id OR ac.partner_id = u.telegram_id
+    )
+""".strip()
+# A random-offset sample instead of ORDER BY RANDOM() over every eligible
+# user: walk the serial id primary key (dense, unlike telegram_id) from a
+# random point between the lowest and highest id, wrapping around to the
+# start, until $4 eligible rows, then pick $3 of that window at random.
+CANDIDATE_BATCH = f"""
+    WITH pivot AS (
+        SELECT MIN(id) + floor(random() * (MAX(id) - MIN(id) + 1))::int AS id
+        FROM users
+    ),
+    sample_window AS (
+        SELECT telegram_id FROM (
+            (SELECT u.telegram_id FROM users u, pivot
+             WHERE u.id >= pivot.id AND {CANDIDATE_ELIGIBLE}
+             ORDER BY u.id LIMIT $4)
+            UNION ALL
+            (SELECT u.telegram_id FROM users u, pivot
+             WHERE u.id < pivot.id AND {CANDIDATE_ELIGIBLE}
+             ORDER BY u.id LIMIT $4)
+        ) AS walked
+        LIMIT $4
+    )
+    SELECT telegram_id FROM sample_window
+    ORDER BY random()
+    LIMIT $3
+"""
+# The first still-eligible profile among the ids in $1, in queue order
+NEXT_CANDIDATE_PROFILE = """
+    SELECT u.telegram_id, u.name, u.gender, u.campus, u.bio, u.photo_file_id
+    FROM users u
+    WHERE u.telegram_id = ANY($1::bigint[])
+    AND u.gender = ANY($2::text[])
+    AND u.is_banned = FALSE
+    AND NOT EXISTS (
+        SELECT 1 FROM active_chats ac
+        WHERE ac.user_id = u.telegram_id OR ac.partner_id = u.telegram_id
+    )
+    ORDER BY array_position($1::bigint[], u.telegram_id)
+    LIMIT 1
+"""
+# Streamed once per candidate index build
+CANDIDATE_INDEX_ROWS = """
+    SELECT u.telegram_id, u.gender, u.campus, u.is_banned,
+           EXISTS (
+               SELECT 1 FROM active_chats ac
+               WHERE ac.user_id = u.telegram_id OR ac.partner_id = u.telegram_id
+           ) AS in_chat,
+           ARRAY(SELECT s.liked_id FROM swipes s WHERE s.liker_id = u.telegram_id) AS liked
+    FROM users u
+"""
+
+# ---------------- Profile Management ----------------
+UPDATE_PREFERENCE = "UPDATE users SET preference = $1 WHERE telegram_id = $2"
+# Serializes RECORD_LIKE for one pair of users. Run it first in the same
+# transaction: the statement's snapshot then includes a reverse swipe that a
+# concurrent like committed while this one waited, so two users liking each
+# other at the same moment can't both miss the match
+LOCK_LIKE_PAIR = """
+    SELECT pg_advisory_xact_lock(hashtextextended(LEAST($1::bigint, $2::bigint) || ':' || GREATEST($1::bigint, $2::bigint), 0))
+"""
+# Records the swipe, the canonical matches row when the reverse swipe exists,
+# and both users' user_stats counters in the same statement
+RECORD_LIKE = """
+    WITH ins AS (
+        INSERT INTO swipes (liker_id, liked_id) VALUES ($1, $2) ON CONFLICT DO NOTHING
+        RETURNING liker_id, liked_id
+    ),
+    mutual AS (
+        SELECT EXISTS (SELECT 1 FROM swipes WHERE liker_id = $2 AND liked_id = $1) AS is_match
+    ),
+    matched AS (
+        INSERT INTO matches (min_id, max_id)
+        SELECT LEAST($1::bigint, $2::bigint), GREATEST($1::bigint, $2::bigint)
+        FROM mutual WHERE is_match AND $1::bigint <> $2::bigint
+        ON CONFLICT DO NOTHING
+        RETURNING min_id, max_id
+    ),
+    counted AS (
+        INSERT INTO user_stats (telegram_id, likes_given, likes_received, matches)
+        SELECT telegram_id, SUM(likes_given), SUM(likes_received), SUM(matches)
+        FROM (
+            SELECT liker_id AS telegram_id, 1 AS likes_given, 0 AS likes_received, 0 AS matches FROM ins
+            UNION ALL SELECT liked_id, 0, 1, 0 FROM ins
+            UNION ALL SELECT min_id, 0, 0, 1 FROM matched
+            UNION ALL SELECT max_id, 0, 0, 1 FROM matched
+        ) c
+        GROUP BY telegram_id
+        ON CONFLICT (telegram_id) DO UPDATE SET
+            likes_given = user_stats.likes_given + EXCLUDED.likes_given,
+            likes_received = user_stats.likes_received + EXCLUDED.likes_received,
+            matches = user_stats.matches + EXCLUDED.matches,
+            updated_at = NOW()
+    )
+    SELECT
+        (SELECT is_match FROM mutual) AS is_match,
+        EXISTS (SELECT 1 FROM matched) AS new_match,
+        (SELECT name FROM users WHERE telegram_id = $2) AS liked_name,
+        (SELECT partner_id FROM active_chats WHERE user_id = $2) AS liked_partner_id
+"""
+
+# ---------------- Edit Profile System ----------------
+UPDATE_GENDER = "UPDATE users SET gender = $1 WHERE telegram_id = $2"
+UPDATE_CAMPUS = "UPDATE users SET campus = $1 WHERE telegram_id = $2"
+CLEAR_PHOTO = "UPDATE users SET photo_file_id = NULL WHERE telegram_id = $1"
+CLEAR_BIO = "UPDATE users SET bio = NULL WHERE telegram_id = $1"
+CLEAR_HOBBIES = "UPDATE users SET hobbies = NULL WHERE telegram_id = $1"
+UPDATE_PHOTO = "UPDATE users SET photo_file_id = $1 WHERE telegram_id = $2"
+# One fixed statement per editable text field so each stays cacheable
+UPDATE_PROFILE_TEXT = {
+    field: f"UPDATE users SET {field} = $1 WHERE telegram_id = $2"
+    for field in ('name', 'bio', 'hobbies')
+}
+PROFILE_SUMMARY = "SELECT name, gender, campus, bio, hobbies, photo_file_id FROM users WHERE telegram_id = $1"
+
+# ---------------- Enhanced Admin Functions ----------------
+# Keyset pages: $1, $2 is the (created_at, id) cursor, $3 the page size. _NEXT
+# walks to older rows, _PREV to newer ones (ascending, reversed by the caller)
+USERS_PAGE_NEXT = """
+    SELECT telegram_id, username, name, gender, campus, is_banned, created_at
+    FROM users
+    WHERE (created_at, telegram_id) < ($1, $2)
+    ORDER BY created_at DESC, telegram_id DESC
+    LIMIT $3
+"""
+USERS_PAGE_PREV = """
+    SELECT telegram_id, username, name, gender, campus, is_banned, created_at
+    FROM users
+    WHERE (created_at, telegram_id) > ($1, $2)
+    ORDER BY created_at, telegram_id
+    LIMIT $3
+"""
+# Counter from bot_stats, else the planner's row estimate for table $2
+APPROX_COUNT = """
+    SELECT COALESCE(
+        (SELECT value FROM bot_stats WHERE name = $1),
+        (SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE oid = $2::regclass)
+    )
+"""
+USER_DETAILS = """
+    SELECT u.*, ac.partner_id,
+           COALESCE(us.likes_given, 0) AS likes_given,
+           COALESCE(us.likes_received, 0) AS likes_received,
+           COALESCE(us.matches, 0) AS matches,
+           COALESCE(us.reports_made, 0) AS reports_made,
+           COALESCE(us.reports_pending_against, 0) AS reports_pending_against
+    FROM users u
+    LEFT JOIN user_stats us ON us.telegram_id = u.telegram_id
+    LEFT JOIN active_chats ac ON ac.user_id = u.telegram_id
+    WHERE u.telegram_id = $1
+"""
+BAN_USER = "UPDATE users SET is_banned = TRUE WHERE telegram_id = $1 AND is_banned IS NOT TRUE"
+USER_NAME = "SELECT name FROM users WHERE telegram_id = $1"
+UNBAN_USER = "UPDATE users SET is_banned = FALSE WHERE telegram_id = $1 AND is_banned"
+BANNED_PAGE_NEXT = """
+    SELECT telegram_id, name, username, created_at
+    FROM users
+    WHERE is_banned AND (created_at, telegram_id) < ($1, $2)
+    ORDER BY created_at DESC, telegram_id DESC
+    LIMIT $3
+"""
+BANNED_PAGE_PREV = """
+    SELECT telegram_id, name, username, created_at
+    FROM users
+    WHERE is_banned AND (created_at, telegram_id) > ($1, $2)
+    ORDER BY created_at, telegram_id
+    LIMIT $3
+"""
+# Admin search: $4 is the lowercased term with LIKE wildcards escaped, $5 the
+# raw term. Substring matches on either column and fuzzy name matches are
+# found through the pg_trgm GIN indexes; username prefix matches rank first,
+# then trigram similarity. rank is an integer so it round-trips through
+# callback_data cursors exactly.
+SEARCH_HITS = """
+    SELECT telegram_id, username, name, is_banned, created_at,
+           (CASE WHEN lower(username) LIKE $4 || '%' THEN 1000000 ELSE 0 END
+            + (GREATEST(similarity(name, $5), similarity(COALESCE(username, ''), $5)) * 999999)::int) AS rank
+    FROM users
+    WHERE username ILIKE '%' || $4 || '%'
+    OR name ILIKE '%' || $4 || '%'
+    OR name % $5
+"""
+SEARCH_PAGE_NEXT = f"""
+    WITH hits AS ({SEARCH_HITS})
+    SELECT * FROM hits
+    WHERE (rank, telegram_id) < ($1, $2)
+    ORDER BY rank DESC, telegram_id DESC
+    LIMIT $3
+"""
+SEARCH_PAGE_PREV = f"""
+    WITH hits AS ({SEARCH_HITS})
+    SELECT * FROM hits
+    WHERE (rank, telegram_id) > ($1, $2)
+    ORDER BY rank, telegram_id
+    LIMIT $3
+"""
+
+# ---------------- Persistence ----------------
+# Conversation keys are stored as JSON text, e.g. '[chat_id, user_id]'
+LOAD_PERSISTED_STATE = """
+    SELECT (SELECT data::text FROM bot_user_data WHERE user_id = $1) AS user_data,
+           (SELECT jsonb_object_agg(name, state)::text FROM bot_conversations WHERE key = $2) AS conversations
+"""
+LOAD_CONVERSATIONS = "SELECT key, state::text FROM bot_conversations WHERE name = $1"
+UPSERT_USER_DATA = """
+    INSERT INTO bot_user_data (user_id, data, updated_at)
+    SELECT user_id, data::jsonb, NOW() FROM unnest($1::bigint[], $2::text[]) AS t(user_id, data)
+    ON CONFLICT (user_id) DO UPDATE SET data = EXCLUDED.data, updated_at = NOW()
+"""
+DELETE_USER_DATA = "DELETE FROM bot_user_data WHERE user_id = ANY($1::bigint[])"
+UPSERT_CONVERSATIONS = """
+    INSERT INTO bot_conversations (name, key, state, updated_at)
+    SELECT name, key, state::jsonb, NOW() FROM unnest($1::text[], $2::text[], $3::text[]) AS t(name, key, state)
+    ON CONFLICT (name, key) DO UPDATE SET state = EXCLUDED.state, updated_at = NOW()
+"""
+DELETE_CONVERSATIONS = """
+    DELETE FROM bot_conversations c
+    USING unnest($1::text[], $2::text[]) AS d(name, key)
+    WHERE c.name = d.name AND c.key = d.key
+"""
+
+# ---------------- Broadcast Engine ----------------
+CREATE_BROADCAST_JOB = """
+    INSERT INTO broadcast_jobs (payload, progress_chat_id, progress_message_id)
+    VALUES ($1::jsonb, $2, $3)
+    RETURNING id
+"""
+SNAPSHOT_BROADCAST_RECIPIENTS = """
+    INSERT INTO broadcast_deliveries (job_id, telegram_id)
+    SELECT $1, telegram_id FROM users
+    WHERE is_banned = FALSE AND blocked_bot = FALSE
+"""
+SET_BROADCAST_TOTAL = "UPDATE broadcast_jobs SET total = $2 WHERE id = $1"
+CLAIM_BROADCAST_DELIVERIES = """
+    UPDATE broadcast_deliveries d
+    SET status = 'claimed', claimed_by = $2, claimed_at = NOW(), attempts = d.attempts + 1
+    FROM (
+        SELECT telegram_id FROM broadcast_deliveries
+        WHERE job_id = $1
+        AND (status = 'pending'
+             OR (status = 'claimed' AND claimed_at < NOW() - make_interval(secs => $3)))
+        ORDER BY telegram_id
+        LIMIT $4
+        FOR UPDATE SKIP LOCKED
+    ) batch
+    WHERE d.job_id = $1 AND d.telegram_id = batch.telegram_id
+    RETURNING d.telegram_id
+"""
+# Reserves the next $2 seconds of the job's send time, shared by every replica,
+# and returns how many seconds from now that window opens
+RESERVE_BROADCAST_WINDOW = """
+    UPDATE broadcast_jobs
+    SET paced_until = GREATEST(paced_until, NOW()) + make_interval(secs => $2)
+    WHERE id = $1
+    RETURNING EXTRACT(EPOCH FROM paced_until - NOW())::float8 - $2
+"""
+RECORD_BROADCAST_RESULTS = """
+    UPDATE broadcast_deliveries d
+    SET status = r.status, updated_at = NOW()
+    FROM unnest($2::bigint[], $3::text[]) AS r(telegram_id, status)
+    WHERE d.job_id = $1 AND d.telegram_id = r.telegram_id
+"""
+MARK_BLOCKED_BOT = "UPDATE users SET blocked_bot = TRUE WHERE telegram_id = ANY($1::bigint[])"
+BROADCAST_STATUS_COUNTS = """
+    SELECT status, COUNT(*) AS n FROM broadcast_deliveries
+    WHERE job_id = $1
+    GROUP BY status
+"""
+FINISH_BROADCAST_JOB = """
+    UPDATE broadcast_jobs SET status = 'completed', finished_at = NOW()
+    WHERE id = $1 AND status = 'running'
+    AND NOT EXISTS (
+        SELECT 1 FROM broadcast_deliveries
+        WHERE job_id = $1 AND status IN ('pending', 'claimed')
+    )
+    RETURNING *
+"""
+BROADCAST_FAILED_SAMPLE = """
+    SELECT telegram_id FROM broadcast_deliveries
+    WHERE job_id = $1 AND status = 'failed'
+    ORDER BY telegram_id
+    LIMIT 10
+"""
+BROADCAST_JOB = "SELECT * FROM broadcast_jobs WHERE id = $1"
+RUNNING_BROADCAST_JOBS = "SELECT id FROM broadcast_jobs WHERE status = 'running' ORDER BY id"
+PURGE_BROADCAST_JOBS = """
+    DELETE FROM broadcast_jobs
+    WHERE status = 'completed' AND finished_at < NOW() - make_interval(days => $1)
+"""
+
+# ---------------- Outbox ----------------
+# Inserts fire the outbox_queued trigger, which wakes the dispatchers on commit
+ENQUEUE_OUTBOX = """
+    INSERT INTO outbox (chat_id, payload)
+    SELECT chat_id, payload::jsonb FROM unnest($1::bigint[], $2::text[]) AS t(chat_id, payload)
+"""
+# Oldest due messages first, so one chat's notifications go out in order
+CLAIM_OUTBOX = """
+    UPDATE outbox o
+    SET claimed_by = $1, claimed_at = NOW(), attempts = o.attempts + 1
+    FROM (
+        SELECT id FROM outbox
+        WHERE status = 'pending' AND available_at <= NOW()
+        AND (claimed_at IS NULL OR claimed_at < NOW() - make_interval(secs => $2))
+        ORDER BY id
+        LIMIT $3
+        FOR UPDATE SKIP LOCKED
+    ) batch
+    WHERE o.id = batch.id
+    RETURNING o.id, o.chat_id, o.payload::text AS payload
+"""
+# A failed send goes back to pending with exponential backoff until it has
+# been attempted $3 times
+RECORD_OUTBOX_RESULTS = """
+    UPDATE outbox o
+    SET status = CASE WHEN r.status = 'failed' AND o.attempts < $3 THEN 'pending' ELSE r.status END,
+        available_at = CASE WHEN r.status = 'failed' THEN NOW() + make_interval(secs => power(2, o.attempts)) ELSE o.available_at END,
+        claimed_by = NULL,
+        claimed_at = NULL,
+        sent_at = CASE WHEN r.status = 'sent' THEN NOW() END
+    FROM unnest($1::bigint[], $2::text[]) AS r(id, status)
+    WHERE o.id = r.id
+"""
+PURGE_OUTBOX = """
+    DELETE FROM outbox
+    WHERE status <> 'pending' AND created_at < NOW() - make_interval(days => $1)
+"""
+
+# ---------------- Stats Counters ----------------
+# Totals live in bot_stats; ROLLUP_STATS are also added to hourly and daily rows
+BUMP_STATS = """
+    WITH d AS (
+        SELECT * FROM unnest($1::text[], $2::bigint[]) AS d(name, delta)
+    ),
+    totals AS (
+        INSERT INTO bot_stats (name, value)
+        SELECT name, delta FROM d
+        ON CONFLICT (name) DO UPDATE SET
+            value = bot_stats.value + EXCLUDED.value,
+            updated_at = NOW()
+    )
+    INSERT INTO bot_stats_rollups (bucket, period_start, name, value)
+    SELECT b.bucket, date_trunc(b.bucket, NOW()::timestamp), d.name, d.delta
+    FROM d CROSS JOIN (VALUES ('hour'), ('day')) AS b(bucket)
+    WHERE d.name = ANY($3::text[])
+    ON CONFLICT (bucket, period_start, name) DO UPDATE SET
+        value = bot_stats_rollups.value + EXCLUDED.value
+"""
+STATS_SNAPSHOT = """
+    SELECT s.name, s.value,
+           COALESCE((
+               SELECT SUM(r.value) FROM bot_stats_rollups r
+               WHERE r.bucket = 'hour' AND r.name = s.name
+               AND r.period_start >= date_trunc('hour', NOW()::timestamp) - INTERVAL '23 hours'
+           ), 0) AS last_24h,
+           COALESCE((
+               SELECT SUM(r.value) FROM bot_stats_rollups r
+               WHERE r.bucket = 'day' AND r.name = s.name
+               AND r.period_start >= date_trunc('day', NOW()::timestamp) - INTERVAL '6 days'
+           ), 0) AS last_7d
+    FROM bot_stats s
+"""
+# Recounts every total from the source tables and returns the ones that drifted
+RECONCILE_STAT_TOTALS = """
+    WITH actual (name, value) AS (
+        VALUES
+            ('users', (SELECT COUNT(*) FROM users)),
+            ('banned_users', (SELECT COUNT(*) FROM users WHERE is_banned)),
+            ('matches', (SELECT COUNT(*) FROM matches)),
+            ('reports', (SELECT COUNT(*) FROM reports)),
+            ('pending_reports', (SELECT COUNT(*) FROM reports WHERE status = 'pending')),
+            ('active_chats', (SELECT COUNT(*) FROM active_chats))
+    ),
+    previous AS (
+        SELECT name, value FROM bot_stats
+    )
+    INSERT INTO bot_stats (name, value)
+    SELECT name, value FROM actual
+    ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value, updated_at = NOW()
+    WHERE bot_stats.value <> EXCLUDED.value
+    RETURNING name, value, (SELECT p.value FROM previous p WHERE p.name = bot_stats.name) AS previous
+"""
+# Rebuilds the rollups that can be derived from row timestamps over the last $1 days
+RECONCILE_STAT_ROLLUPS = """
+    INSERT INTO bot_stats_rollups (bucket, period_start, name, value)
+    SELECT b.bucket, date_trunc(b.bucket, e.at), e.name, COUNT(*)
+    FROM (
+        SELECT 'users' AS name, created_at AS at FROM users
+        WHERE created_at >= date_trunc('day', NOW()::timestamp) - make_interval(days => $1)
+        UNION ALL
+        SELECT 'matches', matched_at FROM matches
+        WHERE matched_at >= date_trunc('day', NOW()::timestamp) - make_interval(days => $1)
+        UNION ALL
+        SELECT 'reports', created_at FROM reports
+        WHERE created_at >= date_trunc('day', NOW()::timestamp) - make_interval(days => $1)
+    ) e CROSS JOIN (VALUES ('hour'), ('day')) AS b(bucket)
+    GROUP BY 1, 2, 3
+    ON CONFLICT (bucket, period_start, name) DO UPDATE SET value = EXCLUDED.value
+    WHERE bot_stats_rollups.value <> EXCLUDED.value
+"""
+PURGE_HOURLY_STATS = """
+    DELETE FROM bot_stats_rollups
+    WHERE bucket = 'hour' AND period_start < NOW() - make_interval(days => $1)
+"""
+
+# ---------------- Updated Admin Panel ----------------
+PENDING_REPORTS_NEXT = """
+    SELECT r.id, r.reporter_id, r.reported_id, r.reason, r.created_at,
+           u1.name as reporter_name, u2.name as reported_name
+    FROM reports r
+    LEFT JOIN users u1 ON r.reporter_id = u1.telegram_id
+    LEFT JOIN users u2 ON r.reported_id = u2.telegram_id
+    WHERE r.status = 'pending' AND (r.created_at, r.id) < ($1, $2)
+    ORDER BY r.created_at DESC, r.id DESC
+    LIMIT $3
+"""
+PENDING_REPORTS_PREV = """
+    SELECT r.id, r.reporter_id, r.reported_id, r.reason, r.created_at,
+           u1.name as reporter_name, u2.name as reported_name
+    FROM reports r
+    LEFT JOIN users u1 ON r.reporter_id = u1.telegram_id
+    LEFT JOIN users u2 ON r.reported_id = u2.telegram_id
+    WHERE r.status = 'pending' AND (r.created_at, r.id) > ($1, $2)
+    ORDER BY r.created_at, r.id
+    LIMIT $3
+"""
+REPORT_BY_ID = """
+    SELECT reporter_id, reported_id, reason, status FROM reports WHERE id = $1
+"""
+# Also takes the report off the reported user's pending count when it leaves 'pending'
+SET_REPORT_STATUS = """
+    WITH old AS (
+        SELECT reported_id, status FROM reports WHERE id = $2 FOR UPDATE
+    ),
+    upd AS (
+        UPDATE reports SET status = $1 WHERE id = $2
+    )
+    UPDATE user_stats us SET
+        reports_pending_against = us.reports_pending_against - 1,
+        updated_at = NOW()
+    FROM old
+    WHERE us.telegram_id = old.reported_id AND old.status = 'pending' AND $1 <> 'pending'
+"""
+
+# ---------------- Chat Requests ----------------
+# Adds stat_deltas(name, delta) to bot_stats and to this hour's and day's
+# rollups of the names in the {rollups} parameter, like BUMP_STATS
+STAT_DELTA_UPSERTS = """
+    stat_totals AS (
+        INSERT INTO bot_stats (name, value)
+        SELECT name, delta FROM stat_deltas WHERE delta <> 0
+        ON CONFLICT (name) DO UPDATE SET
+            value = bot_stats.value + EXCLUDED.value,
+            updated_at = NOW()
+    ),
+    stat_rollups AS (
+        INSERT INTO bot_stats_rollups (bucket, period_start, name, value)
+        SELECT b.bucket, date_trunc(b.bucket, NOW()::timestamp), d.name, d.delta
+        FROM stat_deltas d CROSS JOIN (VALUES ('hour'), ('day')) AS b(bucket)
+        WHERE d.delta <> 0 AND d.name = ANY({rollups}::text[])
+        ON CONFLICT (bucket, period_start, name) DO UPDATE SET
+            value = bot_stats_rollups.value + EXCLUDED.value
+    )
+""".strip()
+# Bumps chat_route_versions for every user in route_users(user_id, partner_id)
+# and builds the [user_id, partner_id or null, version] changes the bot applies
+# to its routes. The version row stays locked until commit, so a later change
+# to the same user always gets a higher version.
+ROUTE_VERSION_CTES = """
+    versions AS (
+        INSERT INTO chat_route_versions (user_id)
+        SELECT DISTINCT user_id FROM route_users
+        ON CONFLICT (user_id) DO UPDATE SET version = chat_route_versions.version + 1
+        RETURNING user_id, version
+    ),
+    route_changes AS (
+        SELECT COALESCE(json_agg(json_build_array(v.user_id, r.partner_id, v.version)), '[]'::json) AS routes
+        FROM versions v
+        JOIN (SELECT DISTINCT ON (user_id) user_id, partner_id FROM route_users
+              ORDER BY user_id, partner_id NULLS LAST) AS r USING (user_id)
+    ),
+    notified AS (
+        SELECT pg_notify({channel}, routes::text)
+        FROM route_changes
+        WHERE json_array_length(routes) > 0
+    )
+""".strip()
+# Pairs the users in the pair(user_id, partner_id) CTE, if it has a row: ends
+# both users' current chats, inserts both directions, bumps the chat stats and
+# notifies the {channel} parameter with the versioned routes that changed. The
+# inserts read COUNT(*) of ended so the DELETE finishes before they check UNIQUE.
+PAIR_CTES = """
+    ended AS (
+        DELETE FROM active_chats
+        WHERE user_id IN (SELECT user_id FROM pair UNION ALL SELECT partner_id FROM pair)
+        OR partner_id IN (SELECT user_id FROM pair UNION ALL SELECT partner_id FROM pair)
+        RETURNING user_id
+    ),
+    paired AS (
+        INSERT INTO active_chats (user_id, partner_id)
+        SELECT v.user_id, v.partner_id
+        FROM pair
+        CROSS JOIN LATERAL (VALUES (pair.user_id, pair.partner_id), (pair.partner_id, pair.user_id)) AS v(user_id, partner_id)
+        CROSS JOIN (SELECT COUNT(*) FROM ended) AS e
+        RETURNING user_id
+    ),
+    stat_deltas AS (
+        SELECT * FROM (VALUES
+            ('active_chats', (SELECT COUNT(*) FROM paired) - (SELECT COUNT(*) FROM ended)),
+            ('chats_started', (SELECT COUNT(*) FROM paired) / 2)
+        ) AS d(name, delta)
+    ),
+    {stat_upserts},
+    route_users AS (
+        SELECT user_id, NULL::bigint AS partner_id FROM ended
+        UNION ALL
+        SELECT user_id, partner_id FROM pair
+        UNION ALL
+        SELECT partner_id, user_id FROM pair
+    ),
+    {route_versions}
+""".strip()
+# Tapping "chat" on a match: 'busy' if the user is already chatting,
+# 'requested' (a chat request is left) if the partner is chatting and hasn't
+# asked for this user, otherwise 'paired', accepting the partner's request if any
+START_CHAT = f"""
+    WITH state AS (
+        SELECT EXISTS (SELECT 1 FROM active_chats WHERE user_id = $1) AS busy,
+               EXISTS (SELECT 1 FROM active_chats WHERE user_id = $2) AS partner_busy,
+               (SELECT MIN(id) FROM chat_requests
+                WHERE requester_id = $2 AND requested_id = $1 AND status = 'pending') AS request_id
+    ),
+    outcome AS (
+        SELECT CASE WHEN busy THEN 'busy'
+                    WHEN request_id IS NULL AND partner_busy THEN 'requested'
+                    ELSE 'paired' END AS outcome,
+               request_id
+        FROM state
+    ),
+    accepted AS (
+        DELETE FROM chat_requests
+        WHERE id = (SELECT request_id FROM outcome WHERE outcome = 'paired')
+    ),
+    requested AS (
+        INSERT INTO chat_requests (requester_id, requested_id)
+        SELECT $1, $2 FROM outcome WHERE outcome = 'requested'
+        ON CONFLICT DO NOTHING
+    ),
+    pair AS (
+        SELECT $1::bigint AS user_id, $2::bigint AS partner_id FROM outcome WHERE outcome = 'paired'
+    ),
+    {PAIR_CTES.format(stat_upserts=STAT_DELTA_UPSERTS.format(rollups='$3'), route_versions=ROUTE_VERSION_CTES.format(channel='$4'))}
+    SELECT o.outcome,
+           (SELECT name FROM users WHERE telegram_id = $1) AS user_name,
+           (SELECT name FROM users WHERE telegram_id = $2) AS partner_name,
+           ARRAY(SELECT user_id FROM ended) AS ended,
+           (SELECT routes FROM route_changes) AS routes,
+           (SELECT COUNT(*) FROM notified) AS notified
+    FROM outcome o
+"""
+# Accepting a chat request; no row if it was already accepted or declined
+ACCEPT_CHAT_REQUEST = f"""
+    WITH request AS (
+        DELETE FROM chat_requests WHERE id = $1
+        RETURNING requester_id, requested_id
+    ),
+    pair AS (
+        SELECT requester_id AS user_id, requested_id AS partner_id FROM request
+    ),
+    {PAIR_CTES.format(stat_upserts=STAT_DELTA_UPSERTS.format(rollups='$2'), route_versions=ROUTE_VERSION_CTES.format(channel='$3'))}
+    SELECT p.user_id AS requester_id, p.partner_id AS requested_id,
+           (SELECT name FROM users WHERE telegram_id = p.user_id) AS requester_name,
+           (SELECT name FROM users WHERE telegram_id = p.partner_id) AS requested_name,
+           ARRAY(SELECT user_id FROM ended) AS ended,
+           (SELECT routes FROM route_changes) AS routes,
+           (SELECT COUNT(*) FROM notified) AS notified
+    FROM pair p
+"""
+# Ends the chats of every user in $1; with a $2 notice payload, the user who
+# ended it leaves their partner a pending request to reconnect and the notice
+# is queued in the outbox for the partner
+END_CHATS = f"""
+    WITH ended AS (
+        DELETE FROM active_chats
+        WHERE user_id = ANY($1::bigint[]) OR partner_id = ANY($1::bigint[])
+        RETURNING user_id, partner_id
+    ),
+    reconnect AS (
+        INSERT INTO chat_requests (requester_id, requested_id, status)
+        SELECT partner_id, user_id, 'pending' FROM ended
+        WHERE $2::jsonb IS NOT NULL AND user_id = ANY($1::bigint[])
+        ON CONFLICT DO NOTHING
+    ),
+    notices AS (
+        INSERT INTO outbox (chat_id, payload)
+        SELECT partner_id, $2::jsonb FROM ended
+        WHERE $2::jsonb IS NOT NULL AND user_id = ANY($1::bigint[])
+    ),
+    stat_deltas AS (
+        SELECT 'active_chats' AS name, -COUNT(*) AS delta FROM ended
+    ),
+    {STAT_DELTA_UPSERTS.format(rollups='$3')},
+    route_users AS (
+        SELECT user_id, NULL::bigint AS partner_id FROM ended
+    ),
+    {ROUTE_VERSION_CTES.format(channel='$4')}
+    SELECT ARRAY(SELECT user_id FROM ended) AS ended,
+           (SELECT routes FROM route_changes) AS routes,
+           (SELECT COUNT(*) FROM notified) AS notified
+"""
+# Every active route plus the last version of each user's route, active or not
+CHAT_ROUTES = """
+    SELECT COALESCE(c.user_id, v.user_id) AS user_id, c.partner_id, COALESCE(v.version, 0) AS version
+    FROM active_chats c
+    FULL JOIN chat_route_versions v ON v.user_id = c.user_id
+"""
+NOTIFY = "SELECT pg_notify($1, $2)"
+DELETE_CHAT_REQUEST = "DELETE FROM chat_requests WHERE id = $1"
+PENDING_REQUESTS_FOR = """
+    SELECT cr.id, cr.requester_id, u.name, u.campus
+    FROM chat_requests cr
+    JOIN users u ON cr.requester_id = u.telegram_id
+    WHERE cr.requested_id = $1 AND cr.status = 'pending'
+    ORDER BY cr.created_at DESC
+"""
+CLEAR_CHAT_REQUESTS = "DELETE FROM chat_requests WHERE requested_id = $1"
+
+# ---------------- User Stats ----------------
+# Ground truth for every user_stats column, recounted from the source tables
+USER_STATS_ACTUAL = """
+    SELECT telegram_id,
+           SUM(likes_given) AS likes_given,
+           SUM(likes_received) AS likes_received,
+           SUM(matches) AS matches,
+           SUM(reports_made) AS reports_made,
+           SUM(reports_pending_against) AS reports_pending_against
+    FROM (
+        SELECT liker_id AS telegram_id, COUNT(*) AS likes_given, 0 AS likes_received, 0 AS matches,
+               0 AS reports_made, 0 AS reports_pending_against
+        FROM swipes GROUP BY liker_id
+        UNION ALL SELECT liked_id, 0, COUNT(*), 0, 0, 0 FROM swipes GROUP BY liked_id
+        UNION ALL SELECT min_id, 0, 0, COUNT(*), 0, 0 FROM matches GROUP BY min_id
+        UNION ALL SELECT max_id, 0, 0, COUNT(*), 0, 0 FROM matches GROUP BY max_id
+        UNION ALL SELECT reporter_id, 0, 0, 0, COUNT(*), 0 FROM reports GROUP BY reporter_id
+        UNION ALL SELECT reported_id, 0, 0, 0, 0, COUNT(*) FROM reports WHERE status = 'pending' GROUP BY reported_id
+    ) c
+    GROUP BY telegram_id
+"""
+USER_STATS_COLUMNS = ('likes_given', 'likes_received', 'matches', 'reports_made', 'reports_pending_against')
+_STORED = ", ".join(f"COALESCE(s.{c}, 0)" for c in USER_STATS_COLUMNS)
+_ACTUAL = ", ".join(f"COALESCE(a.{c}, 0)" for c in USER_STATS_COLUMNS)
+# Users whose stored counters differ from the recount
+USER_STATS_DRIFT = f"""
+    WITH actual AS ({USER_STATS_ACTUAL})
+    SELECT COALESCE(a.telegram_id, s.telegram_id) AS telegram_id,
+           ROW({_STORED}) AS stored,
+           ROW({_ACTUAL}) AS actual
+    FROM actual a
+    FULL JOIN user_stats s ON s.telegram_id = a.telegram_id
+    WHERE ROW({_STORED}) IS DISTINCT FROM ROW({_ACTUAL})
+"""
+# Rewrites drifted rows with the recounted values; also the migration back-fill
+RECOUNT_USER_STATS = f"""
+    WITH actual AS ({USER_STATS_ACTUAL}),
+    drift AS (
+        SELECT COALESCE(a.telegram_id, s.telegram_id) AS telegram_id, {_ACTUAL}
+        FROM actual a
+        FULL JOIN user_stats s ON s.telegram_id = a.telegram_id
+        WHERE ROW({_STORED}) IS DISTINCT FROM ROW({_ACTUAL})
+    )
+    INSERT INTO user_stats (telegram_id, {", ".join(USER_STATS_COLUMNS)})
+    SELECT * FROM drift
+    ON CONFLICT (telegram_id) DO UPDATE SET
+        {", ".join(f"{c} = EXCLUDED.{c}" for c in USER_STATS_COLUMNS)},
+        updated_at = NOW()
+"""
@@ -0,0 +1,59 @@
+"""Check the user_stats counters against a recount from the source tables.
+
+Recounts likes given/received and matches from swipes and matches, and reports
+made/pending against from reports, then lists every user whose stored
+counters differ. With --fix the drifted rows are rewritten with the recounted
+values (the same statement migration 10 used to back-fill the table).
+
+    DATABASE_URL=postgresql://... python tools/recount_user_stats.py [--fix]
+
+Counters bumped by likes or reports that commit while --fix runs can be
+overwritten with the recount taken just before them; run it again to settle.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import queries  # noqa: E402
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_SSL = os.getenv("DATABASE_SSL", "require")
+
+
+async def main(fix, limit):
+    if not DATABASE_URL:
+        print("❌ ERROR: DATABASE_URL environment variable is required!")
+        sys.exit(1)
+
+    conn = await asyncpg.connect(
+        dsn=DATABASE_URL,
+        ssl=False if DATABASE_SSL == "disable" else DATABASE_SSL,
+        statement_cache_size=0,
+    )
+    try:
+        drift = await conn.fetch(queries.USER_STATS_DRIFT)
+        print(f"🔍 {len(drift)} users with drifted counters")
+        print(f"   columns: {', '.join(queries.USER_STATS_COLUMNS)}")
+        for row in drift[:limit]:
+            print(f"   {row['telegram_id']}: stored {tuple(row['stored'])} actual {tuple(row['actual'])}")
+        if len(drift) > limit:
+            print(f"   ... and {len(drift) - limit} more")
+
+        if fix and drift:
+            status = await conn.execute(queries.RECOUNT_USER_STATS)
+            print(f"✅ Rewrote {status.split()[-1]} rows")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fix", action="store_true", help="rewrite drifted rows with the recount")
+    parser.add_argument("--limit", type=int, default=50, help="drifted users to list")
+    args = parser.parse_args()
+    asyncio.run(main(args.fix, args.limit))